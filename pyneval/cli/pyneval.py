@@ -6,9 +6,13 @@ import pyneval
 from pyneval.io.read_swc import read_swc_trees
 from pyneval.io.read_json import read_json
 from pyneval.io.swc_writer import swc_save
+from pyneval.io import swc_cache
 from pyneval.io.read_tiff import read_tiffs
-from pyneval.metric.diadem_metric import diadem_metric
-from pyneval.metric.length_metric import length_metric
+from pyneval.metric.diadem_metric import diadem_metric, diadem_metric_bidirectional
+from pyneval.metric.length_metric import length_metric, length_metric_bidirectional, length_metric_sweep, \
+    sweep_to_str
+from pyneval.metric.utils.eval_context import EvalContext
+from pyneval.metric.utils.edge_match_utils import DEFAULT_INDEX_BACKEND
 from pyneval.metric.volume_metric import volume_metric
 from pyneval.metric.branch_leaf_metric import branch_leaf_metric
 from pyneval.metric.link_metric import link_metric
@@ -138,6 +142,33 @@ def read_parameters():
         help="print debug info or not",
         required=False
     )
+    parser.add_argument(
+        "--cache",
+        help="directory for a binary cache of parsed SWC files, files read again are loaded from it",
+        required=False
+    )
+    parser.add_argument(
+        "--sweep_rad",
+        help="length metric only: a list of rad_threshold values, output recall and precision of every "
+             "combination with --sweep_len instead of a single result",
+        required=False,
+        nargs='+',
+        type=float,
+    )
+    parser.add_argument(
+        "--sweep_len",
+        help="length metric only: a list of len_threshold values, see --sweep_rad",
+        required=False,
+        nargs='+',
+        type=float,
+    )
+    parser.add_argument(
+        "--sweep_format",
+        help="format of the sweep table of all test files, written to --output if given: csv or json",
+        required=False,
+        choices=["csv", "json"],
+        default="csv",
+    )
     return parser.parse_args()
 
 
@@ -148,7 +179,6 @@ def run(DEBUG=True):
     sys.path.append(abs_dir)
     sys.path.append(os.path.join(abs_dir, "src"))
     sys.path.append(os.path.join(abs_dir, "test"))
-    sys.setrecursionlimit(1000000)
 
     # read parameter
     try:
@@ -170,6 +200,10 @@ def run(DEBUG=True):
     if reverse is None:
         reverse = True
 
+    # cache of parsed swc files
+    if args.cache is not None:
+        swc_cache.set_cache_dir(os.path.join(abs_dir, args.cache))
+
     # metric
     metric = get_root_metric(args.metric)
     if not metric:
@@ -177,6 +211,10 @@ def run(DEBUG=True):
         print("\nValid options for --metric:\n")
         print(get_metric_summary(True))
         return 1
+    sweep = bool(args.sweep_rad or args.sweep_len)
+    if sweep and metric != "length_metric":
+        print("\nERROR: --sweep_rad and --sweep_len are only supported by length_metric, not '{}'.".format(args.metric))
+        return 1
 
     # output path
     output_dest = args.output
@@ -195,14 +233,14 @@ def run(DEBUG=True):
     except Exception:
         raise Exception("[Error: ]Error in analyzing config json file")
 
-    test_swc_trees, test_tiffs = [], []
+    test_swc_trees, test_tiffs, test_tree_names = [], [], {}
     # read test trees, gold trees and configs
     if metric in ['volume_metric', 'VM']:
         for file in test_swc_files:
             test_tiffs += read_tiffs(file)
     else:
         for file in test_swc_files:
-            test_swc_trees += read_swc_trees(file)
+            test_swc_trees += read_swc_trees(file, tree_name_dict=test_tree_names)
 
     gold_swc_trees = read_swc_trees(gold_swc_file)
 
@@ -220,17 +258,25 @@ def run(DEBUG=True):
             volume_result = volume_metric(tiff_test=test_tiff, swc_gold=gold_swc_treeroot, config=config)
             print(volume_result["recall"])
 
+    # indexes of the gold tree are built once for all test trees and both directions
+    eval_context = EvalContext(index_backend=config.get("index_backend", DEFAULT_INDEX_BACKEND))
+    # rows of the sweeps of all test trees, written once after the loop
+    sweep_res = []
     for test_swc_treeroot in test_swc_trees:
         if metric == "diadem_metric":
-            diadem_res = diadem_metric(swc_test_tree=test_swc_treeroot,
-                                       swc_gold_tree=gold_swc_treeroot,
-                                       config=config)
-            print("score = {}".format(diadem_res["final_score"]))
             if reverse:
-                rev_diadem_res = diadem_metric(swc_test_tree=gold_swc_treeroot,
-                                               swc_gold_tree=test_swc_treeroot,
-                                               config=config)
-                print("rev_score = {}".format(rev_diadem_res["final_score"]))
+                diadem_res = diadem_metric_bidirectional(swc_test_tree=test_swc_treeroot,
+                                                         swc_gold_tree=gold_swc_treeroot,
+                                                         config=config,
+                                                         context=eval_context)
+                print("score = {}".format(diadem_res["forward"]["final_score"]))
+                print("rev_score = {}".format(diadem_res["reverse"]["final_score"]))
+            else:
+                diadem_res = diadem_metric(swc_test_tree=test_swc_treeroot,
+                                           swc_gold_tree=gold_swc_treeroot,
+                                           config=config,
+                                           context=eval_context)
+                print("score = {}".format(diadem_res["final_score"]))
 
         if metric == "ssd_metric":
             ssd_res = ssd_metric.ssd_metric(gold_swc_treeroot, test_swc_treeroot, config)
@@ -240,18 +286,30 @@ def run(DEBUG=True):
                                            round(ssd_res["recall"] * 100, 2),
                                            round(ssd_res["precision"] * 100, 2)))
 
-        if metric == "length_metric":
-            lm_res = length_metric(gold_swc_treeroot, test_swc_treeroot, config)
-            print("Recall = {} Precision = {}".format(lm_res["recall"], lm_res["precision"]))
+        if metric == "length_metric" and sweep:
+            test_name = test_tree_names[test_swc_treeroot]
+            sweep_res += [dict(test=test_name, reverse=False, **row) for row in
+                          length_metric_sweep(gold_swc_treeroot, test_swc_treeroot, config,
+                                              rad_thresholds=args.sweep_rad, len_thresholds=args.sweep_len,
+                                              context=eval_context)]
+            if reverse:
+                sweep_res += [dict(test=test_name, reverse=True, **row) for row in
+                              length_metric_sweep(test_swc_treeroot, gold_swc_treeroot, config,
+                                                  rad_thresholds=args.sweep_rad, len_thresholds=args.sweep_len,
+                                                  context=eval_context)]
+        elif metric == "length_metric":
+            if reverse:
+                lm_res = length_metric_bidirectional(gold_swc_treeroot, test_swc_treeroot, config,
+                                                     context=eval_context)
+                for res in (lm_res["forward"], lm_res["reverse"]):
+                    print("Recall = {} Precision = {}".format(res["recall"], res["precision"]))
+            else:
+                lm_res = length_metric(gold_swc_treeroot, test_swc_treeroot, config, context=eval_context)
+                print("Recall = {} Precision = {}".format(lm_res["recall"], lm_res["precision"]))
 
             if output_dest:
                 swc_save(test_swc_treeroot, output_dest)
-            if reverse:
-                if "detail" in config:
-                    config["detail"] = config["detail"][:-4] + "_reverse.swc"
-                lm_res = length_metric(test_swc_treeroot, gold_swc_treeroot, config)
-                print("Recall = {} Precision = {}".format(lm_res["recall"], lm_res["precision"]))
-                if output_dest:
+                if reverse:
                     swc_save(gold_swc_treeroot, output_dest[:-4]+"_reverse.swc")
         if metric == "branch_metric":
             branch_res = branch_leaf_metric(gold_swc_tree=gold_swc_treeroot,
@@ -286,6 +344,14 @@ def run(DEBUG=True):
                   "tree_dis_loss = {}\n".format(link_res["edge_loss"], link_res["tree_dis_loss"]))
             print("---------------End---------------")
 
+    if sweep:
+        sweep_str = sweep_to_str(sweep_res, out_format=args.sweep_format)
+        if output_dest:
+            with open(output_dest, 'w') as f:
+                f.write(sweep_str)
+        else:
+            print(sweep_str)
+
 
 if __name__ == "__main__":
     sys.exit(run())
@@ -61,7 +61,6 @@ def run():
     sys.path.append(abs_dir)
     sys.path.append(os.path.join(abs_dir, "src"))
     sys.path.append(os.path.join(abs_dir, "test"))
-    sys.setrecursionlimit(1000000)
 
     # read parameter
     args = read_parameters()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# binary cache of parsed swc files, disabled unless a cache directory is given.
+# every cached file is a folder of raw .npy columns, so a warm start memory-maps
+# the arrays and skips text parsing.
+CACHE_DIR_ENV = "PYNEVAL_CACHE_DIR"
+CACHE_KEY_ENV = "PYNEVAL_CACHE_KEY"
+CACHE_VERSION = 1
+COLUMNS = ("ids", "types", "xyz", "radii", "parent_index", "depths", "root_lengths")
+
+_cache_dir = None
+_key_mode = None
+
+
+def set_cache_dir(cache_dir, key_mode="stat"):
+    """
+    enable the cache for all later SwcTree.load calls, None disables it again
+    key_mode: "stat" keys a file by path, size and mtime, "hash" by the sha1 of its content
+    """
+    global _cache_dir, _key_mode
+    if key_mode not in ("stat", "hash"):
+        raise Exception("[Error: swc_cache]Unknown key mode {}".format(key_mode))
+    _cache_dir = cache_dir
+    _key_mode = key_mode
+
+
+def get_cache_dir():
+    if _cache_dir is not None:
+        return _cache_dir
+    return os.environ.get(CACHE_DIR_ENV)
+
+
+def get_key_mode():
+    if _key_mode is not None:
+        return _key_mode
+    return os.environ.get(CACHE_KEY_ENV, "stat")
+
+
+def cache_key(path, key_mode="stat"):
+    h = hashlib.sha1("v{}".format(CACHE_VERSION).encode())
+    if key_mode == "hash":
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                h.update(block)
+    else:
+        st = os.stat(path)
+        h.update("{}|{}|{}".format(os.path.abspath(path), st.st_size, st.st_mtime_ns).encode())
+    return h.hexdigest()
+
+
+def load_columns(path, cache_dir, key_mode="stat"):
+    """
+    return a dict of the cached columns of "path" or None if it is not cached.
+    arrays are memory-mapped copy-on-write, writing to them never changes the cache.
+    """
+    entry = os.path.join(cache_dir, cache_key(path, key_mode))
+    if not os.path.isdir(entry):
+        return None
+    try:
+        return {col: np.load(os.path.join(entry, col + ".npy"), mmap_mode='c') for col in COLUMNS}
+    except (OSError, ValueError):
+        return None
+
+
+def save_columns(path, columns, cache_dir, key_mode="stat"):
+    """write the columns of "path" to the cache, a concurrent writer of the same entry is harmless"""
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, cache_key(path, key_mode))
+    if os.path.isdir(entry):
+        return
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        for col in COLUMNS:
+            np.save(os.path.join(tmp_dir, col + ".npy"), np.ascontiguousarray(columns[col]))
+        os.rename(tmp_dir, entry)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
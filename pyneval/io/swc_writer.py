@@ -62,3 +62,12 @@ def swc_save(swc_tree, out_path):
                 ))
             except:
                 continue
+
+
+def swc_str_save(swc_str_list, out_path):
+    # lines which are already in swc format, e.g. EdgeMatches.to_swc_list
+    if not is_path_valid(out_path):
+        return False
+    with open(out_path, 'w') as f:
+        f.truncate()
+        f.writelines(swc_str_list)
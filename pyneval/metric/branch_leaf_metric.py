@@ -1,4 +1,3 @@
-import sys
 
 from pyneval.model.swc_node import SwcTree
 from pyneval.metric.utils.km_utils import KM, get_dis_graph
@@ -166,7 +165,6 @@ def branch_leaf_metric(gold_swc_tree, test_swc_tree, config):
 
 
 if __name__ == "__main__":
-    sys.setrecursionlimit(1000000)
     file_name = "fake_data11"
     gold_swc_tree = SwcTree()
     test_swc_tree = SwcTree()
@@ -1,9 +1,8 @@
 import os
-import queue
 import time
 import math
 import numpy as np
-from anytree import PreOrderIter
+from pyneval.model.traversal import pre_order
 from pyneval.metric.utils import config_utils
 from pyneval.io import read_config
 from pyneval.model.binary_node import RIGHT
@@ -18,6 +17,7 @@ from pyneval.io.read_json import read_json
 from pyneval.io.swc_writer import swc_save
 from pyneval.io.read_swc import adjust_swcfile
 from pyneval.metric.utils import point_match_utils
+from pyneval.metric.utils.eval_context import EvalContext
 import jsonschema
 
 
@@ -63,16 +63,16 @@ def remove_spurs(bin_root, threshold):
     spur_set = set()
     both_children_spur = False
 
-    stack = queue.LifoQueue()
+    stack = []
 
     if bin_root.has_children:
-        stack.put(bin_root)
+        stack.append(bin_root)
 
-    while not stack.empty():
-        node = stack.get()
+    while stack:
+        node = stack.pop()
         if node.has_children():
-            stack.put(node.left_son)
-            stack.put(node.right_son)
+            stack.append(node.left_son)
+            stack.append(node.right_son)
         else:
             distance = node.data.path_length
             if distance < threshold and not (node in g_matches):
@@ -85,7 +85,7 @@ def remove_spurs(bin_root, threshold):
                             not l_node in g_matches:
                         both_children_spur = True
                         spur_set.add(l_node)
-                        ll_node = stack.get()
+                        ll_node = stack.pop()
                         if ll_node != l_node:
                             raise Exception("[Error:  ] stack top is not current node's twin")
 
@@ -95,25 +95,25 @@ def remove_spurs(bin_root, threshold):
 
 
 def generate_node_weights(bin_root, bin_subroot, spur_set, DEBUG=False):
-    init_stack = queue.LifoQueue()
-    main_stack = queue.LifoQueue()
+    init_stack = []
+    main_stack = []
     degree_dict = {}
     global g_weight_dict
     degree = 0
     for subroot in bin_subroot:
-        init_stack.put(subroot)
-        main_stack.put(subroot)
+        init_stack.append(subroot)
+        main_stack.append(subroot)
 
-        while not init_stack.empty():
-            node = init_stack.get()
+        while init_stack:
+            node = init_stack.pop()
             if node.has_children():
-                init_stack.put(node.left_son)
-                init_stack.put(node.right_son)
-                main_stack.put(node.left_son)
-                main_stack.put(node.right_son)
+                init_stack.append(node.left_son)
+                init_stack.append(node.right_son)
+                main_stack.append(node.left_son)
+                main_stack.append(node.right_son)
 
-        while not main_stack.empty():
-            node = main_stack.get()
+        while main_stack:
+            node = main_stack.pop()
 
             if g_weight_node == WEIGHT_UNIFORM:
                 g_weight_dict[node] = 1
@@ -319,10 +319,10 @@ def get_des_in_for_continuation(first_node, ancestor_node, ancestor_match,
     spe_ancestor_trajectory = ancestor_trajectory
     test_matches = []
 
-    stack = queue.LifoQueue()
-    stack.put(first_node)
-    while not stack.empty():
-        gold_node = stack.get()
+    stack = []
+    stack.append(first_node)
+    while stack:
+        gold_node = stack.pop()
         des_tra = gold_node.data.parent_trajectory
         # print("gold_node id = {}".format(gold_node.data.get_id()))
         if gold_node in g_matches:
@@ -382,8 +382,8 @@ def get_des_in_for_continuation(first_node, ancestor_node, ancestor_match,
                     return child_match
 
         if gold_node.has_children() and gold_node not in g_matches:
-            stack.put(gold_node.left_son)
-            stack.put(gold_node.right_son)
+            stack.append(gold_node.left_son)
+            stack.append(gold_node.right_son)
 
     return None
 
@@ -505,27 +505,27 @@ def weight_excess(bin_gold_subroot, bin_test_subroot, DEBUG=False):
 
     sum_weight = 0.0
     gold_bin_list = []
-    setup_stack = queue.LifoQueue()
-    use_stack = queue.LifoQueue()
+    setup_stack = []
+    use_stack = []
 
     for son in bin_gold_subroot:
         gold_bin_list.extend(son.get_node_list())
 
     for son in bin_test_subroot:
-        setup_stack.put(son)
-        use_stack.put(son)
-        while not setup_stack.empty():
-            node = setup_stack.get()
+        setup_stack.append(son)
+        use_stack.append(son)
+        while setup_stack:
+            node = setup_stack.pop()
             if node.has_children():
-                setup_stack.put(node.left_son)
-                setup_stack.put(node.right_son)
-                use_stack.put(node.left_son)
-                use_stack.put(node.right_son)
+                setup_stack.append(node.left_son)
+                setup_stack.append(node.right_son)
+                use_stack.append(node.left_son)
+                use_stack.append(node.right_son)
 
         direct_term_excess = {}
 
-        while not use_stack.empty():
-            node = use_stack.get()
+        while use_stack:
+            node = use_stack.pop()
             data = node.data
             # if data.get_id()
             if DEBUG:
@@ -575,7 +575,7 @@ def score_trees(bin_gold_root, bin_test_root, bin_gold_subroots, bin_test_subroo
     global g_direct_match_score
     global g_quantity_score
 
-    stack = queue.LifoQueue()
+    stack = []
     number_of_nodes = 0
     weight = 0
 
@@ -609,10 +609,10 @@ def score_trees(bin_gold_root, bin_test_root, bin_gold_subroots, bin_test_subroo
     number_of_nodes += len(bin_gold_list)
 
     for gold_subroot in bin_gold_subroots:
-        stack.put(gold_subroot)
+        stack.append(gold_subroot)
 
-        while not stack.empty():
-            gold_node = stack.get()
+        while stack:
+            gold_node = stack.pop()
             gold_data = gold_node.data
             if DEBUG:
                 print(gold_node.data.get_id())
@@ -620,8 +620,8 @@ def score_trees(bin_gold_root, bin_test_root, bin_gold_subroots, bin_test_subroo
                     print("line:616")
 
             if gold_node.has_children():
-                stack.put(gold_node.left_son)
-                stack.put(gold_node.right_son)
+                stack.append(gold_node.left_son)
+                stack.append(gold_node.right_son)
 
             if gold_node in g_spur_set:
                 pass
@@ -839,38 +839,45 @@ def diadem_init():
 
 
 def adjust_root(swc_gold_tree, swc_test_tree,
-                test_kdtree, test_pos_node_dict, t_matches):
+                test_index, test_nodes, t_matches):
     swc_gold_list = swc_gold_tree.get_node_list()
     swc_test_list = swc_test_tree.get_node_list()
+    # re-rooting does not move nodes, so the closest test nodes of all gold nodes are queried at once
+    gold_nodes = [node for node in swc_gold_list if not node.is_virtual()]
+    nearest, _ = test_index.knn([node.get_center()._pos for node in gold_nodes], k=5)
+    nearest = dict(zip(gold_nodes, nearest.tolist()))
 
-    gold_vis_list = np.zeros(shape=(len(swc_gold_list) + 10,))
-    test_vis_list = np.zeros(shape=(len(swc_test_list) + 10,))
+    # indexed by the dense node index, not by the swc id
+    gold_vis_list = np.zeros(shape=(swc_gold_tree.index_size() + 1,))
+    test_vis_list = np.zeros(shape=(swc_test_tree.index_size() + 1,))
 
     for node in swc_gold_list:
         if node.is_virtual():
             continue
         nearby_nodes = get_nearby_swc_node_list(gold_node=node, threshold=node.radius() / 2,
-                                                test_kdtree=test_kdtree, test_pos_node_dict=test_pos_node_dict)
+                                                test_index=test_index, test_nodes=test_nodes,
+                                                nearest=nearest[node])
         for t_node in nearby_nodes:
-            if not gold_vis_list[node.get_id()] and not test_vis_list[t_node.get_id()]:
+            if not gold_vis_list[node.get_index()] and not test_vis_list[t_node.get_index()]:
                 t_matches[node] = t_node
                 swc_gold_tree.change_root(node.get_id())
                 swc_test_tree.change_root(t_node.get_id())
 
-                for sub_node in PreOrderIter(node):
-                    gold_vis_list[sub_node.get_id()] = 1
-                for sub_node in PreOrderIter(t_node):
-                    test_vis_list[sub_node.get_id()] = 1
+                for sub_node in pre_order(node):
+                    gold_vis_list[sub_node.get_index()] = 1
+                for sub_node in pre_order(t_node):
+                    test_vis_list[sub_node.get_index()] = 1
                 break
 
 
-def diadem_metric(swc_gold_tree, swc_test_tree, config):
+def diadem_metric(swc_gold_tree, swc_test_tree, config, context=None):
     """Main function of diadem metric
     Args:
         swc_gold_tree(SwcTree):
         swc_test_tree(SwcTree):
         config(Dict):
             The keys of 'config' is the name of configs, and the items are config values
+        context(EvalContext): optional, keeps the node index of the test tree for later runs on it
 
     Example:
         test_tree = swc_node.SwcTree()
@@ -899,13 +906,16 @@ def diadem_metric(swc_gold_tree, swc_test_tree, config):
     # initialize diadem configs
     config_init(config)
 
-    test_kdtree, test_pos_node_dict = point_match_utils.create_kdtree(swc_test_tree.get_node_list())
+    if context is None:
+        test_index, test_nodes = point_match_utils.create_node_index(swc_test_tree.get_node_list())
+    else:
+        test_index, test_nodes = context.get_node_index(swc_test_tree)
 
     t_matches = {}
     debug = False
     if g_find_proper_root:
         adjust_root(swc_gold_tree=swc_gold_tree, swc_test_tree=swc_test_tree,
-                    test_kdtree=test_kdtree, test_pos_node_dict=test_pos_node_dict,
+                    test_index=test_index, test_nodes=test_nodes,
                     t_matches=t_matches)
     if g_align_tree_by_root:
         swc_test_tree.align_roots(swc_gold_tree, t_matches)
@@ -950,6 +960,21 @@ def diadem_metric(swc_gold_tree, swc_test_tree, config):
     return res
 
 
+def diadem_metric_bidirectional(swc_gold_tree, swc_test_tree, config, context=None):
+    """diadem metric of the test tree against the gold tree (forward) and the other way round (reverse)
+    Args: Same as func:diadem_metric, both runs share the node indexes of "context", a new one if None
+
+    Return:
+        result(Dict): forward and reverse, the results of the two diadem_metric runs
+    """
+    if context is None:
+        context = EvalContext()
+    return {
+        "forward": diadem_metric(swc_gold_tree, swc_test_tree, config, context=context),
+        "reverse": diadem_metric(swc_test_tree, swc_gold_tree, config, context=context)
+    }
+
+
 def pyneval_diadem_metric(gold_swc, test_swc, config):
     """ interface to webmets, which is a web visualization project abandoned now
     Args: Same as func:diadem_metric
@@ -1,28 +1,35 @@
-import sys
 import jsonschema
+import json
 
 from pyneval.model.swc_node import SwcTree
-from pyneval.metric.utils.edge_match_utils import get_match_edges
+from pyneval.metric.utils.edge_match_utils import get_match_edges, get_nearby_edge_cache, EdgeMatches, \
+    DEFAULT_INDEX_BACKEND
+from pyneval.metric.utils.eval_context import EvalContext
 from pyneval.io.read_json import read_json
 from pyneval.io.read_swc import adjust_swcfile
 from pyneval.io.read_config import read_float_config, read_path_config, read_bool_config
-from pyneval.io.swc_writer import swc_save
+from pyneval.io.swc_writer import swc_save, swc_str_save
 
 
 def length_metric_run(gold_swc_tree=None, test_swc_tree=None,
-                      rad_threshold=-1.0, len_threshold=0.2, debug=False):
+                      rad_threshold=-1.0, len_threshold=0.2, index_backend=DEFAULT_INDEX_BACKEND, workers=1,
+                      nearby_edge_cache=None, debug=False):
     """
     Description: Detail of length metric, get best edge for each edge and calculate final scores
     Input: gold/test swc tree, and parsed configs
-    Output: recall(int), precision(int) and vertical Auxiliary line between swc trees
+    Output: recall(int), precision(int) and EdgeMatches, the matched edges of both trees
+        (EdgeMatches.to_swc_list renders the auxiliary lines between the trees)
     """
-    vertical_tree = []
+    edge_matches = EdgeMatches(gold_swc_tree)
 
     match_edges, test_match_length = get_match_edges(gold_swc_tree=gold_swc_tree,
                                                      test_swc_tree=test_swc_tree,  # tree data
-                                                     vertical_tree=vertical_tree,  # a empty Auxiliary line tree
+                                                     edge_matches=edge_matches,  # records every match
                                                      rad_threshold=rad_threshold,
                                                      len_threshold=len_threshold,
+                                                     index_backend=index_backend,
+                                                     workers=workers,
+                                                     nearby_edge_cache=nearby_edge_cache,
                                                      debug=debug)  # configs
 
     match_length = 0.0
@@ -48,14 +55,15 @@ def length_metric_run(gold_swc_tree=None, test_swc_tree=None,
     else:
         precision = 0
 
-    return min(recall, 1.0), min(precision, 1.0), vertical_tree
+    return min(recall, 1.0), min(precision, 1.0), edge_matches
 
 
 # @do_cprofile("./mkm_run.prof")
-def length_metric(gold_swc_tree, test_swc_tree, config):
+def length_metric(gold_swc_tree, test_swc_tree, config, context=None):
     """
     Description: Main function of length metric, parse configs and preprocess data
-    Input: gold/test swc tree, config
+    Input: gold/test swc tree, config, context(EvalContext, optional) which keeps the edge indexes
+        of the trees for later runs on them
     Output: recall(int) and precision(int)
     """
     # read config
@@ -63,19 +71,29 @@ def length_metric(gold_swc_tree, test_swc_tree, config):
     rad_threshold = config["rad_threshold"]
     len_threshold = config["len_threshold"]
     debug = config["debug"]
+    index_backend = config.get("index_backend", DEFAULT_INDEX_BACKEND)
+    workers = config.get("workers", 1)
 
     if rad_mode == 1:
         rad_threshold *= -1
+    nearby_edge_cache = None
+    if context is not None:
+        nearby_edge_cache = get_nearby_edge_cache(gold_swc_tree, test_swc_tree, rad_threshold=rad_threshold,
+                                                  context=context)
     # check every edge in test, if it is overlap with any edge in gold three
-    recall, precision, vertical_tree = length_metric_run(gold_swc_tree=gold_swc_tree,
+    recall, precision, edge_matches = length_metric_run(gold_swc_tree=gold_swc_tree,
                                                          test_swc_tree=test_swc_tree,
                                                          rad_threshold=rad_threshold,
                                                          len_threshold=len_threshold,
+                                                         index_backend=index_backend,
+                                                         workers=workers,
+                                                         nearby_edge_cache=nearby_edge_cache,
                                                          debug=debug)
 
     if "detail_path" in config:
         swc_save(gold_swc_tree, config["detail_path"][:-4]+"_gold.swc")
         swc_save(test_swc_tree, config["detail_path"][:-4]+"_test.swc")
+        swc_str_save(edge_matches.to_swc_list(), config["detail_path"][:-4]+"_vertical.swc")
     if debug:
         print("Recall = {}, Precision = {}".format(recall, precision))
 
@@ -86,6 +104,89 @@ def length_metric(gold_swc_tree, test_swc_tree, config):
     return res
 
 
+def length_metric_bidirectional(gold_swc_tree, test_swc_tree, config, context=None):
+    """
+    Description: length metric of gold against test (forward) and of test against gold (reverse).
+        both runs take the edge indexes and path indexes of the trees from one EvalContext,
+        so every structure of a tree is built once, pass the same context to evaluate more trees against gold
+    Input: gold/test swc tree, config (as length_metric, a detail_path of the reverse run ends with _reverse),
+        context(EvalContext, optional)
+    Output: dict(forward=result of length_metric, reverse=result with gold and test swapped)
+    """
+    if context is None:
+        context = EvalContext(index_backend=config.get("index_backend", DEFAULT_INDEX_BACKEND))
+    rev_config = dict(config)
+    if "detail_path" in config:
+        rev_config["detail_path"] = config["detail_path"][:-4] + "_reverse.swc"
+
+    return {
+        "forward": length_metric(gold_swc_tree, test_swc_tree, config, context=context),
+        "reverse": length_metric(test_swc_tree, gold_swc_tree, rev_config, context=context)
+    }
+
+
+def length_metric_sweep(gold_swc_tree, test_swc_tree, config, rad_thresholds=None, len_thresholds=None,
+                        context=None):
+    """
+    Description: length metric on every grid point of rad_thresholds x len_thresholds, a precision/recall curve.
+        the test edge index and the nearby edge lists are built once with the loosest rad_threshold,
+        every grid point reuses them and only runs the matching again
+    Input: gold/test swc tree, config (as length_metric), lists of thresholds, default: the value in config,
+        context(EvalContext, optional)
+    Output: list of dict(rad_threshold, len_threshold, recall, precision), rad_threshold is the outer loop
+    """
+    rad_mode = config["rad_mode"]
+    debug = config["debug"]
+    index_backend = config.get("index_backend", DEFAULT_INDEX_BACKEND)
+    workers = config.get("workers", 1)
+    if rad_thresholds is None:
+        rad_thresholds = [config["rad_threshold"]]
+    if len_thresholds is None:
+        len_thresholds = [config["len_threshold"]]
+
+    sign = -1 if rad_mode == 1 else 1
+    nearby_edge_cache = get_nearby_edge_cache(gold_swc_tree, test_swc_tree,
+                                              rad_threshold=sign * max(rad_thresholds),
+                                              index_backend=index_backend, context=context)
+
+    res = []
+    for rad_threshold in rad_thresholds:
+        for len_threshold in len_thresholds:
+            recall, precision, _ = length_metric_run(gold_swc_tree=gold_swc_tree,
+                                                     test_swc_tree=test_swc_tree,
+                                                     rad_threshold=sign * rad_threshold,
+                                                     len_threshold=len_threshold,
+                                                     index_backend=index_backend,
+                                                     workers=workers,
+                                                     nearby_edge_cache=nearby_edge_cache,
+                                                     debug=debug)
+            res.append({
+                "rad_threshold": rad_threshold,
+                "len_threshold": len_threshold,
+                "recall": recall,
+                "precision": precision
+            })
+    return res
+
+
+def sweep_to_str(sweep_res, out_format="csv"):
+    """
+    Description: text of the output of length_metric_sweep
+    Input: list of dicts with the same keys, out_format "csv" (one header line) or "json"
+    """
+    if out_format == "json":
+        return json.dumps(sweep_res, indent=2)
+    if out_format != "csv":
+        raise Exception("[Error: ] unknown sweep format {}".format(out_format))
+    if len(sweep_res) == 0:
+        return ""
+    keys = list(sweep_res[0].keys())
+    lines = [",".join(keys)]
+    for row in sweep_res:
+        lines.append(",".join(str(row[key]) for key in keys))
+    return "\n".join(lines) + "\n"
+
+
 # length metric interface connect to webmets
 def pyneval_length_metric(gold_swc, test_swc, method, rad_threshold, len_threshold):
     gold_tree = SwcTree()
@@ -94,22 +195,20 @@ def pyneval_length_metric(gold_swc, test_swc, method, rad_threshold, len_thresho
     gold_tree.load_list(adjust_swcfile(gold_swc))
     test_tree.load_list(adjust_swcfile(test_swc))
 
-    config = {
-        'method': method,
-        'len_threshold': len_threshold,
-        'rad_threshold': rad_threshold
-    }
-
-    lm_res = length_metric(gold_swc_tree=gold_tree,
-                           test_swc_tree=test_tree,
-                           config=config)
+    # method is the rad_mode of the config, 1: rad_threshold is relative to the radius of the gold node
+    if method == 1:
+        rad_threshold *= -1
+    recall, precision, edge_matches = length_metric_run(gold_swc_tree=gold_tree,
+                                                        test_swc_tree=test_tree,
+                                                        rad_threshold=rad_threshold,
+                                                        len_threshold=len_threshold)
 
     result = {
-        'recall': lm_res[0],
-        'precision': lm_res[1],
+        'recall': recall,
+        'precision': precision,
         'gold_swc': gold_tree.to_str_list(),
         'test_swc': test_tree.to_str_list(),
-        'vertical_swc': lm_res[2]
+        'vertical_swc': edge_matches.to_swc_list()
     }
     return result
 
@@ -117,7 +216,6 @@ def pyneval_length_metric(gold_swc, test_swc, method, rad_threshold, len_thresho
 if __name__ == "__main__":
     goldTree = SwcTree()
     testTree = SwcTree()
-    sys.setrecursionlimit(10000000)
     goldTree.load("..\\..\\data\\test_data\\geo_metric_data\\gold_34_23_10.swc")
     testTree.load("..\\..\\data\\test_data\\geo_metric_data\\test_34_23_10.swc")
 
@@ -1,4 +1,3 @@
-import sys
 import time
 import jsonschema
 
@@ -88,7 +87,6 @@ def link_metric(gold_swc_tree, test_swc_tree, config):
 
 
 if __name__ == "__main__":
-    sys.setrecursionlimit(1000000)
     start = time.time()
     gold_swc_tree = SwcTree()
     test_swc_tree = SwcTree()
@@ -16,17 +16,24 @@ Attributes:
 Todos:
     None
 """
-import sys
 
 import jsonschema
+import numpy as np
 
 from pyneval.io import swc_writer
 from pyneval.model import swc_node
 from pyneval.io import read_json
 from pyneval.tools import re_sample
 from pyneval.metric.utils import point_match_utils
+from pyneval.metric.utils.segment_distance import SegmentDistanceIndex, get_tree_segments, iter_edge_samples
 from pyneval.io import read_config
 
+# "up_sample": distances between the nodes of up sampled trees, "analytic": distances from samples on the edges
+# to the closest edge of the other tree
+SSD_ENGINES = ("up_sample", "analytic")
+DEFAULT_SSD_ENGINE = "up_sample"
+DEFAULT_SAMPLE_STEP = 1.0
+
 
 def get_mse(src_tree, tar_tree, ssd_threshold=2.0, mode=1):
     """ calculate the minimum square error of two trees
@@ -50,12 +57,14 @@ def get_mse(src_tree, tar_tree, ssd_threshold=2.0, mode=1):
         None
     """
     dis, num = 0, 0
-    kdtree, pos_node_dict = point_match_utils.create_kdtree(tar_tree.get_node_list())
-    for node in src_tree.get_node_list():
-        if node.is_virtual():
+    tar_index, tar_nodes = point_match_utils.create_node_index(tar_tree.get_node_list())
+    src_nodes = [node for node in src_tree.get_node_list() if not node.is_virtual()]
+    nearest, _ = tar_index.knn([node.get_center()._pos for node in src_nodes], k=1)
+    for node, target in zip(src_nodes, nearest[:, 0].tolist()):
+        # an empty target tree has no closest node
+        if target < 0:
             continue
-        target_pos = kdtree.search_knn(list(node.get_center_as_tuple()), k=1)[0]
-        target_node = pos_node_dict[tuple(target_pos[0].data)]
+        target_node = tar_nodes[target]
 
         cur_dis = target_node.distance(node)
 
@@ -75,13 +84,93 @@ def get_mse(src_tree, tar_tree, ssd_threshold=2.0, mode=1):
     return dis, num
 
 
+def get_mse_analytic(src_tree, tar_tree, ssd_threshold=2.0, mode=1, sample_step=1.0, tar_index=None):
+    """ get_mse measured on the edges instead of the nodes of up sampled trees
+    samples along the edges of src_tree (see iter_edge_samples) are generated chunk by chunk, the distance of a sample
+    is its exact distance to the closest edge of tar_tree.
+
+    Args:
+        src_tree(SwcTree): all rows are used, use get_copy first to drop unlinked nodes
+        tar_tree(SwcTree): as src_tree
+        ssd_threshold(float): as get_mse
+        mode(1 or 2): as get_mse, the radius of a sample is interpolated along its edge
+        sample_step(float): the largest distance between two samples on an edge
+        tar_index(SegmentDistanceIndex): index of the edges of tar_tree, built if not given
+
+    Returns:
+        dis(float): as get_mse
+        num(int): as get_mse
+        sample_num(int): number of samples
+        far_rows(list): rows of the nodes of src_tree which are counted into dis
+    """
+    if tar_index is None:
+        tar_index = SegmentDistanceIndex(*get_tree_segments(tar_tree))
+    dis, num, sample_num, far_rows = 0, 0, 0, []
+    for points, radii, rows in iter_edge_samples(src_tree, sample_step):
+        sample_num += len(points)
+        cur_dis, _ = tar_index.nearest(points)
+        threshold = ssd_threshold if mode == 1 else ssd_threshold * radii
+        # an empty target tree has no closest edge
+        far = np.isfinite(cur_dis) & (cur_dis >= threshold)
+        dis += float(cur_dis[far].sum())
+        num += int(far.sum())
+        far_rows += rows[far & (rows >= 0)].tolist()
+    try:
+        dis /= num
+    except ZeroDivisionError:
+        dis = num = 0
+    return dis, num, sample_num, far_rows
+
+
+def ssd_metric_analytic(gold_swc_tree, test_swc_tree, config):
+    """ssd_metric with the "analytic" engine, the trees are not up sampled"""
+    debug = config["debug"]
+    threshold_mode = config["threshold_mode"]
+    ssd_threshold = config["ssd_threshold"]
+    sample_step = config.get("sample_step", DEFAULT_SAMPLE_STEP)
+
+    c_gold_swc_tree = gold_swc_tree.get_copy()
+    c_test_swc_tree = test_swc_tree.get_copy()
+    g2t_score, g2t_num, gold_sample_num, gold_far_rows = get_mse_analytic(
+        src_tree=c_gold_swc_tree, tar_tree=c_test_swc_tree, ssd_threshold=ssd_threshold, mode=threshold_mode,
+        sample_step=sample_step)
+    t2g_score, t2g_num, test_sample_num, test_far_rows = get_mse_analytic(
+        src_tree=c_test_swc_tree, tar_tree=c_gold_swc_tree, ssd_threshold=ssd_threshold, mode=threshold_mode,
+        sample_step=sample_step)
+
+    if "detail_path" in config:
+        # the nodes of the trees, typed as in the up sampled trees
+        for swc_tree, root_id, far_rows, suffix in ((c_gold_swc_tree, 1, gold_far_rows, "_gold_sampled.swc"),
+                                                    (c_test_swc_tree, 5, test_far_rows, "_test_sampled.swc")):
+            swc_tree.set_node_type_by_topo(root_id=root_id)
+            far_rows = set(far_rows)
+            for node in swc_tree.get_node_list():
+                if not node.is_virtual() and node.get_index() in far_rows:
+                    node._type = 9
+            swc_writer.swc_save(swc_tree, config["detail_path"][:-4] + suffix)
+
+    if debug:
+        print("recall_num = {}, pre_num = {}, gold_sample_num = {}, test_sample_num = {} {} {}".format(
+            g2t_num, t2g_num, gold_sample_num, test_sample_num, gold_swc_tree.length(), test_swc_tree.length()
+        ))
+
+    res = {
+        "avg_score": (g2t_score + t2g_score) / 2,
+        "recall": 1 - g2t_num/gold_sample_num if gold_sample_num else 1,
+        "precision": 1 - t2g_num/test_sample_num if test_sample_num else 1
+    }
+    return res
+
+
 def ssd_metric(gold_swc_tree: swc_node.SwcTree, test_swc_tree: swc_node.SwcTree, config: dict):
     """Main function of SSD metric.
     Args:
         gold_swc_tree(SwcTree):
         test_swc_tree(SwcTree):
         config(Dict):
-            The keys of 'config' is the name of configs, and the items are config values
+            The keys of 'config' is the name of configs, and the items are config values.
+            "engine" (optional, one of SSD_ENGINES, default "up_sample"): "analytic" keeps the edges of the
+            trees and samples them every "sample_step" (optional, default DEFAULT_SAMPLE_STEP), see get_mse_analytic
     Example:
         test_tree = swc_node.SwcTree()
         gold_tree = swc_node.SwcTree()
@@ -99,6 +188,12 @@ def ssd_metric(gold_swc_tree: swc_node.SwcTree, test_swc_tree: swc_node.SwcTree,
     Raises:
         None
     """
+    engine = config.get("engine", DEFAULT_SSD_ENGINE)
+    if engine == "analytic":
+        return ssd_metric_analytic(gold_swc_tree, test_swc_tree, config)
+    if engine != "up_sample":
+        raise Exception("[Error: ]Unknown ssd engine {}, expect one of {}".format(engine, SSD_ENGINES))
+
     debug = config["debug"]
     threshold_mode = config["threshold_mode"]
     ssd_threshold = config["ssd_threshold"]
@@ -140,7 +235,6 @@ if __name__ == "__main__":
     test_tree = swc_node.SwcTree()
     gold_tree = swc_node.SwcTree()
 
-    sys.setrecursionlimit(10000000)
     gold_tree.load("..\\..\\data\\test_data\\geo_metric_data\\gold_34_23_10.swc")
     test_tree.load("..\\..\\data\\test_data\\geo_metric_data\\test_34_23_10.swc")
 
@@ -4,7 +4,6 @@ from pyneval.model.binary_node import BinaryNode
 
 import copy
 import math
-import queue
 
 _3D = "3d"
 _2D = "2d"
@@ -15,21 +14,28 @@ LEFT = 'left'
 DEFULT = 'DEFULT'
 
 
-# recurrently convert a swcnode tree into a binary tree
+# convert a swcnode tree into a binary tree, children are converted before their parents
 # input: root of a swcnode tree
 # return: root of a binary tree
 def swctree_to_binarytree(node):
+    binary_nodes = {}
+    stack = [(node, False)]
+    while stack:
+        cur, sons_done = stack.pop()
+        if not sons_done:
+            stack.append((cur, True))
+            for son_node in reversed(cur.children):
+                stack.append((son_node, False))
+            continue
+        binnary_son_list = [binary_nodes.pop(son_node) for son_node in cur.children]
+        binary_nodes[cur] = merge_binary_sons(cur, binnary_son_list)
+    return binary_nodes[node]
+
+
+# the nodes in binnary_son_list are the roots of the binary trees of node's children
+def merge_binary_sons(node, binnary_son_list):
     binary_root = BinaryNode(data=node)
 
-    # the nodes in this list is the root of a binary tree
-    binnary_son_list = []
-    son = list(node.children)
-
-    for son_node in son:
-        # print(type(son_node))
-        binnary_node = swctree_to_binarytree(son_node)
-        binnary_son_list.append(binnary_node)
-
     while len(binnary_son_list) > 2:
         best1 = binnary_son_list[0]
         best2 = binnary_son_list[1]
@@ -58,20 +64,31 @@ def swctree_to_binarytree(node):
 
 
 def re_arrange(bin_node, hight=1, parent=None, side=DEFULT):
+    # pre-order: hight and side come from the parent
     bin_node.hight = hight
-    bin_node.parent = parent
     bin_node.side = side
-    bin_node.max_dep = 1
-    bin_node.treesize = 1
-    if bin_node.left_son is not None:
-        re_arrange(bin_node=bin_node.left_son, hight=hight+1, parent=bin_node, side=LEFT)
-        bin_node.max_dep = max(bin_node.max_dep, bin_node.left_son.max_dep + 1)
-        bin_node.treesize += bin_node.left_son.treesize
-
-    if bin_node.right_son is not None:
-        re_arrange(bin_node=bin_node.right_son, hight=hight+1, parent=bin_node,side=RIGHT)
-        bin_node.max_dep = max(bin_node.max_dep, bin_node.right_son.max_dep + 1)
-        bin_node.treesize += bin_node.right_son.treesize
+    order = []
+    stack = [bin_node]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        for son, son_side in ((node.right_son, RIGHT), (node.left_son, LEFT)):
+            if son is not None:
+                son.hight = node.hight + 1
+                son.side = son_side
+                stack.append(son)
+
+    # post-order: max_dep and treesize come from the sons.
+    # sons are linked before their parent, so anytree never walks a long ancestor chain
+    for node in reversed(order):
+        node.max_dep = 1
+        node.treesize = 1
+        for son in (node.left_son, node.right_son):
+            if son is not None:
+                son.parent = node
+                node.max_dep = max(node.max_dep, son.max_dep + 1)
+                node.treesize += son.treesize
+    bin_node.parent = parent
 
 
 def calculate_trajectories_xy(origin, first, second, threshold):
@@ -197,24 +214,24 @@ def add_child_bifurcations(stack, node):
 
     while lson.left_son is not None and lson.right_son is None:
         lson = lson.left_son
-    stack.put(lson)
+    stack.append(lson)
 
     while rson.left_son is not None and rson.right_son is None:
         rson = rson.left_son
-    stack.put(rson)
+    stack.append(rson)
 
 
 # calculate the distance to root
 def calculate_trajectories(swc_root, bin_root, thresholds, z_in_path_dist =True, current_trajectories=0.0, DEBUG=False):
-    stack = queue.LifoQueue()
+    stack = []
 
     node = bin_root
     while node.left_son != None and node.right_son == None:
         node = node.left_son
-    stack.put(node)
+    stack.append(node)
 
-    while not stack.empty():
-        node = stack.get()
+    while stack:
+        node = stack.pop()
         if DEBUG:
             print("[debug:  ] calculate trajectories for node {}".format(node.data.get_id()))
         data = node.data
@@ -272,7 +289,7 @@ def calculate_path_data(bin_node, z_in_path_dist, DEBUG=False):
 
 
 def remove_continuations(swc_root, bin_root, calc_path_dist, z_in_path_dist):
-    stack = queue.LifoQueue()
+    stack = []
 
     # swc_node: data
     child_data = None
@@ -292,13 +309,13 @@ def remove_continuations(swc_root, bin_root, calc_path_dist, z_in_path_dist):
             data.xy_path_length = swc_root.distance(data, mode="2d")
         data.z_path_length = math.fabs(swc_root.get_z() - bin_root.data.get_z())
 
-    stack.put(bin_root)
-    while not stack.empty():
-        node = stack.get()
+    stack.append(bin_root)
+    while stack:
+        node = stack.pop()
         data = node.data
 
         if not node.is_leaf():
-            stack.put(node.left_son)
+            stack.append(node.left_son)
             if calc_path_dist:
                 calculate_path_data(node.left_son, z_in_path_dist)
             if node.right_son is None:
@@ -317,7 +334,7 @@ def remove_continuations(swc_root, bin_root, calc_path_dist, z_in_path_dist):
                         node.parent.right_son = child
                     child.parent = node.parent
             else:
-                stack.put(node.right_son)
+                stack.append(node.right_son)
                 if calc_path_dist:
                     calculate_path_data(node.right_son, z_in_path_dist)
     return res_root
@@ -1,6 +1,5 @@
 import math
 import copy
-import queue
 from pyneval.model.swc_node import SwcNode,SwcTree
 from pyneval.model.binary_node import BinaryNode
 from pyneval.model.euclidean_point import EuclideanPoint
@@ -74,24 +73,24 @@ def is_in_threshold(gold_node, test_node):
 
 
 def get_trajectory_for_path(ancestor_node, descendant_node):
-    path_stack = queue.LifoQueue()
+    path_stack = []
     ancestor_data = ancestor_node.data
 
     while descendant_node != ancestor_node:
-        path_stack.put(descendant_node)
+        path_stack.append(descendant_node)
         descendant_node = descendant_node.parent
         if descendant_node is None:
             return None
 
     trajectory = EuclideanPoint()
 
-    descendant_node = path_stack.get()
+    descendant_node = path_stack.pop()
     down_x = False
     down_z = False
 
-    while not path_stack.empty() and (not down_x or not down_z):
+    while path_stack and (not down_x or not down_z):
         sec_data = descendant_node.data
-        next_descendant = path_stack.get()
+        next_descendant = path_stack.pop()
 
         if next_descendant.is_left():
             if not down_x and sec_data.left_trajectory.get_x() != TRAJECTORY_NONE:
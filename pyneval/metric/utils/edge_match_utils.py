@@ -1,29 +1,50 @@
-from pyneval.model.euclidean_point import EuclideanPoint,Line
+from pyneval.model.euclidean_point import EuclideanPoint, Line, point_segment_pairs
 from pyneval.metric.utils.config_utils import DINF
-from pyneval.model.swc_node import get_lca, SwcNode
+from pyneval.model.swc_node import SwcTree
 from pyneval.io.swc_writer import swc_save
+from pyneval.metric.utils.segment_index import SegmentGrid
+from pyneval.model.path_index import PathMarks
 
 import numpy as np
-import math, copy
+import math, copy, heapq
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from anytree import PreOrderIter
-from rtree import index
+try:
+    from rtree import index
+except ImportError:
+    index = None
 
 MIN_SIZE = 0.8
 FLOAT_ERROR = 0.001
+# segment index of the test edges, "grid": SegmentGrid, "rtree": libspatialindex rtree
+INDEX_BACKENDS = ("grid", "rtree")
+DEFAULT_INDEX_BACKEND = "grid"
+# gold edges are scored in workers * CHUNKS_PER_WORKER chunks, so a slow chunk does not hold up the pool
+CHUNKS_PER_WORKER = 4
 
 
 # public
 # find successful matched edge
 def get_match_edges(gold_swc_tree=None, test_swc_tree=None,
-                    vertical_tree=None,
+                    edge_matches=None,
                     rad_threshold=-1.0, len_threshold=0.2,
+                    index_backend=DEFAULT_INDEX_BACKEND,
+                    workers=1,
+                    nearby_edge_cache=None,
                     debug=False):
     """
     :param gold_swc_tree: Swc_Tree
     :param test_swc_tree: Swc_Tree
-    :param vertical_tree: swc format string list, initially empty tree, store vertical edge between two trees
+    :param edge_matches: EdgeMatches, the matches are recorded in it, None: not recorded
     :param rad_threshold: float, radius threshold
     :param len_threshold: float, length threshold
+    :param index_backend: string, segment index of the test edges, one of INDEX_BACKENDS
+    :param workers: int, number of processes scoring candidate pairs, 1 scores them lazily in this process.
+                    the result does not depend on it
+    :param nearby_edge_cache: NearbyEdgeCache of the two trees (get_nearby_edge_cache), built if None.
+                              a cache built with a looser rad_threshold gives the same result, so runs with
+                              several thresholds can share one
     :param detail_path: string, path for extra detail
     :param debug: bool, true or false, to show debug info or not
     :return: match_edge set contains tuple of two swc nodes
@@ -31,112 +52,284 @@ def get_match_edges(gold_swc_tree=None, test_swc_tree=None,
     """
 
     match_edge = set()
-    edge_use_dict = {}
-    id_rootdis_dict = {}
     test_match_length = 0.0
-    vertical_id = 1
-    idx3d = get_edge_rtree(test_swc_tree)
-    id_edge_dict = get_idedge_dict(test_swc_tree)
+    if nearby_edge_cache is None:
+        nearby_edge_cache = get_nearby_edge_cache(gold_swc_tree, test_swc_tree, rad_threshold, index_backend)
+    # a cache may be shared by several runs (length_metric_sweep), the debug output counts this run only
+    nearby_edge_cache.reset_counters()
+    id_edge_dict = nearby_edge_cache.id_edge_dict
     gold_node_list = gold_swc_tree.get_node_list()
-    test_node_list = test_swc_tree.get_node_list()
 
-    # node num need to be larger than the max id
-    test_maxum = 0
-    for node in test_node_list:
-        id_rootdis_dict[node.get_id()] = node.root_length
-        test_maxum = max(test_maxum, node.get_id())
+    # indexed by the dense node index, not by the swc id
+    vis_list = np.zeros(test_swc_tree.index_size()+1, dtype='int8')
+    edge_use_table = EdgeUseTable(test_swc_tree.index_size(), path_index=test_swc_tree.get_path_index())
 
-    vis_list = np.zeros(test_maxum+5, dtype='int8')
-    test_swc_tree.get_lca_preprocess(node_num=test_maxum+5)
+    # phase 1, read only: pairs of every gold edge which pass the length check, in the order they are tried
+    scored_pairs = None
+    if workers > 1:
+        gold_edge_ids = [node.get_id() for node in gold_node_list
+                         if not node.is_virtual() and not node.parent.is_virtual()]
+        scored_pairs = score_candidate_pairs_parallel(gold_swc_tree, test_swc_tree, nearby_edge_cache.candidates,
+                                                      gold_edge_ids,
+                                                      rad_threshold, len_threshold, workers)
 
+    # phase 2, in gold order: the first pair with a clean route is committed
     for node in gold_node_list:
         if node.is_virtual() or node.parent.is_virtual():
             continue
 
-        rad_threshold1, rad_threshold2 = cal_rad_threshold(rad_threshold, node.radius(), node.parent.radius())
-
-        line_tuple_a_set = get_nearby_edges(idx3d=idx3d, point=node, id_edge_dict=id_edge_dict,
-                                            threshold=rad_threshold1, not_self=False, debug=debug)
-        line_tuple_b_set = get_nearby_edges(idx3d=idx3d, point=node.parent, id_edge_dict=id_edge_dict,
-                                            threshold=rad_threshold2, not_self=False, debug=debug)
+        if scored_pairs is None:
+            candidate_pairs = score_candidate_pairs(test_swc_tree, node, nearby_edge_cache,
+                                                    rad_threshold, len_threshold, debug)
+        else:
+            candidate_pairs = [(id_edge_dict[a_id], id_edge_dict[b_id], test_length, None)
+                               for a_id, b_id, test_length in scored_pairs[node.get_id()]]
 
         done = False
-        for line_tuple_a_dis in line_tuple_a_set:
-            if done:
-                break
-            for line_tuple_b_dis in line_tuple_b_set:
-                line_tuple_a = line_tuple_a_dis[0]
-                dis_a = line_tuple_a_dis[1]
-                line_tuple_b = line_tuple_b_dis[0]
-                dis_b = line_tuple_b_dis[1]
-
-                test_length = get_lca_length(test_swc_tree, \
-                               line_tuple_a, \
-                               line_tuple_b, \
-                               Line(e_node_1=node.get_center(),
-                                    e_node_2=node.parent.get_center()),
-                               id_rootdis_dict)
-                gold_length = node.parent_distance()
-
-                if test_length == DINF:
-                    continue
-
-                len_threshold1 = cal_len_threshold(len_threshold, gold_length)
-                if not (dis_a <= rad_threshold1 and dis_b <= rad_threshold2):
-                    if debug:
-                        print(node.get_id(), dis_a, rad_threshold1, dis_b, rad_threshold2, "error1")
-                    continue
-                if not (math.fabs(test_length - gold_length) < len_threshold1):
-                    if debug:
-                        print(node.get_id(), "error2")
-                    continue
-                if not is_route_clean(gold_swc_tree=test_swc_tree,
-                                      gold_line_tuple_a=line_tuple_a, gold_line_tuple_b=line_tuple_b,
-                                      node1=node, node2=node.parent,
-                                      edge_use_dict=edge_use_dict, vis_list= vis_list, debug=debug):
-                    if debug:
-                        print(node.get_id(), "error3")
-                    continue
-                match_edge.add(tuple([node, node.parent]))
-                vertical_id = adjust_vertical_tree(node, line_tuple_a, line_tuple_b, vertical_tree, vertical_id)
-                test_match_length += test_length
-                done = True
-                break
+        for line_tuple_a, line_tuple_b, test_length, feet in candidate_pairs:
+            if not is_route_clean(gold_swc_tree=test_swc_tree,
+                                  gold_line_tuple_a=line_tuple_a, gold_line_tuple_b=line_tuple_b,
+                                  node1=node, node2=node.parent,
+                                  edge_use_table=edge_use_table, vis_list=vis_list, debug=debug, feet=feet):
+                if debug:
+                    print(node.get_id(), "error3")
+                continue
+            match_edge.add(tuple([node, node.parent]))
+            if edge_matches is not None:
+                if feet is None:
+                    feet = get_feet(Line(e_node_1=node.get_center(), e_node_2=node.parent.get_center()),
+                                    line_tuple_a, line_tuple_b)
+                edge_matches.add(node.get_id(), line_tuple_a[0].get_id(), line_tuple_b[0].get_id(),
+                                 feet[0], feet[1], test_length)
+            test_match_length += test_length
+            done = True
+            break
 
         if not done:
             node._type = 9
             if debug:
                 print("{} not done".format(node.get_id()))
 
+    if debug and scored_pairs is None:
+        print("nearby edge cache: queries = {}, hit rate = {:.4f}".format(
+            nearby_edge_cache.queries, nearby_edge_cache.hit_rate()))
     return match_edge, test_match_length
 
 
-def adjust_vertical_tree(node, line_tuple_a, line_tuple_b, vertical_tree, vertical_id):
-    # adjust vertical tree
-    swc_foot_a = swc_get_foot(node, line_tuple_a)
-    swc_foot_b = swc_get_foot(node.parent, line_tuple_b)
-    tmp_node = SwcNode(center=node._pos, radius=node.radius() / 2, ntype=node._type)
-    tmp_node_p = SwcNode(center=node.parent._pos, radius=node.parent.radius() / 2, ntype=node.parent._type)
+def get_nearby_edge_cache(gold_swc_tree, test_swc_tree, rad_threshold, index_backend=DEFAULT_INDEX_BACKEND,
+                          context=None):
+    """
+    index the test edges and find the nearby test edges of all gold nodes at once
+    :param rad_threshold: float, radius threshold, edges farther than it are never returned by the cache
+    :param context: EvalContext (eval_context.py), reuse its index of the test edges, None: build the index here
+    :return: NearbyEdgeCache
+    level: 1
+    """
+    if context is None:
+        idx3d = get_edge_index(test_swc_tree, backend=index_backend)
+        id_edge_dict = get_idedge_dict(test_swc_tree)
+    else:
+        idx3d = context.get_edge_index(test_swc_tree)
+        id_edge_dict = context.get_idedge_dict(test_swc_tree)
+    candidates = get_candidate_edges(gold_swc_tree=gold_swc_tree, test_swc_tree=test_swc_tree,
+                                     rad_threshold=rad_threshold, idx3d=idx3d)
+    return NearbyEdgeCache(*candidates, id_edge_dict=id_edge_dict, index_size=gold_swc_tree.index_size())
+
+
+def score_candidate_pairs(test_swc_tree, node, nearby_edge_cache, rad_threshold, len_threshold, debug=False):
+    """
+    yield the candidate pairs of the gold edge (node, node.parent) whose route length passes the length
+    threshold, in best first order (get_candidate_pairs). only reads the trees, so it can run anywhere
+    :param nearby_edge_cache: NearbyEdgeCache of the gold tree against test_swc_tree
+    :return: tuple(line_tuple_a, line_tuple_b, test_length, feet)
+    level: 1
+    """
+    rad_threshold1, rad_threshold2 = cal_rad_threshold(rad_threshold, node.radius(), node.parent.radius())
+
+    line_tuple_a_set = nearby_edge_cache.get(node, rad_threshold1)
+    line_tuple_b_set = nearby_edge_cache.get(node.parent, rad_threshold2)
+
+    gold_length = node.parent_distance()
+    len_threshold1 = cal_len_threshold(len_threshold, gold_length)
+    candidate_pairs = get_candidate_pairs(node.get_center(), node.parent.get_center(),
+                                          line_tuple_a_set, line_tuple_b_set,
+                                          rad_threshold1, rad_threshold2, gold_length, len_threshold1)
+
+    for line_tuple_a, dis_a, line_tuple_b, dis_b, feet in candidate_pairs:
+        test_length = get_lca_length(test_swc_tree, \
+                       line_tuple_a, \
+                       line_tuple_b, \
+                       Line(e_node_1=node.get_center(),
+                            e_node_2=node.parent.get_center()),
+                       feet=feet)
+
+        if test_length == DINF:
+            continue
+        if not (math.fabs(test_length - gold_length) < len_threshold1):
+            if debug:
+                print(node.get_id(), "error2")
+            continue
+        yield line_tuple_a, line_tuple_b, test_length, feet
+
+
+# trees and nearby edges of a scoring process, set once by _init_score_worker
+_score_context = None
 
-    tmp_node.set_id(vertical_id)
-    vertical_id += 1
-    vertical_tree.append(tmp_node.to_swc_str(-1))
 
-    tmp_node_p.set_id(vertical_id)
-    vertical_id += 1
-    vertical_tree.append(tmp_node_p.to_swc_str(-1))
+def _init_score_worker(gold_columns, test_columns, candidates, rad_threshold, len_threshold):
+    global _score_context
+    gold_swc_tree = SwcTree()
+    gold_swc_tree.load_columns(gold_columns)
+    test_swc_tree = SwcTree()
+    test_swc_tree.load_columns(test_columns)
+    nearby_edge_cache = NearbyEdgeCache(*candidates, id_edge_dict=get_idedge_dict(test_swc_tree),
+                                        index_size=gold_swc_tree.index_size())
+    _score_context = (gold_swc_tree, test_swc_tree, nearby_edge_cache, rad_threshold, len_threshold)
 
-    swc_foot_a.set_id(vertical_id)
-    vertical_id += 1
-    vertical_tree.append(swc_foot_a.to_swc_str(tmp_node.get_id()))
 
-    swc_foot_b.set_id(vertical_id)
-    vertical_id += 1
-    vertical_tree.append(swc_foot_b.to_swc_str(tmp_node_p.get_id()))
-    return vertical_id
+def _score_chunk(gold_edge_ids):
+    gold_swc_tree, test_swc_tree, nearby_edge_cache, rad_threshold, len_threshold = _score_context
+    res = []
+    for nid in gold_edge_ids:
+        node = gold_swc_tree.node_from_id(nid)
+        res.append([(line_tuple_a[0].get_id(), line_tuple_b[0].get_id(), test_length)
+                    for line_tuple_a, line_tuple_b, test_length, _ in
+                    score_candidate_pairs(test_swc_tree, node, nearby_edge_cache, rad_threshold, len_threshold)])
+    return res
+
+
+def score_candidate_pairs_parallel(gold_swc_tree, test_swc_tree, candidates, gold_edge_ids,
+                                   rad_threshold, len_threshold, workers):
+    """
+    score_candidate_pairs of many gold edges in a process pool, every process gets its own copy of the trees
+    :param candidates: arrays returned by get_candidate_edges
+    :param gold_edge_ids: ids of the child nodes of the gold edges to score
+    :param workers: number of processes
+    :return: dict, gold edge id -> list of tuple(id of edge a, id of edge b, test_length), all pairs
+        which pass the length threshold, in the order score_candidate_pairs yields them
+    level: 1
+    """
+    chunk_num = workers * CHUNKS_PER_WORKER
+    chunk_size = max(1, -(-len(gold_edge_ids) // chunk_num))
+    chunks = [gold_edge_ids[i:i + chunk_size] for i in range(0, len(gold_edge_ids), chunk_size)]
+
+    scored_pairs = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_score_worker,
+                             initargs=(gold_swc_tree.get_columns(), test_swc_tree.get_columns(),
+                                       candidates, rad_threshold, len_threshold)) as executor:
+        for chunk, res in zip(chunks, executor.map(_score_chunk, chunks)):
+            scored_pairs.update(zip(chunk, res))
+    return scored_pairs
+
+
+class EdgeMatches:
+    """
+    matched gold edges of get_match_edges, one row per match in the order they are committed:
+        gold_ids(M): id of the child node of the gold edge
+        test_ids(M*2): ids of the child nodes of the test edges matched to the two ends of the gold edge
+        feet(M*2*3): closest points of the two ends of the gold edge on these test edges
+        lengths(M): length of the route between the two feet in the test tree
+    rows are appended as plain tuples while matching, the arrays are built the first time they are read.
+    to_swc_list renders the auxiliary lines between the trees (the former vertical_tree) on request
+    """
+    def __init__(self, gold_swc_tree=None):
+        """
+        :param gold_swc_tree: gold tree of the matching, needed by to_swc_list only
+        """
+        self.gold_swc_tree = gold_swc_tree
+        self._rows = []
+        self._arrays = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, gold_id, test_id_a, test_id_b, foot_a, foot_b, length):
+        """
+        :param foot_a, foot_b: EuclideanPoint, feet of the child and the parent end of the gold edge
+        """
+        self._rows.append((gold_id, test_id_a, test_id_b, foot_a._pos, foot_b._pos, length))
+        self._arrays = None
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            rows = self._rows
+            self._arrays = (np.array([row[0] for row in rows], dtype=np.int64),
+                            np.array([row[1:3] for row in rows], dtype=np.int64).reshape(-1, 2),
+                            np.array([row[3:5] for row in rows], dtype=np.float64).reshape(-1, 2, 3),
+                            np.array([row[5] for row in rows], dtype=np.float64))
+        return self._arrays
+
+    @property
+    def gold_ids(self):
+        return self._get_arrays()[0]
+
+    @property
+    def test_ids(self):
+        return self._get_arrays()[1]
+
+    @property
+    def feet(self):
+        return self._get_arrays()[2]
+
+    @property
+    def lengths(self):
+        return self._get_arrays()[3]
+
+    def to_swc_list(self):
+        """
+        swc lines of the auxiliary lines, 4 nodes per match: the two ends of the gold edge (radius halved,
+        parent -1) and their feet on the test edges (type 0, radius 1.0), ids start at 1.
+        types of the gold nodes are read from the gold tree when this is called
+        """
+        gold_swc_tree = self.gold_swc_tree
+        lines = []
+        vertical_id = 1
+        for gold_id, _, _, foot_a, foot_b, _ in self._rows:
+            node = gold_swc_tree.node_from_id(gold_id)
+            for k, end in enumerate((node, node.parent)):
+                x, y, z = end._pos._pos
+                lines.append('{} {} {} {} {} {} {}\n'.format(
+                    vertical_id + k, end._type, x, y, z, end.radius() / 2, -1))
+            for k, foot in enumerate((foot_a, foot_b)):
+                lines.append('{} {} {} {} {} {} {}\n'.format(
+                    vertical_id + 2 + k, 0, foot[0], foot[1], foot[2], 1.0, vertical_id + k))
+            vertical_id += 4
+        return lines
 
 
 # private
+# construct the segment index of all edges
+def get_edge_index(swc_tree=None, backend=DEFAULT_INDEX_BACKEND):
+    """
+    :param swc_tree: Swc_Tree
+    :param backend: string, "grid" for SegmentGrid or "rtree"
+    :return: index of edge bounding boxes, key is the id of the child node, both backends answer
+        intersection and intersection_v
+    level: 1
+    """
+    if backend == "grid":
+        return get_edge_grid(swc_tree)
+    if backend == "rtree":
+        return get_edge_rtree(swc_tree)
+    raise Exception("[Error: ]Unknown segment index backend {}, expect one of {}".format(backend, INDEX_BACKENDS))
+
+
+def get_edge_grid(swc_tree=None):
+    """
+    :param swc_tree: Swc_Tree, to build SegmentGrid
+    :return: SegmentGrid, same boxes as get_edge_rtree
+    level: 1
+    """
+    rows = np.array([node.get_index() for node in swc_tree.get_node_list()
+                     if not node.is_virtual() and not node.parent.is_virtual()], dtype=np.int64)
+    point_a = swc_tree.xyz[rows]
+    point_b = swc_tree.xyz[swc_tree.parent_index[rows]]
+    extra = swc_tree.radii[rows][:, None]
+    return SegmentGrid(mins=np.where(point_a > point_b, point_b, point_a) - extra,
+                       maxs=np.where(point_a > point_b, point_a, point_b) + extra,
+                       ids=swc_tree.ids[rows])
+
+
 # construct rtree
 def get_edge_rtree(swc_tree=None):
     """
@@ -144,6 +337,8 @@ def get_edge_rtree(swc_tree=None):
     :return: rtree
     level: 1
     """
+    if index is None:
+        raise Exception("[Error: ]rtree is not installed, use the grid segment index")
     swc_tree_list = swc_tree.get_node_list()
     p = index.Property()
     p.dimension = 3
@@ -212,20 +407,20 @@ def get_nearby_edges_slow(test_node_list, point, threshold, not_self=False, DEBU
         if new_d < threshold:
             line_tuple = ([node, node.parent])
             nearby_edges.append(tuple([line_tuple, new_d]))
-    nearby_edges.sort(key=lambda x: x[1])
+    nearby_edges.sort(key=lambda x: (x[1], x[0][0].get_id()))
     return nearby_edges
 
 
 # find the closest edge base on rtree
 def get_nearby_edges(idx3d, point, id_edge_dict, threshold, not_self=False, debug=False):
     '''
-    :param idx3d: an rtree
+    :param idx3d: a segment index, rtree or SegmentGrid
     :param point: point to get nearby edges
     :param id_edge_dict:map between id and line tuple(edge)
     :param threshold:
     :param not_self: exclude self,used in overlap detect
     :param debug:
-    :return: a list of tuple(edge, dis). Sorted according to dis
+    :return: a list of tuple(edge, dis). Sorted according to dis, ties by the id of the child node of the edge
     level: 1
     '''
     point_box = (point.get_x() - threshold, point.get_y() - threshold, point.get_z() - threshold,
@@ -251,104 +446,235 @@ def get_nearby_edges(idx3d, point, id_edge_dict, threshold, not_self=False, debu
         if not_self and new_d == 0:
             continue
         nearby_edges.append(tuple([line_tuple, new_d]))
-    nearby_edges.sort(key=lambda x: x[1])
+    nearby_edges.sort(key=lambda x: (x[1], x[0][0].get_id()))
     return nearby_edges
 
 
+def get_candidate_edges(gold_swc_tree, test_swc_tree, rad_threshold, idx3d=None, not_self=False):
+    """
+    batched get_nearby_edges for every gold node, the threshold of a node is its radius threshold
+    (cal_rad_threshold), edges farther than it are dropped.
+    :param gold_swc_tree: SwcTree, nodes to search around
+    :param test_swc_tree: SwcTree, edges to search
+    :param rad_threshold: float, radius threshold
+    :param idx3d: segment index of test_swc_tree edges (get_edge_index), built if None
+    :param not_self: exclude edges at distance 0, used in overlap detect
+    :return: three flat arrays, gold_index(dense index of the gold node), test_edge_id(id of the child node
+        of the test edge) and distance, sorted by gold_index, then by distance, then by test_edge_id,
+        as in get_nearby_edges, so the order does not depend on the index backend
+    level: 1
+    """
+    if idx3d is None:
+        idx3d = get_edge_index(test_swc_tree)
+    gold_rows = np.array([node.get_index() for node in gold_swc_tree.get_node_list() if not node.is_virtual()],
+                         dtype=np.int64)
+    test_rows = np.array([node.get_index() for node in test_swc_tree.get_node_list()
+                          if not node.is_virtual() and not node.parent.is_virtual()], dtype=np.int64)
+    if len(gold_rows) == 0 or len(test_rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+    gold_xyz = gold_swc_tree.xyz[gold_rows]
+    if rad_threshold < 0:
+        thresholds = -rad_threshold*gold_swc_tree.radii[gold_rows]
+    else:
+        thresholds = np.full(len(gold_rows), rad_threshold, dtype=np.float64)
+    hit_ids, counts = idx3d.intersection_v(gold_xyz - thresholds[:, None], gold_xyz + thresholds[:, None])
+    query = np.repeat(np.arange(len(gold_rows)), counts.astype(np.int64))
+
+    # test edge id -> rows of its two nodes
+    test_ids = test_swc_tree.ids[test_rows]
+    order = np.argsort(test_ids)
+    child_rows = test_rows[order[np.searchsorted(test_ids[order], hit_ids)]]
+    parent_rows = test_swc_tree.parent_index[child_rows]
+    seg_a = test_swc_tree.xyz[child_rows]
+    seg_b = test_swc_tree.xyz[parent_rows]
+
+    # if two sides of an edge are in the same position, ignore this edge
+    d = seg_a - seg_b
+    keep = np.sqrt(d[:, 0]*d[:, 0] + d[:, 1]*d[:, 1] + d[:, 2]*d[:, 2]) != 0
+    distances, _, _ = point_segment_pairs(gold_xyz[query], seg_a, seg_b)
+    keep &= distances <= thresholds[query]
+    if not_self:
+        keep &= distances != 0
+
+    gold_index, hit_ids, distances = gold_rows[query[keep]], hit_ids[keep], distances[keep]
+    order = np.lexsort((hit_ids, distances, gold_index))
+    return gold_index[order], hit_ids[order], distances[order]
+
+
+class NearbyEdgeCache:
+    """
+    nearby edge lists of gold nodes built from the arrays of get_candidate_edges,
+    each (node, threshold) list is built once and reused, a node is queried as the child of
+    its edge and again as the parent of every child edge
+    """
+    def __init__(self, gold_index, test_edge_ids, distances, id_edge_dict, index_size):
+        """
+        :param gold_index, test_edge_ids, distances: arrays returned by get_candidate_edges
+        :param id_edge_dict: id_edge_dict of the test tree (get_idedge_dict)
+        :param index_size: index_size() of the gold tree
+        """
+        self.candidates = (gold_index, test_edge_ids, distances)
+        self.offsets = np.searchsorted(gold_index, np.arange(index_size + 1)).tolist()
+        self.test_edge_ids = test_edge_ids.tolist()
+        self.distances = distances.tolist()
+        self.id_edge_dict = id_edge_dict
+        self.cache = {}
+        self.queries = 0
+        self.hits = 0
+
+    def get(self, gold_node, threshold):
+        """
+        :return: list of tuple(edge, dis) within threshold, sorted according to dis, as get_nearby_edges
+        """
+        self.queries += 1
+        key = (gold_node.get_index(), threshold)
+        nearby_edges = self.cache.get(key)
+        if nearby_edges is not None:
+            self.hits += 1
+            return nearby_edges
+
+        i = gold_node.get_index()
+        nearby_edges = [tuple([self.id_edge_dict[self.test_edge_ids[k]], self.distances[k]])
+                        for k in range(self.offsets[i], self.offsets[i + 1]) if self.distances[k] <= threshold]
+        self.cache[key] = nearby_edges
+        return nearby_edges
+
+    def reset_counters(self):
+        """start counting queries and hits again, the cached lists are kept"""
+        self.queries = 0
+        self.hits = 0
+
+    def hit_rate(self):
+        return self.hits / self.queries if self.queries > 0 else 0.0
+
+
+def get_candidate_pairs(point_a, point_b, line_tuple_a_set, line_tuple_b_set,
+                        rad_threshold_a, rad_threshold_b, gold_length, len_threshold):
+    """
+    :param point_a, point_b: EuclideanPoint, two ends of the gold edge
+    :param line_tuple_a_set, line_tuple_b_set: nearby edges of the two ends, lists of tuple(edge, dis) sorted by dis
+    :param rad_threshold_a, rad_threshold_b: radius thresholds of the two ends
+    :param gold_length: length of the gold edge
+    :param len_threshold: absolute length threshold of the gold edge
+    yield tuple(line_tuple_a, dis_a, line_tuple_b, dis_b, feet) in best first order of dis_a + dis_b,
+    pairs with the same sum come in the order of the two lists. pairs are generated lazily from a heap,
+    so a caller which stops at the first good pair only pays for the pairs it has seen.
+    only cheap checks are done here: pairs out of the radius thresholds are skipped, and so are pairs whose feet
+    are too far apart, the route between two feet is never shorter than the straight line between them
+    feet is (foot of point_a on line_tuple_a, foot of point_b on line_tuple_b).
+    level: 1
+    """
+    if len(line_tuple_a_set) == 0 or len(line_tuple_b_set) == 0:
+        return
+    feet_a = {}
+    feet_b = {}
+    heap = [(line_tuple_a_set[0][1] + line_tuple_b_set[0][1], 0, 0)]
+    while heap:
+        _, i, j = heapq.heappop(heap)
+        # (i, j + 1) and (i + 1, 0) are the only pairs which follow (i, j) directly
+        if j + 1 < len(line_tuple_b_set):
+            heapq.heappush(heap, (line_tuple_a_set[i][1] + line_tuple_b_set[j + 1][1], i, j + 1))
+        if j == 0 and i + 1 < len(line_tuple_a_set):
+            heapq.heappush(heap, (line_tuple_a_set[i + 1][1] + line_tuple_b_set[0][1], i + 1, 0))
+
+        line_tuple_a, dis_a = line_tuple_a_set[i]
+        line_tuple_b, dis_b = line_tuple_b_set[j]
+        if dis_a > rad_threshold_a or dis_b > rad_threshold_b:
+            continue
+        if i not in feet_a:
+            feet_a[i] = point_a.get_closest_point(Line(e_node_1=line_tuple_a[0].get_center(),
+                                                       e_node_2=line_tuple_a[1].get_center()))
+        if j not in feet_b:
+            feet_b[j] = point_b.get_closest_point(Line(e_node_1=line_tuple_b[0].get_center(),
+                                                       e_node_2=line_tuple_b[1].get_center()))
+        if feet_a[i].distance(feet_b[j]) - gold_length >= len_threshold + FLOAT_ERROR:
+            continue
+        yield line_tuple_a, dis_a, line_tuple_b, dis_b, (feet_a[i], feet_b[j])
+
+
 # get the distance of two matched closest edges
-def get_lca_length(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, test_line, id_rootdis_dict):
+def get_lca_length(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, test_line, id_rootdis_dict=None, feet=None):
     """
     :param gold_swc_tree SwcTree object
     :param gold_line_tuple_a: a list of two nodes describe a edge
     :param gold_line_tuple_b: a list of two nodes describe a edge
     :param test_line: Line object defined in pyneval/model/euclidean_point
-    :param id_rootdis_dict: a dict [int to float], get nodes' distance to root by its id
+    :param id_rootdis_dict: not used any more, route lengths come from gold_swc_tree.get_path_index()
+    :param feet: (foot_a, foot_b), closest points of the two ends of test line on the two edges, computed if None
     :return lca_length of two side nodes of test line
     level: 1
     """
-    point_a, point_b = test_line.get_points()
-
-    gold_line_a = Line(e_node_1=gold_line_tuple_a[0].get_center(),
-                       e_node_2=gold_line_tuple_a[1].get_center())
-    gold_line_b = Line(e_node_1=gold_line_tuple_b[0].get_center(),
-                       e_node_2=gold_line_tuple_b[1].get_center())
-
-    foot_a = point_a.get_closest_point(gold_line_a)
-    foot_b = point_b.get_closest_point(gold_line_b)
+    if feet is None:
+        feet = get_feet(test_line, gold_line_tuple_a, gold_line_tuple_b)
+    foot_a, foot_b = feet
 
     # if two foots lay on the same edge, pass
     if gold_line_tuple_a[0].get_id() == gold_line_tuple_b[0].get_id() and \
         gold_line_tuple_a[1].get_id() == gold_line_tuple_b[1].get_id():
         return foot_a.distance(foot_b)
 
-    lca_id = gold_swc_tree.get_lca(gold_line_tuple_a[0].get_id(), gold_line_tuple_b[0].get_id())
-    if lca_id is None or lca_id < 1:
+    path_index = gold_swc_tree.get_path_index()
+    lca = path_index.lca(gold_line_tuple_a[0].get_index(), gold_line_tuple_b[0].get_index())
+    if lca < 0 or gold_swc_tree.ids[lca] < 1:
         return DINF
-    try:
-        lca_length2 = id_rootdis_dict[gold_line_tuple_a[0].get_id()] + \
-                      id_rootdis_dict[gold_line_tuple_b[0].get_id()] - \
-                      id_rootdis_dict[lca_id]*2
-    except:
-        print(id_rootdis_dict)
-        raise Exception("[error: lca_id={}]".format(
-            lca_id
-        ))
-    # get nodes on the route, make sure no extra node
-    route_list_a = get_route_node(gold_line_tuple_a[0], lca_id)
-    route_list_b = get_route_node(gold_line_tuple_b[0], lca_id)
-
-    lca_length = 0.0
-    # if (gold_line_tuple_a[1] in route_list_a) != (gold_line_tuple_a[0].get_id() != lca_id):
-    #     print(gold_line_tuple_a[1] in route_list_a, gold_line_tuple_a[0].get_id() != lca_id)
-    if gold_line_tuple_a[0].get_id() != lca_id:
-        route_list_a.remove(gold_line_tuple_a[0])
-        lca_length2 -= gold_line_tuple_a[0].parent_distance()
-        lca_length += foot_a.distance(gold_line_tuple_a[1].get_center())
-        lca_length2 += foot_a.distance(gold_line_tuple_a[1].get_center())
-    else:
-        lca_length += foot_a.distance(gold_line_tuple_a[0].get_center())
-        lca_length2 += foot_a.distance(gold_line_tuple_a[0].get_center())
-    # if (gold_line_tuple_b[1] in route_list_b) != (gold_line_tuple_b[0].get_id() != lca_id):
-    #     print(gold_line_tuple_b[1] in route_list_b, gold_line_tuple_b[0].get_id() != lca_id)
-    if gold_line_tuple_b[0].get_id() != lca_id:
-        route_list_b.remove(gold_line_tuple_b[0])
-        lca_length2 -= gold_line_tuple_b[0].parent_distance()
-        lca_length += foot_b.distance(gold_line_tuple_b[1].get_center())
-        lca_length2 += foot_b.distance(gold_line_tuple_b[1].get_center())
-    else:
-        lca_length += foot_b.distance(gold_line_tuple_b[0].get_center())
-        lca_length2 += foot_b.distance(gold_line_tuple_b[0].get_center())
 
-    route_list = route_list_a + route_list_b
-    for node in route_list:
-        if node.get_id() == lca_id:
-            continue
-        lca_length += node.parent_distance()
+    # a foot edge below the lca is counted from the foot to its parent, the lca edge from the foot to the lca
+    top_a, lca_length_a = get_route_top(path_index, gold_line_tuple_a, foot_a, lca)
+    top_b, lca_length_b = get_route_top(path_index, gold_line_tuple_b, foot_b, lca)
+
+    # the rest of the route is a difference of root distances
+    root_dis = path_index.root_dis
+    return lca_length_a + lca_length_b + (root_dis[top_a] + root_dis[top_b] - 2 * root_dis[lca])
+
 
-    return lca_length
+def get_feet(test_line, gold_line_tuple_a, gold_line_tuple_b):
+    """
+    closest points of the two ends of test_line on the edges gold_line_tuple_a and gold_line_tuple_b
+    """
+    point_a, point_b = test_line.get_points()
+    gold_line_a = Line(e_node_1=gold_line_tuple_a[0].get_center(),
+                       e_node_2=gold_line_tuple_a[1].get_center())
+    gold_line_b = Line(e_node_1=gold_line_tuple_b[0].get_center(),
+                       e_node_2=gold_line_tuple_b[1].get_center())
+    return point_a.get_closest_point(gold_line_a), point_b.get_closest_point(gold_line_b)
 
 
-def is_route_clean(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, node1, node2, edge_use_dict, vis_list, debug):
+def get_route_top(path_index, gold_line_tuple, foot, lca):
+    """
+    :param path_index: PathIndex of the tree
+    :param gold_line_tuple: (node, node.parent), the edge which holds the foot
+    :param foot: EuclideanPoint on the edge
+    :param lca: dense index of the lca of the route
+    :return: dense index of the first node above the foot edge on the way to the lca, distance from the foot to it
+    level: 2
+    """
+    row = gold_line_tuple[0].get_index()
+    if row != lca:
+        return path_index.parent[row], foot.distance(gold_line_tuple[1].get_center())
+    return row, foot.distance(gold_line_tuple[0].get_center())
+
+
+def is_route_clean(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, node1, node2, edge_use_table, vis_list, debug,
+                   feet=None):
     """
     :param gold_swc_tree SwcTree object
     :param gold_line_tuple_a: a list of two nodes describe a edge
     :param gold_line_tuple_b: a list of two nodes describe a edge
     :param node1: one node side
     :param node2: the other node side
-    :param edge_use_dict: [swc_node, list[interval_1, interval_2]], interval is a tuple of two int,
-    edge_use_dict shows which part of edge between swc_node and swc_node.parent has been used
-    :param vis_list: list, check if edge has been used
+    :param edge_use_table: EdgeUseTable built with gold_swc_tree.get_path_index(),
+                           shows which part of edge between swc_node and swc_node.parent has been used
+    :param vis_list: list indexed by SwcNode.get_index(), check if edge has been used
+    :param feet: (foot_a, foot_b), closest points of node1 and node2 on the two edges, computed if None
     level: 1
     check if any part between two pedals is used
     :return True/False
     """
-    point_a = node1.get_center()
-    point_b = node2.get_center()
-    gold_line_a = Line(e_node_1=gold_line_tuple_a[0].get_center(), e_node_2=gold_line_tuple_a[1].get_center())
-    gold_line_b = Line(e_node_1=gold_line_tuple_b[0].get_center(), e_node_2=gold_line_tuple_b[1].get_center())
-
-    foot_a = point_a.get_closest_point(gold_line_a)
-    foot_b = point_b.get_closest_point(gold_line_b)
+    if feet is None:
+        feet = get_feet(Line(e_node_1=node1.get_center(), e_node_2=node2.get_center()),
+                        gold_line_tuple_a, gold_line_tuple_b)
+    foot_a, foot_b = feet
 
     # if two foots lay on the same edge, pass
     if gold_line_tuple_a[0].get_id() == gold_line_tuple_b[0].get_id() and \
@@ -365,33 +691,34 @@ def is_route_clean(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, node1, n
             if start > end:
                 start, end = end, start
             end -= FLOAT_ERROR
-            if vis_list[gold_line_tuple_a[0].get_id()] == 1:
+            if vis_list[gold_line_tuple_a[0].get_index()] == 1:
                 return False
-            if add_interval(edge_use_dict, gold_line_tuple_a[0], tuple([start, end])):
+            if edge_use_table.is_free(gold_line_tuple_a[0], start, end):
                 if start < end:
-                    edge_use_dict[gold_line_tuple_a[0]].add(tuple([start, end]))
+                    edge_use_table.add(gold_line_tuple_a[0], start, end)
                 return True
             return False
 
-    # not on the same edge, get lca first
-    lca_id = gold_swc_tree.get_lca(gold_line_tuple_a[0].get_id(), gold_line_tuple_b[0].get_id())
-    if lca_id is None:
-        raise Exception("[Error:] No Lca found")
-
-    # get nodes on the route, make sure no extra node
-    route_list_a = get_route_node(gold_line_tuple_a[0], lca_id)
-    route_list_b = get_route_node(gold_line_tuple_b[0], lca_id)
-
-    if gold_line_tuple_a[1] in route_list_a:
-        route_list_a.remove(gold_line_tuple_a[0])
+    # not on the same edge, get lca first, -1 if the edges lay in different trees
+    route_marks = edge_use_table.route_marks
+    if route_marks is None:
+        raise Exception("[Error: ] edge_use_table is built without a path index")
+    path_index = route_marks.path_index
+    lca = path_index.lca(gold_line_tuple_a[0].get_index(), gold_line_tuple_b[0].get_index())
+
+    # the route is top_a -> lca <- top_b without the lca, top_x is the first node above the foot edge
+    top_a = gold_line_tuple_a[0].get_index()
+    if top_a != lca:
+        top_a = path_index.parent[top_a]
         start_a = foot_a.distance(gold_line_tuple_a[0].get_center()) / gold_line_tuple_a[0].parent_distance()
         end_a = 1.0
     else:
         start_a = 0.0
         end_a = foot_a.distance(gold_line_tuple_a[0].get_center()) / gold_line_tuple_a[0].parent_distance()
 
-    if gold_line_tuple_b[1] in route_list_b:
-        route_list_b.remove(gold_line_tuple_b[0])
+    top_b = gold_line_tuple_b[0].get_index()
+    if top_b != lca:
+        top_b = path_index.parent[top_b]
         start_b = foot_b.distance(gold_line_tuple_b[0].get_center()) / gold_line_tuple_b[0].parent_distance()
         end_b = 1.0
     else:
@@ -409,54 +736,77 @@ def is_route_clean(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, node1, n
     # for each internal left point is included, right is not
     end_a -= FLOAT_ERROR
     end_b -= FLOAT_ERROR
-    route_list = route_list_a + route_list_b
-    for node in route_list:
-        if node.get_id() == lca_id:
-            continue
-        if vis_list[node.get_id()] == 1 or exist(edge_use_dict, node):
-            return False
+    if route_marks.any_marked(top_a, lca) or route_marks.any_marked(top_b, lca):
+        return False
 
-    if add_interval(edge_use_dict, gold_line_tuple_a[0], tuple([start_a, end_a])) and \
-       add_interval(edge_use_dict, gold_line_tuple_b[0], tuple([start_b, end_b])) and \
-        vis_list[gold_line_tuple_a[0].get_id()] == 0 and \
-        vis_list[gold_line_tuple_b[0].get_id()] == 0:
+    if edge_use_table.is_free(gold_line_tuple_a[0], start_a, end_a) and \
+       edge_use_table.is_free(gold_line_tuple_b[0], start_b, end_b) and \
+        vis_list[gold_line_tuple_a[0].get_index()] == 0 and \
+        vis_list[gold_line_tuple_b[0].get_index()] == 0:
         if start_a < end_a:
-            edge_use_dict[gold_line_tuple_a[0]].add(tuple([start_a, end_a]))
+            edge_use_table.add(gold_line_tuple_a[0], start_a, end_a)
         if start_b < end_b:
-            edge_use_dict[gold_line_tuple_b[0]].add(tuple([start_b, end_b]))
+            edge_use_table.add(gold_line_tuple_b[0], start_b, end_b)
 
-        for node in route_list:
-            if node.get_id() == lca_id:
-                continue
-            vis_list[node.get_id()] = 1
+        for row in path_index.path_rows(top_a, lca) + path_index.path_rows(top_b, lca):
+            vis_list[row] = 1
+            route_marks.mark(row)
         return True
     return False
 
 
-def is_intered(inter1, inter2):
+class EdgeUseTable:
     """
+    used parts of the edges of a tree, an edge is identified by the dense index of its child node.
+    a used part is a closed interval [start, end] of the edge, 0 at the child and 1 at the parent.
+    intervals of an edge never overlap, they are kept in two lists sorted by start,
+    so an overlap check is one binary search. an insert shifts the tail of the lists, O(k) for k intervals
+    on the edge, but k is the number of edges matched onto one edge, a few at most, so a balanced tree
+    would only be slower.
+    with a path index, route_marks marks every used edge and every edge on a matched route,
+    so is_route_clean checks a whole route in O(log^2 n)
     level: 2
     """
-    if inter1[0] == inter1[1] or inter2[0] == inter2[1]:
-        return False
-    if inter1[0] <= inter2[0] <= inter1[1] or inter1[0] <= inter2[1] <= inter1[1] or \
-       inter2[0] <= inter1[0] <= inter2[1] or inter2[0] <= inter1[1] <= inter2[1]:
-        return True
-    return False
-
-
-def add_interval(dic, edge, interval):
-    """
-        level: 2
-    """
-    if edge not in dic.keys():
-        dic[edge] = set()
-    if interval[0] > interval[1]:
-        return True
-    for inter in dic[edge]:
-        if is_intered(inter, interval):
-            return False
-    return True
+    def __init__(self, edge_num, path_index=None):
+        """
+        :param edge_num: index_size() of the tree
+        :param path_index: PathIndex of the tree, SwcTree.get_path_index()
+        """
+        self.starts = [None] * edge_num
+        self.ends = [None] * edge_num
+        self.route_marks = PathMarks(path_index) if path_index is not None else None
+
+    def is_used(self, edge):
+        """
+        check if any part of edge is used
+        """
+        return self.starts[edge.get_index()] is not None
+
+    def is_free(self, edge, start, end):
+        """
+        check if [start, end] does not overlap a used part of edge,
+        an empty interval (start >= end) is always free
+        """
+        starts = self.starts[edge.get_index()]
+        if start >= end or starts is None:
+            return True
+        # the used part which starts last before "end" is the only candidate
+        k = bisect_right(starts, end) - 1
+        return k < 0 or self.ends[edge.get_index()][k] < start
+
+    def add(self, edge, start, end):
+        """
+        mark [start, end] of edge as used, it must be free
+        """
+        i = edge.get_index()
+        if self.starts[i] is None:
+            self.starts[i] = []
+            self.ends[i] = []
+        k = bisect_right(self.starts[i], start)
+        self.starts[i].insert(k, start)
+        self.ends[i].insert(k, end)
+        if self.route_marks is not None:
+            self.route_marks.mark(i)
 
 
 def get_route_node(current_node, lca_id):
@@ -470,25 +820,3 @@ def get_route_node(current_node, lca_id):
 
     res_list.append(current_node)
     return res_list
-
-
-def exist(dic, edge):
-    """
-    check if any part of edge is used
-    """
-    if edge not in dic.keys():
-        return False
-    if len(dic[edge]) > 0:
-        return True
-    return False
-
-
-def swc_get_foot(swc_node, swc_line_tuple):
-    e_node = swc_node.get_center()
-    e_line = Line(e_node_1=swc_line_tuple[0].get_center(),
-                  e_node_2=swc_line_tuple[1].get_center())
-
-    e_foot = e_node.get_closest_point(e_line)
-    swc_foot = SwcNode(center=e_foot, radius=1.0, ntype=0)
-
-    return swc_foot
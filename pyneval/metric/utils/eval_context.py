@@ -0,0 +1,54 @@
+import weakref
+
+from pyneval.metric.utils import point_match_utils
+from pyneval.metric.utils.edge_match_utils import get_edge_index, get_idedge_dict, DEFAULT_INDEX_BACKEND
+
+
+class EvalContext:
+    """
+    per tree structures of one evaluation, shared by all runs which use the same tree:
+    the forward and the reverse run of a pair, and the runs of one gold tree against many test trees.
+    a structure is built the first time a run asks for it and kept while the tree is unchanged
+    (SwcTree.get_revision), diadem re-roots and moves the trees it scores, so its node index is rebuilt after that.
+    """
+
+    def __init__(self, index_backend=DEFAULT_INDEX_BACKEND):
+        """
+        :param index_backend: segment index of the edges, see edge_match_utils.INDEX_BACKENDS
+        """
+        self.index_backend = index_backend
+        # tree -> {name: (revision, structure)}, a tree which is not used any more is dropped with its structures
+        self._cache = weakref.WeakKeyDictionary()
+        self.builds = 0
+        self.hits = 0
+
+    def _get(self, swc_tree, name, build):
+        tree_cache = self._cache.setdefault(swc_tree, {})
+        revision = swc_tree.get_revision()
+        item = tree_cache.get(name)
+        if item is not None and item[0] == revision:
+            self.hits += 1
+            return item[1]
+        self.builds += 1
+        structure = build()
+        tree_cache[name] = (swc_tree.get_revision(), structure)
+        return structure
+
+    def get_edge_index(self, swc_tree):
+        """segment index of the edges of swc_tree, see edge_match_utils.get_edge_index"""
+        return self._get(swc_tree, "edge_index", lambda: get_edge_index(swc_tree, backend=self.index_backend))
+
+    def get_idedge_dict(self, swc_tree):
+        """id of the child node -> edge of swc_tree, see edge_match_utils.get_idedge_dict"""
+        return self._get(swc_tree, "idedge_dict", lambda: get_idedge_dict(swc_tree))
+
+    def get_path_index(self, swc_tree):
+        """lca and route lengths of swc_tree, the PathIndex cached by the tree itself"""
+        return swc_tree.get_path_index()
+
+    def get_node_index(self, swc_tree):
+        """
+        :return: tuple(point index, indexed nodes) of the nodes of swc_tree, see point_match_utils.create_node_index
+        """
+        return self._get(swc_tree, "node_index",
+                         lambda: point_match_utils.create_node_index(swc_tree.get_node_list()))
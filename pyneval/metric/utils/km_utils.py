@@ -22,6 +22,36 @@ def get_simple_lca_length(std_tree, test_gold_dict, node1, node2, switch):
     return tmp_node1.root_length + tmp_node2.root_length - 2 * lca_node.root_length
 
 
+def get_simple_lca_length_matrix(std_tree, test_gold_dict, node1_list, node2_list, switch):
+    """
+    get_simple_lca_length of every pair (node1_list[i], node2_list[j]) as a len(node1_list) x len(node2_list) array,
+    all LCAs are resolved by one get_lca_batch call
+    """
+    if std_tree.depth_array is None:
+        raise Exception("[Error: ] std has not been lca initialized yet")
+    if switch:
+        tmp_node1_list = node1_list
+        tmp_node2_list = [test_gold_dict[node2] for node2 in node2_list]
+    else:
+        tmp_node1_list = [test_gold_dict[node1] for node1 in node1_list]
+        tmp_node2_list = node2_list
+    if any(node is None for node in tmp_node1_list) or any(node is None for node in tmp_node2_list):
+        raise Exception("[Error: ]gold tree and test tree are not same. ")
+
+    id1 = np.array([node.get_id() for node in tmp_node1_list], dtype=np.int64)
+    id2 = np.array([node.get_id() for node in tmp_node2_list], dtype=np.int64)
+    len1 = np.array([node.root_length for node in tmp_node1_list], dtype=np.float64)
+    len2 = np.array([node.root_length for node in tmp_node2_list], dtype=np.float64)
+
+    lca_id = std_tree.get_lca_batch(np.repeat(id1, len(id2)), np.tile(id2, len(id1))).reshape(len(id1), len(id2))
+    std_id_node_dict = std_tree.get_id_node_dict()
+    lca_len = np.array([std_id_node_dict[nid].root_length if nid != -1 else 0.0 for nid in lca_id.ravel().tolist()],
+                       dtype=np.float64).reshape(lca_id.shape)
+    dis = len1[:, None] + len2[None, :] - 2 * lca_len
+    dis[lca_id == -1] = DINF
+    return dis
+
+
 def get_dis_graph(gold_tree, test_tree, test_node_list, gold_node_list,
                   test_gold_dict, threshold_dis, metric_mode=1):
     """
@@ -50,21 +80,21 @@ def get_dis_graph(gold_tree, test_tree, test_node_list, gold_node_list,
 
     dis_graph = np.zeros(shape=(test_len, gold_len))
 
-    for i in range(test_len):
-        for j in range(gold_len):
-            if metric_mode == 1:
+    if metric_mode == 1:
+        for i in range(test_len):
+            for j in range(gold_len):
                 dis = test_node_list[i].distance(gold_node_list[j])
-            else:
-                dis = get_simple_lca_length(std_tree=std_tree,
-                                            test_gold_dict=test_gold_dict,
-                                            node1=test_node_list[i],
-                                            node2=gold_node_list[j],
-                                            switch=switch)
-
-            if dis <= threshold_dis:
-                dis_graph[i][j] = -dis
-            else:
-                dis_graph[i][j] = -0x3f3f3f3f/2
+                if dis <= threshold_dis:
+                    dis_graph[i][j] = -dis
+                else:
+                    dis_graph[i][j] = -0x3f3f3f3f/2
+    elif test_len > 0 and gold_len > 0:
+        dis = get_simple_lca_length_matrix(std_tree=std_tree,
+                                           test_gold_dict=test_gold_dict,
+                                           node1_list=test_node_list,
+                                           node2_list=gold_node_list,
+                                           switch=switch)
+        dis_graph = np.where(dis <= threshold_dis, -dis, -0x3f3f3f3f/2)
 
     dis_graph = dis_graph.tolist()
     return dis_graph, switch, test_len, gold_len
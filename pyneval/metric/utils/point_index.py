@@ -0,0 +1,246 @@
+import numpy as np
+
+from pyneval.metric.utils.segment_index import _cell_ranges, MIN_CELL_SIZE, MAX_CELLS_PER_DIM
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# nearest neighbour index of points, "grid": PointGrid, "kdtree": scipy cKDTree, "auto": kdtree if scipy is installed
+POINT_INDEX_BACKENDS = ("auto", "grid", "kdtree")
+DEFAULT_POINT_BACKEND = "auto"
+# the default cell size of PointGrid is fitted in CELL_FIT_STEPS bisection steps to about POINTS_PER_CELL points per cell
+POINTS_PER_CELL = 4
+CELL_FIT_STEPS = 12
+
+
+def _sort_hits(query, points, dis):
+    # hits sorted by query, then by distance, then by point
+    order = np.lexsort((points, dis, query))
+    return query[order], points[order], dis[order]
+
+
+def _first_k(ids, dis, counts, k):
+    """
+    first k hits of every query of a radius result
+    :return: indices(M*k, -1 if a query has less than k hits), distances(M*k, inf for -1)
+    """
+    res_idx = np.full((len(counts), k), -1, dtype=np.int64)
+    res_dis = np.full((len(counts), k), np.inf)
+    starts = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(counts)), counts)
+    rank = np.arange(len(ids)) - starts[owner]
+    sel = rank < k
+    res_idx[owner[sel], rank[sel]] = ids[sel]
+    res_dis[owner[sel], rank[sel]] = dis[sel]
+    return res_idx, res_dis
+
+
+def _knn_from_radius(index, points, k, radius):
+    """
+    knn answered by radius queries, the radius of a query is doubled until its ball holds k points
+    or covers the whole index. the first k hits of a ball which holds k points are the k nearest points
+    """
+    query_num = len(points)
+    res_idx = np.full((query_num, k), -1, dtype=np.int64)
+    res_dis = np.full((query_num, k), np.inf)
+    k_eff = min(k, len(index))
+    if k_eff == 0 or query_num == 0:
+        return res_idx, res_dis
+
+    # no point is farther than the farthest corner of the bounding box
+    lo, hi = index.points.min(axis=0), index.points.max(axis=0)
+    max_dis = np.sqrt((np.maximum(np.abs(points - lo), np.abs(points - hi)) ** 2).sum(axis=1))
+    radius = np.full(query_num, float(radius))
+    pending = np.arange(query_num)
+    while len(pending):
+        ids, dis, counts = index.radius(points[pending], radius[pending])
+        done = (counts >= k_eff) | (radius[pending] >= max_dis[pending])
+        first_idx, first_dis = _first_k(ids, dis, counts, k)
+        res_idx[pending[done]] = first_idx[done]
+        res_dis[pending[done]] = first_dis[done]
+        pending = pending[~done]
+        radius[pending] *= 2
+    return res_idx, res_dis
+
+
+class PointGrid:
+    """
+    static nearest neighbour index of 3D points on a uniform grid, built in one vectorized pass
+    and queried in batches, points are stored in CSR form by cell as in SegmentGrid.
+    queries return the indices of the points in the order they were given, sorted by distance,
+    ties by index
+    """
+
+    def __init__(self, points, cell_size=None):
+        """
+        :param points: N*3 array
+        :param cell_size: edge length of a cell, default: fitted by _fit_cell_size
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        n = len(self.points)
+        if n == 0:
+            self.origin = np.zeros(3)
+            self.cell_size = 1.0
+            self.shape = np.ones(3, dtype=np.int64)
+            self.cell_keys = np.zeros(0, dtype=np.int64)
+            self.cell_offsets = np.zeros(1, dtype=np.int64)
+            self.cell_points = np.zeros(0, dtype=np.int64)
+            return
+
+        self.origin = self.points.min(axis=0)
+        extent = self.points.max(axis=0) - self.origin
+        if cell_size is None:
+            cell_size = self._fit_cell_size(extent)
+        self._set_cell_size(cell_size, extent)
+
+        keys = self._key_of(self._cell_of(self.points))
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        self.cell_points = order
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        self.cell_keys = keys[starts]
+        self.cell_offsets = np.r_[starts, len(keys)]
+
+    def __len__(self):
+        return len(self.points)
+
+    def _set_cell_size(self, cell_size, extent):
+        self.cell_size = float(max(cell_size, extent.max() / MAX_CELLS_PER_DIM, MIN_CELL_SIZE))
+        self.shape = (extent // self.cell_size).astype(np.int64) + 1
+
+    def _fit_cell_size(self, extent):
+        """
+        the cell size which puts about POINTS_PER_CELL points into every occupied cell.
+        nodes of a tree lay on curves, so a size from the volume of the bounding box would be far too large,
+        it is only the upper end of a bisection on the log scale
+        """
+        hi = max(float(np.prod(np.maximum(extent, MIN_CELL_SIZE)) / len(self.points)) ** (1.0 / 3),
+                 float(extent.max()) / MAX_CELLS_PER_DIM, MIN_CELL_SIZE)
+        lo = max(hi / 4096, float(extent.max()) / MAX_CELLS_PER_DIM, MIN_CELL_SIZE)
+        for _ in range(CELL_FIT_STEPS):
+            mid = (lo * hi) ** 0.5
+            self._set_cell_size(mid, extent)
+            occupied = len(np.unique(self._key_of(self._cell_of(self.points))))
+            if len(self.points) > POINTS_PER_CELL * occupied:
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+    def _cell_of(self, points):
+        cells = np.floor((points - self.origin) / self.cell_size)
+        return np.clip(cells, -1, self.shape).astype(np.int64)
+
+    def _key_of(self, cells):
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    def radius(self, points, r):
+        """
+        points within distance r (included) of every query point
+        :param points: M*3 array
+        :param r: float or M floats
+        :return: indices(int64), distances, counts(M), the hits of query m are
+            indices[sum(counts[:m]):sum(counts[:m+1])], sorted by distance
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        query_num = len(points)
+        r = np.broadcast_to(np.asarray(r, dtype=np.float64), (query_num,))
+        if len(self.cell_keys) == 0 or query_num == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(query_num, dtype=np.int64)
+
+        # cells outside of the grid hold no point
+        lo = np.maximum(self._cell_of(points - r[:, None]), 0)
+        hi = np.minimum(self._cell_of(points + r[:, None]), self.shape - 1)
+        # a query which spans more cells than there are points checks all points
+        spans = np.prod(np.maximum(hi - lo + 1, 0), axis=1)
+        wide = np.flatnonzero(spans > len(self.points))
+        lo[wide], hi[wide] = 0, -1
+        query, cells = _cell_ranges(lo, hi, query_num)
+        keys = self._key_of(cells)
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        found = self.cell_keys[pos] == keys
+        query, pos = query[found], pos[found]
+
+        starts = self.cell_offsets[pos]
+        sizes = self.cell_offsets[pos + 1] - starts
+        query = np.r_[np.repeat(query, sizes), np.repeat(wide, len(self.points))]
+        hits = np.r_[self.cell_points[np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())],
+                     np.tile(np.arange(len(self.points)), len(wide))]
+
+        dis = np.sqrt(((self.points[hits] - points[query]) ** 2).sum(axis=1))
+        keep = dis <= r[query]
+        query, hits, dis = _sort_hits(query[keep], hits[keep], dis[keep])
+        return hits, dis, np.bincount(query, minlength=query_num)
+
+    def knn(self, points, k):
+        """
+        k nearest points of every query point
+        :param points: M*3 array
+        :param k: int
+        :return: indices(M*k int64, -1 if the index holds less than k points), distances(M*k, inf for -1)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return _knn_from_radius(self, points, k, self.cell_size)
+
+
+class KDTreeIndex:
+    """
+    the queries of PointGrid answered by scipy's compiled cKDTree
+    """
+
+    def __init__(self, points):
+        if cKDTree is None:
+            raise Exception("[Error: ]scipy is not installed, use the grid point index")
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.tree = cKDTree(self.points) if len(self.points) else None
+
+    def __len__(self):
+        return len(self.points)
+
+    def radius(self, points, r):
+        """same as PointGrid.radius"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        query_num = len(points)
+        r = np.broadcast_to(np.asarray(r, dtype=np.float64), (query_num,))
+        if self.tree is None or query_num == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(query_num, dtype=np.int64)
+
+        hit_lists = self.tree.query_ball_point(points, r)
+        counts = np.array([len(hit_list) for hit_list in hit_lists], dtype=np.int64)
+        query = np.repeat(np.arange(query_num), counts)
+        hits = np.fromiter((i for hit_list in hit_lists for i in hit_list), dtype=np.int64, count=counts.sum())
+        dis = np.sqrt(((self.points[hits] - points[query]) ** 2).sum(axis=1))
+        query, hits, dis = _sort_hits(query, hits, dis)
+        return hits, dis, counts
+
+    def knn(self, points, k):
+        """same as PointGrid.knn"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        query_num = len(points)
+        res_idx = np.full((query_num, k), -1, dtype=np.int64)
+        res_dis = np.full((query_num, k), np.inf)
+        if self.tree is None or query_num == 0 or k == 0:
+            return res_idx, res_dis
+
+        # the k-th distance of scipy, then all points within it, so ties are broken by index as in PointGrid
+        k_eff = min(k, len(self.points))
+        dis, _ = self.tree.query(points, k=k_eff)
+        kth = dis.reshape(query_num, k_eff)[:, -1]
+        ids, dis, counts = self.radius(points, kth * (1 + 1e-9) + 1e-12)
+        return _first_k(ids, dis, counts, k)
+
+
+def create_point_index(points, backend=DEFAULT_POINT_BACKEND):
+    """
+    :param points: N*3 array
+    :param backend: string, one of POINT_INDEX_BACKENDS
+    :return: PointGrid or KDTreeIndex, both answer knn(points, k) and radius(points, r)
+    """
+    if backend == "auto":
+        backend = "grid" if cKDTree is None else "kdtree"
+    if backend == "grid":
+        return PointGrid(points)
+    if backend == "kdtree":
+        return KDTreeIndex(points)
+    raise Exception("[Error: ]Unknown point index backend {}, expect one of {}".format(backend, POINT_INDEX_BACKENDS))
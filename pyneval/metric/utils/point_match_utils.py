@@ -1,27 +1,22 @@
 import queue
-import kdtree
+import numpy as np
 from anytree import PreOrderIter
 from pyneval.model.swc_node import SwcTree
 from pyneval.metric.utils.config_utils import get_default_threshold
 from pyneval.metric.utils.config_utils import SAME_POS_TH
+from pyneval.metric.utils.point_index import create_point_index, DEFAULT_POINT_BACKEND
 
 
-# for length metric (unused)
-def get_kdtree_data(kd_node):
-    return kd_node[0].data
-
-
-def create_kdtree(node_list):
-    pos_node_dict = {}
-    center_list = []
-
-    for node in node_list:
-        if node.is_virtual():
-            continue
-        pos_node_dict[node.get_center_as_tuple()] = node
-        center_list.append(list(node.get_center_as_tuple()))
-    my_kdtree = kdtree.create(center_list)
-    return my_kdtree, pos_node_dict
+def create_node_index(node_list, backend=DEFAULT_POINT_BACKEND):
+    """
+    :param node_list: swc nodes, the virtual root is skipped
+    :param backend: string, see point_index.POINT_INDEX_BACKENDS
+    :return: point index of the node centers, and the indexed nodes: query results are positions in this list.
+        nodes on the same position are all kept
+    """
+    nodes = [node for node in node_list if not node.is_virtual()]
+    points = np.array([node.get_center()._pos for node in nodes], dtype=np.float64).reshape(-1, 3)
+    return create_point_index(points, backend=backend), nodes
 
 
 def get_swc2swc_dicts(src_node_list, tar_node_list):
@@ -29,18 +24,16 @@ def get_swc2swc_dicts(src_node_list, tar_node_list):
     get a dict mapping nodes from node list source to node list target
     if two nodes are mapped if they are on the same position
     '''
-    target_kd, pos_node_dict = create_kdtree(tar_node_list)
+    target_index, target_nodes = create_node_index(tar_node_list)
+    src_nodes = [node for node in src_node_list if not node.is_virtual()]
+    # find the closest pos for all gold nodes at once
+    nearest, _ = target_index.knn([node.get_center()._pos for node in src_nodes], k=1)
 
     src_tar_dict = {}
-
-    for src_node in src_node_list:
-        if src_node.is_virtual():
-            continue
-        # find the closest pos for gold node
-        target_pos = target_kd.search_knn(list(src_node.get_center_as_tuple()), k=1)[0]
-        target_node = pos_node_dict[tuple(target_pos[0].data)]
+    for src_node, target in zip(src_nodes, nearest[:, 0].tolist()):
+        target_node = target_nodes[target] if target >= 0 else None
         # only if gold and test nodes are very close(dis < 0.03), they can be considered as the same pos
-        if src_node.distance(target_node) < SAME_POS_TH:
+        if target_node is not None and src_node.distance(target_node) < SAME_POS_TH:
             src_tar_dict[src_node] = target_node
         else:
             src_tar_dict[src_node] = None
@@ -0,0 +1,118 @@
+import numpy as np
+
+from pyneval.model.euclidean_point import point_segment_pairs
+from pyneval.metric.utils.point_index import create_point_index, DEFAULT_POINT_BACKEND
+from pyneval.metric.utils.segment_index import MIN_CELL_SIZE
+
+# samples of a tree are measured in chunks of about SAMPLE_CHUNK_SIZE points
+SAMPLE_CHUNK_SIZE = 1 << 16
+
+
+def get_tree_segments(swc_tree):
+    """
+    :param swc_tree: SwcTree, all rows are used, use get_copy first to drop unlinked nodes
+    :return: seg_a(M*3), seg_b(M*3), the edges from every node to its parent,
+        a root without children is a segment of length 0
+    """
+    xyz, pa = swc_tree.xyz, swc_tree.parent_index
+    sons = np.flatnonzero(pa >= 0)
+    alone = np.flatnonzero((pa < 0) & (np.bincount(pa[sons], minlength=len(pa)) == 0))
+    return np.r_[xyz[sons], xyz[alone]].reshape(-1, 3), np.r_[xyz[pa[sons]], xyz[alone]].reshape(-1, 3)
+
+
+def iter_edge_samples(swc_tree, sample_step, chunk_size=SAMPLE_CHUNK_SIZE):
+    """
+    points along the edges of swc_tree, generated chunk by chunk: all nodes, and on every edge the points
+    which cut it into ceil(length / sample_step) pieces of the same length
+    :param swc_tree: SwcTree, all rows are used
+    :param sample_step: float, the largest distance between two samples on an edge
+    :param chunk_size: int, number of samples per chunk, an edge is never cut into two chunks
+    :return: iterator of (xyz(K*3), radii(K), rows(K)), radii are interpolated along the edges,
+        rows are the rows of the nodes, -1 for the points on edges
+    """
+    xyz, radii, pa = swc_tree.xyz, swc_tree.radii, swc_tree.parent_index
+    for start in range(0, len(xyz), chunk_size):
+        rows = np.arange(start, min(start + chunk_size, len(xyz)))
+        yield xyz[rows], radii[rows], rows
+
+    sons = np.flatnonzero(pa >= 0)
+    lengths = swc_tree.edge_lengths()[sons]
+    counts = np.maximum(np.ceil(lengths / sample_step).astype(np.int64), 1) - 1
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(sons):
+        stop = max(int(np.searchsorted(ends, ends[start] - counts[start] + chunk_size, side='right')), start + 1)
+        edge, num = sons[start:stop], counts[start:stop]
+        owner = np.repeat(np.arange(len(edge)), num)
+        # j / n of the edge from the son, j = 1..n-1
+        t = (np.arange(num.sum()) - np.repeat(np.cumsum(num) - num, num) + 1) / np.repeat(num + 1, num)
+        son, parent = edge[owner], pa[edge[owner]]
+        yield xyz[son] + (xyz[parent] - xyz[son]) * t[:, None], radii[son] + (radii[parent] - radii[son]) * t, \
+            np.full(len(t), -1, dtype=np.int64)
+        start = stop
+
+
+class SegmentDistanceIndex:
+    """
+    exact distance from points to the closest of a set of segments.
+    every segment is covered by points at most "step" apart, kept in a point index. a segment at distance d
+    has a covering point within d + step / 2, so once the closest segment of the points in a ball of radius r
+    is closer than r - step / 2 no other segment can be closer. the radius is doubled until then
+    """
+
+    def __init__(self, seg_a, seg_b, backend=DEFAULT_POINT_BACKEND):
+        """
+        :param seg_a: M*3 array, one end of the segments
+        :param seg_b: M*3 array, the other end
+        :param backend: string, point index of the covering points, see point_index.POINT_INDEX_BACKENDS
+        """
+        self.seg_a = np.asarray(seg_a, dtype=np.float64).reshape(-1, 3)
+        self.seg_b = np.asarray(seg_b, dtype=np.float64).reshape(-1, 3)
+        sub = self.seg_b - self.seg_a
+        lengths = np.sqrt(sub[:, 0] * sub[:, 0] + sub[:, 1] * sub[:, 1] + sub[:, 2] * sub[:, 2])
+        # the median segment is covered by its two ends. segments of length 0 are left out of the median,
+        # and the step is at least the mean length, so there are at most 3 covering points per segment on average
+        nonzero = lengths[lengths > 0]
+        self.step = max(float(np.median(nonzero)), float(lengths.mean()), MIN_CELL_SIZE) if len(nonzero) else 1.0
+        pieces = np.maximum(np.ceil(lengths / self.step).astype(np.int64), 1)
+        self.owner = np.repeat(np.arange(len(lengths)), pieces + 1)
+        t = (np.arange(len(self.owner)) - np.repeat(np.cumsum(pieces + 1) - pieces - 1, pieces + 1)) / pieces[self.owner]
+        self.index = create_point_index(self.seg_a[self.owner] + sub[self.owner] * t[:, None], backend=backend)
+
+    def __len__(self):
+        return len(self.seg_a)
+
+    def nearest(self, points):
+        """
+        :param points: K*3 array
+        :return: distances(K, inf if there is no segment), indices of the closest segments(K, -1 if there is none)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        res_dis = np.full(len(points), np.inf)
+        res_seg = np.full(len(points), -1, dtype=np.int64)
+        if len(self.seg_a) == 0 or len(points) == 0:
+            return res_dis, res_seg
+
+        # no covering point is farther than the farthest corner of their bounding box
+        lo, hi = self.index.points.min(axis=0), self.index.points.max(axis=0)
+        max_dis = np.sqrt((np.maximum(np.abs(points - lo), np.abs(points - hi)) ** 2).sum(axis=1))
+        radius = np.full(len(points), self.step)
+        pending = np.arange(len(points))
+        while len(pending):
+            ids, _, counts = self.index.radius(points[pending], radius[pending])
+            # pairs of (point, segment), a segment is measured once per point
+            pairs = np.unique(np.repeat(pending, counts) * len(self.seg_a) + self.owner[ids])
+            query, seg = pairs // len(self.seg_a), pairs % len(self.seg_a)
+            dis, _, _ = point_segment_pairs(points[query], self.seg_a[seg], self.seg_b[seg])
+
+            # the closest segment of every point, ties by index
+            order = np.lexsort((seg, dis, query))
+            first = order[np.r_[True, query[order][1:] != query[order][:-1]]] if len(order) else order
+            res_dis[query[first]] = dis[first]
+            res_seg[query[first]] = seg[first]
+
+            done = (res_dis[pending] <= radius[pending] - self.step / 2) | (radius[pending] >= max_dis[pending])
+            pending = pending[~done]
+            res_dis[pending], res_seg[pending] = np.inf, -1
+            radius[pending] *= 2
+        return res_dis, res_seg
@@ -0,0 +1,150 @@
+import numpy as np
+
+# a cell is never smaller than this, and a grid has at most MAX_CELLS_PER_DIM cells along each axis
+MIN_CELL_SIZE = 1e-6
+MAX_CELLS_PER_DIM = 1 << 20
+# a box which touches more cells than this is not put into the cells, it is checked by every query
+MAX_CELLS_PER_BOX = 64
+
+
+def _cell_ranges(lo, hi, count):
+    """
+    enumerate the cells (i, j, k) of the ranges lo[m] <= cell <= hi[m], m = 0..M-1
+    :return: owner(index m of every cell), cells(number of cells * 3)
+    """
+    span = np.maximum(hi - lo + 1, 0)
+    sizes = span[:, 0] * span[:, 1] * span[:, 2]
+    owner = np.repeat(np.arange(len(lo)), sizes)
+    # position of every cell inside the range of its owner
+    k = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    span = span[owner]
+    cells = np.empty((len(owner), 3), dtype=np.int64)
+    cells[:, 2] = k % span[:, 2]
+    cells[:, 1] = k // span[:, 2] % span[:, 1]
+    cells[:, 0] = k // (span[:, 1] * span[:, 2])
+    return owner, cells + lo[owner]
+
+
+class SegmentGrid:
+    """
+    static index of axis aligned boxes (bounding boxes of segments) on a uniform grid, built in one
+    vectorized pass and queried in batches. a box which touches more than MAX_CELLS_PER_BOX cells is kept out of
+    the cells in a separate list of wide boxes, which every query checks directly, and a query which touches more
+    cells than there are boxes checks all boxes directly instead of walking its cells, so neither a long segment
+    nor a large query box blows up the cost. it answers the same queries as rtree.index.Index,
+    intersection and intersection_v, boxes are closed on both sides as in rtree.
+    the index only holds numpy arrays, so it pickles cheaply into worker processes.
+    ids of a query are returned in the order the boxes were given.
+    """
+
+    def __init__(self, mins, maxs, ids=None, cell_size=None):
+        """
+        :param mins: N*3 array, lower corners of the boxes
+        :param maxs: N*3 array, upper corners of the boxes
+        :param ids: N ints returned by queries, default 0..N-1
+        :param cell_size: edge length of a cell, default the median box size
+        """
+        self.mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        self.maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        if ids is None:
+            ids = np.arange(len(self.mins))
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+        if len(self.mins) == 0:
+            self.origin = np.zeros(3)
+            self.cell_size = 1.0
+            self.shape = np.ones(3, dtype=np.int64)
+            self.cell_keys = np.zeros(0, dtype=np.int64)
+            self.cell_offsets = np.zeros(1, dtype=np.int64)
+            self.cell_boxes = np.zeros(0, dtype=np.int64)
+            self.wide_boxes = np.zeros(0, dtype=np.int64)
+            return
+
+        self.origin = self.mins.min(axis=0)
+        extent = self.maxs.max(axis=0) - self.origin
+        if cell_size is None:
+            cell_size = np.median((self.maxs - self.mins).max(axis=1))
+        self.cell_size = float(max(cell_size, extent.max() / MAX_CELLS_PER_DIM, MIN_CELL_SIZE))
+        self.shape = (extent // self.cell_size).astype(np.int64) + 1
+
+        # every other box is listed in all cells it touches, cells are stored in CSR form sorted by key
+        lo, hi = self._cell_of(self.mins), self._cell_of(self.maxs)
+        wide = np.prod(hi - lo + 1, axis=1) > MAX_CELLS_PER_BOX
+        self.wide_boxes = np.flatnonzero(wide)
+        narrow = np.flatnonzero(~wide)
+        owner, cells = _cell_ranges(lo[narrow], hi[narrow], len(narrow))
+        keys = self._key_of(cells)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        self.cell_boxes = narrow[owner[order]]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        self.cell_keys = keys[starts]
+        self.cell_offsets = np.r_[starts, len(keys)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell_of(self, points):
+        cells = np.floor((points - self.origin) / self.cell_size)
+        return np.clip(cells, -1, self.shape).astype(np.int64)
+
+    def _key_of(self, cells):
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    def intersection_v(self, mins, maxs):
+        """
+        boxes which intersect the query boxes, batched like rtree.index.Index.intersection_v
+        :param mins: M*3 array, lower corners of the query boxes
+        :param maxs: M*3 array, upper corners of the query boxes
+        :return: ids(int64), counts(M), the hits of query m are ids[sum(counts[:m]):sum(counts[:m+1])]
+        """
+        mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        query_num = len(mins)
+        if len(self.ids) == 0 or query_num == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(query_num, dtype=np.int64)
+
+        # cells outside of the grid hold no box
+        lo = np.maximum(self._cell_of(mins), 0)
+        hi = np.minimum(self._cell_of(maxs), self.shape - 1)
+        # a query which spans more cells than there are boxes checks all boxes
+        spans = np.prod(np.maximum(hi - lo + 1, 0), axis=1)
+        wide = np.flatnonzero(spans > len(self.ids))
+        lo[wide], hi[wide] = 0, -1
+        query, cells = _cell_ranges(lo, hi, query_num)
+        keys = self._key_of(cells)
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys), max(len(self.cell_keys) - 1, 0))
+        found = self.cell_keys[pos] == keys if len(self.cell_keys) else np.zeros(len(keys), dtype=bool)
+        query, pos = query[found], pos[found]
+
+        # all (query, box) pairs of the touched cells
+        starts = self.cell_offsets[pos]
+        sizes = self.cell_offsets[pos + 1] - starts
+        narrow = np.setdiff1d(np.arange(query_num), wide)
+        query = np.r_[np.repeat(query, sizes), np.repeat(wide, len(self.ids)),
+                      np.repeat(narrow, len(self.wide_boxes))]
+        boxes = np.r_[self.cell_boxes[np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())],
+                      np.tile(np.arange(len(self.ids)), len(wide)), np.tile(self.wide_boxes, len(narrow))]
+
+        hit = np.all((self.mins[boxes] <= maxs[query]) & (mins[query] <= self.maxs[boxes]), axis=1)
+        # a box in several cells is reported once, pairs sorted by query, then by box
+        pairs = np.unique(query[hit] * len(self.ids) + boxes[hit])
+        query, boxes = pairs // len(self.ids), pairs % len(self.ids)
+        return self.ids[boxes], np.bincount(query, minlength=query_num)
+
+    def intersection(self, coordinates):
+        """ids of the boxes which intersect one box (minx, miny, minz, maxx, maxy, maxz), as rtree"""
+        coordinates = np.asarray(coordinates, dtype=np.float64)
+        ids, _ = self.intersection_v(coordinates[None, :3], coordinates[None, 3:])
+        return ids.tolist()
+
+    def radius_v(self, points, radius):
+        """
+        boxes which intersect the cube of half size "radius" around every point
+        :param points: M*3 array
+        :param radius: float or M floats
+        :return: ids, counts as intersection_v
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), (len(points),))[:, None]
+        return self.intersection_v(points - radius, points + radius)
@@ -1,6 +1,6 @@
 import jsonschema
-import queue
 import math
+from collections import deque
 
 from pyneval.io import read_json
 from pyneval.io.swc_writer import swc_save
@@ -36,9 +36,9 @@ def get_dis(tuple_1, tuple_2):
 
 
 def cal_label(node, test_tiff, thres_intensity, max_step=0):
-    que = queue.Queue()
+    que = deque()
     center = [round(node.get_x()), round(node.get_y()), round(node.get_z())]
-    que.put(tuple([center, 0]))
+    que.append(tuple([center, 0]))
     vis = set()
     vis.add(tuple(center))
 
@@ -47,8 +47,8 @@ def cal_label(node, test_tiff, thres_intensity, max_step=0):
         [-1, 0, 0], [0, -1, 0], [0, 0, -1]
     ]
 
-    while not que.empty():
-        cur = que.get()
+    while que:
+        cur = que.popleft()
         cur_loc = cur[0]
         cur_step = cur[1]
         if cur_step > max_step:
@@ -66,8 +66,8 @@ def cal_label(node, test_tiff, thres_intensity, max_step=0):
             dz = cur_loc[2] + stp[i][2]
             new_pos = tuple([dx, dy, dz])
             if new_pos not in vis:
-                vis.add(tuple([new_pos, cur_step + 1]))
-                que.put(tuple([new_pos, cur_step + 1]))
+                vis.add(new_pos)
+                que.append(tuple([new_pos, cur_step + 1]))
     return None
 
 
@@ -2,7 +2,6 @@ from anytree import NodeMixin
 from pyneval.model.euclidean_point import EuclideanPoint
 import copy
 import math
-import queue
 
 _3D = "3d"
 _2D = "2d"
@@ -85,25 +84,23 @@ class BinaryNode(NodeMixin):
         print("---------------------------")
 
     def print_tree(self):
-        q = queue.LifoQueue()
-        q.put(self)
-        while not q.empty():
-            cur = q.get()
+        stack = [self]
+        while stack:
+            cur = stack.pop()
             if cur is None:
                 continue
             cur.to_str()
-            q.put(cur.left_son)
-            q.put(cur.right_son)
+            stack.append(cur.left_son)
+            stack.append(cur.right_son)
 
     def get_node_list(self):
         node_list = list()
-        stack = queue.LifoQueue()
-        stack.put(self)
+        stack = [self]
 
-        while not stack.empty():
-            node = stack.get()
+        while stack:
+            node = stack.pop()
             node_list.append(node)
             if node.has_children():
-                stack.put(node.left_son)
-                stack.put(node.right_son)
+                stack.append(node.left_son)
+                stack.append(node.right_son)
         return node_list
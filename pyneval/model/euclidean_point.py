@@ -2,14 +2,93 @@ import numpy as np
 import math
 from pyneval.metric.utils.config_utils import EPS
 
+
+def _project(points, seg_a, seg_b, clamp):
+    """
+    project points on segments a->b, all arguments are (broadcastable) ...*3 float arrays
+    :return: distances(...), foot points(...*3), t(...), foot = a + t*(b-a)
+    """
+    b_a = seg_b - seg_a
+    a_p = seg_a - points
+    k_up = -(a_p[..., 0]*b_a[..., 0] + a_p[..., 1]*b_a[..., 1] + a_p[..., 2]*b_a[..., 2])
+    k_down = b_a[..., 0]**2 + b_a[..., 1]**2 + b_a[..., 2]**2
+    # a degenerate segment is the point a
+    degenerate = k_down < EPS
+    t = np.divide(k_up, k_down, out=np.zeros(np.shape(k_up)), where=~degenerate)
+    foot = t[..., None]*b_a + seg_a
+    if clamp:
+        # the ends are taken as they are, a + 1*(b-a) may not be exactly b
+        foot = np.where((t <= 0)[..., None], seg_a, np.where((t >= 1)[..., None], seg_b, foot))
+        t = np.clip(t, 0.0, 1.0)
+    foot = np.where(degenerate[..., None], seg_a, foot)
+    sub = points - foot
+    dis = np.sqrt(sub[..., 0]*sub[..., 0] + sub[..., 1]*sub[..., 1] + sub[..., 2]*sub[..., 2])
+    return dis, foot, t
+
+
+def _project_one(p, a, b, clamp):
+    """
+    _project for a single point and segment in plain python, the scalar methods use it
+    because numpy costs more than the arithmetic for one pair. results are the same as _project
+    """
+    b_a = [b[0]-a[0], b[1]-a[1], b[2]-a[2]]
+    a_p = [a[0]-p[0], a[1]-p[1], a[2]-p[2]]
+    k_up = -(a_p[0]*b_a[0] + a_p[1]*b_a[1] + a_p[2]*b_a[2])
+    k_down = b_a[0]**2 + b_a[1]**2 + b_a[2]**2
+    if k_down < EPS:
+        t = 0.0
+        foot = [a[0], a[1], a[2]]
+    else:
+        t = k_up/k_down
+        if clamp and t <= 0:
+            t = 0.0
+            foot = [a[0], a[1], a[2]]
+        elif clamp and t >= 1:
+            t = 1.0
+            foot = [b[0], b[1], b[2]]
+        else:
+            foot = [t*b_a[0] + a[0], t*b_a[1] + a[1], t*b_a[2] + a[2]]
+    sub = [p[0]-foot[0], p[1]-foot[1], p[2]-foot[2]]
+    return math.sqrt(sub[0]*sub[0] + sub[1]*sub[1] + sub[2]*sub[2]), foot, t
+
+
+def point_segment_pairs(points, seg_a, seg_b, clamp=True):
+    """
+    distance of M aligned (point, segment) pairs, points[i] against the segment seg_a[i]->seg_b[i]
+    :param points: M*3 array, a single point (3) is broadcast to all segments
+    :param seg_a: M*3 array, one end of the segments
+    :param seg_b: M*3 array, the other end
+    :param clamp: True: closest point on the segment, False: foot point on the infinite line
+    :return: distances(M), foot points(M*3) and t(M), foot = a + t*(b-a).
+        a segment shorter than sqrt(EPS) is treated as the point a, its t is 0
+    """
+    points = np.asarray(points, dtype=np.float64)
+    seg_a = np.asarray(seg_a, dtype=np.float64)
+    seg_b = np.asarray(seg_b, dtype=np.float64)
+    return _project(points, seg_a, seg_b, clamp)
+
+
+def point_segment_matrix(points, seg_a, seg_b, clamp=True):
+    """
+    distance of every one of M points to every one of K segments seg_a[j]->seg_b[j]
+    :return: distances(M*K), foot points(M*K*3) and t(M*K), see point_segment_pairs
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 3)
+    seg_a = np.asarray(seg_a, dtype=np.float64).reshape(1, -1, 3)
+    seg_b = np.asarray(seg_b, dtype=np.float64).reshape(1, -1, 3)
+    return _project(points, seg_a, seg_b, clamp)
+
+
 class EuclideanPoint(object):
     '''
     geometry node without volume
     for point-line calculate
     '''
+    __slots__ = ("_pos",)
+
     def __init__(self,
                  center=[0, 0, 0]):
-        if not isinstance(center, list):
+        if not isinstance(center, (list, np.ndarray)):
             raise Exception("[Error: ]not a list")
         self._pos = center
 
@@ -49,31 +128,13 @@ class EuclideanPoint(object):
         return True
 
     def get_foot_point(self, line):
-        p = self._pos
-        a = line.coords[0]
-        b = line.coords[1]
-        a_p = [a[0]-p[0], a[1]-p[1], a[2]-p[2]]
-        b_a = [b[0]-a[0], b[1]-a[1], b[2]-a[2]]
-
-        k_up = -(a_p[0]*b_a[0]+a_p[1]*b_a[1]+a_p[2]*b_a[2])
-        k_down = b_a[0]**2+b_a[1]**2+b_a[2]**2
-        if k_down < EPS:
-            raise Exception("[Error: ] Line {} {} is just a point".format(a, b))
-        k = k_up/k_down
-        foot = [k*b_a[0]+a[0], k*b_a[1]+a[1], k*b_a[2]+a[2]]
+        """foot point on the infinite line, the end coords[0] for a degenerate line"""
+        _, foot, _ = _project_one(self._pos, line.coords[0], line.coords[1], clamp=False)
         return EuclideanPoint(foot)
 
     def get_closest_point(self, line):
-        foot = self.get_foot_point(line)
-        if foot.on_line(line):
-            return foot
-        else:
-            dis1 = self.distance(EuclideanPoint(center=line.coords[0]))
-            dis2 = self.distance(EuclideanPoint(center=line.coords[1]))
-            if dis1 <dis2:
-                return EuclideanPoint(center=line.coords[0])
-            else:
-                return EuclideanPoint(center=line.coords[1])
+        _, foot, _ = _project_one(self._pos, line.coords[0], line.coords[1], clamp=True)
+        return EuclideanPoint(foot)
 
     def on_line(self, line):
         p = self._pos
@@ -87,7 +148,7 @@ class EuclideanPoint(object):
         return False
 
     def distance_to_point(self, point):
-        if isinstance(point, list) and len(point) == 3:
+        if isinstance(point, (list, np.ndarray)) and len(point) == 3:
             point = EuclideanPoint(point)
         if not isinstance(point, EuclideanPoint):
             raise Exception("[Error:  ] expect point. got {}".format(point))
@@ -98,7 +159,7 @@ class EuclideanPoint(object):
         return math.sqrt(sub[0]*sub[0] + sub[1]*sub[1] + sub[2]*sub[2])
 
     def distance_to_point_2d(self, point):
-        if isinstance(point, list) and len(point) == 3:
+        if isinstance(point, (list, np.ndarray)) and len(point) == 3:
             point = EuclideanPoint(point)
         if not isinstance(point, EuclideanPoint):
             raise Exception("[Error:  ] expect point. got {}".format(point))
@@ -109,18 +170,12 @@ class EuclideanPoint(object):
         return math.sqrt(sub[0]*sub[0] + sub[1]*sub[1])
 
     def distance_to_line(self, line):
-        foot = self.get_foot_point(line)
-        return self.distance_to_point(foot)
+        dis, _, _ = _project_one(self._pos, line.coords[0], line.coords[1], clamp=False)
+        return dis
 
     def distance_to_segment(self, line):
-        foot = self.get_foot_point(line)
-        # foot = EuclideanPoint([0, 0, 0])
-        if foot.on_line(line):
-            return self.distance_to_point(foot)
-        else:
-            dis1 = self.distance_to_point(line.coords[0])
-            dis2 = self.distance_to_point(line.coords[1])
-            return min(dis1, dis2)
+        dis, _, _ = _project_one(self._pos, line.coords[0], line.coords[1], clamp=True)
+        return dis
 
     def distance(self, obj):
         if isinstance(obj, EuclideanPoint):
@@ -139,6 +194,8 @@ class Line:
     consist of two EuclideanPoint
     coords[0] and coords[1]
     '''
+    __slots__ = ("coords", "is_segment")
+
     def __init__(self,
                  coords=None,
                  e_node_1=None,
@@ -0,0 +1,172 @@
+"""
+path queries on a parent index (e.g. SwcTree.parent_index, see pyneval/model/traversal.py).
+
+PathIndex splits the tree into heavy paths (heavy-light decomposition): the rows of a heavy path
+get consecutive positions, and the route from any row to the root crosses O(log n) heavy paths.
+a route is therefore a few position ranges, which PathMarks answers with a Fenwick tree.
+"""
+import numpy as np
+
+from pyneval.model.traversal import pre_order_index, children_index
+
+
+class PathIndex:
+    """
+    static heavy-light decomposition of a forest given by a parent index.
+    rows are the dense node indices, -1 stands for the virtual root above all trees.
+    root_dis[i] is the length of the route from the root of its tree to row i,
+    so a route length is a difference of two prefix sums.
+    """
+
+    def __init__(self, parent_index, edge_lengths):
+        """
+        :param parent_index: parent row of every row, -1 for roots, -2 for unlinked rows
+        :param edge_lengths: length of the edge between every row and its parent
+        """
+        parent_index = np.asarray(parent_index, dtype=np.int64)
+        edge_lengths = np.asarray(edge_lengths, dtype=np.float64)
+        n = len(parent_index)
+        order = pre_order_index(parent_index).tolist()
+        pa = parent_index.tolist()
+        lengths = edge_lengths.tolist()
+
+        depth = [0] * n
+        root_dis = [0.0] * n
+        for row in order:
+            p = pa[row]
+            if p >= 0:
+                depth[row] = depth[p] + 1
+                root_dis[row] = root_dis[p] + lengths[row]
+
+        # the heavy child of a row is its child with the largest subtree, the first one on ties
+        size = [1] * n
+        for row in reversed(order):
+            if pa[row] >= 0:
+                size[pa[row]] += size[row]
+        heavy = [-1] * n
+        for row in order:
+            p = pa[row]
+            if p >= 0 and (heavy[p] == -1 or size[row] > size[heavy[p]]):
+                heavy[p] = row
+
+        # number rows heavy child first, so every heavy path is a range of positions
+        offsets, child_rows = children_index(parent_index)
+        offsets = offsets.tolist()
+        child_rows = child_rows.tolist()
+        head = list(range(n))
+        pos = [-1] * n
+        stack = child_rows[offsets[n]:offsets[n + 1]][::-1]
+        cur_pos = 0
+        while stack:
+            row = stack.pop()
+            pos[row] = cur_pos
+            cur_pos += 1
+            for son in reversed(child_rows[offsets[row]:offsets[row + 1]]):
+                if son != heavy[row]:
+                    stack.append(son)
+            if heavy[row] != -1:
+                head[heavy[row]] = head[row]
+                stack.append(heavy[row])
+
+        self.parent = pa
+        self.depth = depth
+        self.root_dis = root_dis
+        self.head = head
+        self.pos = pos
+        self.size = cur_pos
+
+    def lca(self, u, v):
+        """
+        lowest common ancestor of rows u and v, -1 if they lay in different trees
+        """
+        head, depth, parent = self.head, self.depth, self.parent
+        if u < 0 or v < 0:
+            return -1
+        while head[u] != head[v]:
+            if depth[head[u]] < depth[head[v]]:
+                u, v = v, u
+            u = parent[head[u]]
+            if u < 0:
+                return -1
+        return u if depth[u] <= depth[v] else v
+
+    def path_length(self, u, v):
+        """
+        length of the route between rows u and v, None if they lay in different trees
+        """
+        w = self.lca(u, v)
+        if w < 0:
+            return None
+        return self.root_dis[u] + self.root_dis[v] - 2 * self.root_dis[w]
+
+    def path_rows(self, u, w):
+        """rows on the route from u up to its ancestor w, u included and w excluded"""
+        parent = self.parent
+        rows = []
+        while u != w and u >= 0:
+            rows.append(u)
+            u = parent[u]
+        return rows
+
+    def path_ranges(self, u, w):
+        """
+        position ranges [lo, hi] of the rows on the route from u up to its ancestor w,
+        u included and w excluded. w = -1 means up to the root, the root included
+        """
+        head, pos, parent = self.head, self.pos, self.parent
+        ranges = []
+        while u != w and u >= 0 and pos[u] >= 0:
+            h = head[u]
+            if w >= 0 and head[w] == h:
+                ranges.append((pos[w] + 1, pos[u]))
+                break
+            ranges.append((pos[h], pos[u]))
+            u = parent[h]
+        return ranges
+
+
+class PathMarks:
+    """
+    marked rows of a PathIndex, a row is marked at most once and never unmarked.
+    the marks are counted by a Fenwick tree over the positions of the rows
+    """
+
+    def __init__(self, path_index):
+        self.path_index = path_index
+        self.marked = [False] * len(path_index.pos)
+        self.tree = [0] * (path_index.size + 1)
+
+    def _prefix(self, k):
+        # number of marked positions in [0, k)
+        tree = self.tree
+        res = 0
+        while k > 0:
+            res += tree[k]
+            k -= k & -k
+        return res
+
+    def is_marked(self, row):
+        return row >= 0 and self.marked[row]
+
+    def mark(self, row):
+        if row < 0 or self.marked[row]:
+            return
+        self.marked[row] = True
+        tree = self.tree
+        # rows which are not linked to the root have no position, they are never on a route
+        k = self.path_index.pos[row] + 1
+        while 0 < k < len(tree):
+            tree[k] += 1
+            k += k & -k
+
+    def any_marked(self, u, w):
+        """check if any row on the route from u up to its ancestor w is marked, u included, w excluded"""
+        for lo, hi in self.path_index.path_ranges(u, w):
+            if self._prefix(hi + 1) > self._prefix(lo):
+                return True
+        return False
+
+    def mark_path(self, u, w):
+        """mark all rows on the route from u up to its ancestor w, u included, w excluded"""
+        for row in self.path_index.path_rows(u, w):
+            self.mark(row)
@@ -1,12 +1,21 @@
 # bennieHan 2019-11-12 16:01
 # all right reserved
 
-from anytree import NodeMixin, iterators, RenderTree
+from anytree import NodeMixin, RenderTree
 from pyneval.model.euclidean_point import EuclideanPoint
+from pyneval.io import swc_cache
+from pyneval.model.traversal import pre_order, pre_order_index, post_order_index
+from pyneval.model.path_index import PathIndex
 from anytree import PreOrderIter
 
+try:
+    # slotted version of NodeMixin, anytree >= 2.9
+    from anytree.node.lightnodemixin import LightNodeMixin
+except ImportError:
+    LightNodeMixin = NodeMixin
+
 import math
-import queue
+import warnings
 import numpy as np
 import copy
 
@@ -18,25 +27,28 @@ def Make_Virtual():
     return SwcNode(nid=-1, center=EuclideanPoint(center=[0, 0, 0]))
 
 
-def get_nearby_swc_node_list(gold_node, test_kdtree, test_pos_node_dict, threshold):
+def get_nearby_swc_node_list(gold_node, test_index, test_nodes, threshold, nearest=None):
     '''
-    find all nodes in "test_swc_list" which are close enough to "gold_node"
+    find the nodes in "test_nodes" which are close enough to "gold_node", among its 5 closest nodes
     sort them by distance
 
     :param gold_node: swc_node
-    :param test_swc_list:
+    :param test_index: point index of test_nodes (point_match_utils.create_node_index)
+    :param test_nodes: list of swc nodes
     :param threshold:
+    :param nearest: indices of the 5 closest test nodes if they are already queried in a batch
     :return:
     '''
     if gold_node.is_virtual():
         return
     tmp_list = []
     # find the closest pos for gold node
-    target_pos_list = test_kdtree.search_knn(list(gold_node.get_center_as_tuple()), k=5)
-    for pos in target_pos_list:
-        target_node = test_pos_node_dict[tuple(pos[0].data)]
-        if target_node.is_virtual() or gold_node.is_virtual():
+    if nearest is None:
+        nearest = test_index.knn([gold_node.get_center()._pos], k=5)[0][0].tolist()
+    for target in nearest:
+        if target < 0:
             continue
+        target_node = test_nodes[target]
         # only if gold and test nodes are very close(dis < 0.03), they can be considered as the same pos
         if gold_node.distance(target_node) < threshold:
             tmp_list.append(tuple([target_node, target_node.distance(gold_node)]))
@@ -116,7 +128,74 @@ def get_lca(u, v):
     return None
 
 
-class SwcNode(NodeMixin):
+def parse_swc_lines(lines):
+    """parse the lines of a SWC file in one pass
+
+    :param lines: list of strings, lines of a SWC file
+    :return: N*7 float array, columns are id, type, x, y, z, radius and parent id.
+        comment lines, empty lines and lines which do not have 7 columns are skipped
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            data = np.loadtxt(lines, comments='#', ndmin=2, dtype=np.float64)
+    except ValueError:
+        data = None
+    if data is None or (data.size > 0 and data.shape[1] != 7):
+        lines = [line for line in lines
+                 if not line.strip().startswith('#') and len(line.split('#')[0].split()) == 7]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            data = np.loadtxt(lines, comments='#', ndmin=2, dtype=np.float64)
+    if data.size == 0:
+        return np.zeros(shape=(0, 7), dtype=np.float64)
+    return data
+
+
+class DiademData:
+    """
+    the fields of a SwcNode which only the diadem metric uses,
+    a node creates its record the first time one of them is written
+    """
+    __slots__ = ("surface_area", "volume",
+                 "parent_trajectory", "left_trajectory", "right_trajectory",
+                 "path_length", "xy_path_length", "z_path_length")
+
+    def __init__(self,
+                 surface_area=0.0,
+                 volume=0.0,
+                 parent_trajectory=None,
+                 left_trajectory=None,
+                 right_trajectory=None,
+                 path_length=0.0,
+                 xy_path_length=0.0,
+                 z_path_length=0.0):
+        self.surface_area = surface_area
+        self.volume = volume
+        self.parent_trajectory = parent_trajectory
+        self.left_trajectory = left_trajectory
+        self.right_trajectory = right_trajectory
+        self.path_length = path_length
+        self.xy_path_length = xy_path_length
+        self.z_path_length = z_path_length
+
+
+_DIADEM_DEFAULT = DiademData()
+
+
+def _diadem_field(name):
+    """property of SwcNode stored in its DiademData record"""
+    def getter(node):
+        return getattr(node._diadem or _DIADEM_DEFAULT, name)
+
+    def setter(node, value):
+        if node._diadem is None:
+            node._diadem = DiademData()
+        setattr(node._diadem, name, value)
+    return property(getter, setter)
+
+
+class SwcNode(LightNodeMixin):
     """
         this is a class that temporarily store SWC file
         Attributes:
@@ -136,7 +215,22 @@ class SwcNode(NodeMixin):
         path_length: distance to parent
         xy_path_length: distance to parent regardless z coordinate
         z_path_lenth: distance to parent
+
+        id, type, center, radius, depth and root_length of a node attached to a SwcTree
+        are read from and written to the column arrays of the tree.
+        the diadem fields (surface_area ... z_path_length) live in a DiademData record
+        which is only created when one of them is written
     """
+    __slots__ = ("_tree", "_idx", "_nid", "_ntype", "_npos", "_nradius", "_ndepth", "_nroot_length", "_diadem")
+
+    surface_area = _diadem_field("surface_area")
+    volume = _diadem_field("volume")
+    parent_trajectory = _diadem_field("parent_trajectory")
+    left_trajectory = _diadem_field("left_trajectory")
+    right_trajectory = _diadem_field("right_trajectory")
+    path_length = _diadem_field("path_length")
+    xy_path_length = _diadem_field("xy_path_length")
+    z_path_length = _diadem_field("z_path_length")
 
     def __init__(self,
                  nid=-1,
@@ -157,23 +251,141 @@ class SwcNode(NodeMixin):
                  path_length=0.0,
                  xy_path_length=0.0,
                  z_path_lenth=0.0):
-        self._id = nid
-        self._type = ntype
+        # a node is a view of one row in the column arrays of its SwcTree.
+        # before it is attached to a tree, the row data is kept on the node itself
+        self._tree = None
+        self._idx = -1
+        self._nid = nid
+        self._ntype = ntype
+        self._npos = center
+        self._nradius = radius
+        self._ndepth = depth
+        self._nroot_length = route_length
+
+        diadem_data = DiademData(surface_area, volume,
+                                 parent_trajectory, left_trajectory, right_trajectory,
+                                 path_length, xy_path_length, z_path_lenth)
+        self._diadem = None
+        if any(getattr(diadem_data, name) != getattr(_DIADEM_DEFAULT, name) for name in DiademData.__slots__):
+            self._diadem = diadem_data
+
+        # attach at last, the tree copies the row data when a new node is attached
         self.parent = parent
-        self._pos = center
-        self._radius = radius
-        self.surface_area = surface_area
-        self.volume = volume
-        self._depth = depth
 
-        self.parent_trajectory = parent_trajectory
-        self.left_trajectory = left_trajectory
-        self.right_trajectory = right_trajectory
+    @classmethod
+    def _view(cls, tree, idx):
+        """create a node which reads and writes the row "idx" of "tree"
+        """
+        node = cls.__new__(cls)
+        node._tree = tree
+        node._idx = idx
+        node._npos = EuclideanPoint(center=tree._xyz[idx])
+        node._diadem = None
+        return node
+
+    @property
+    def _id(self):
+        if self._idx < 0:
+            return self._nid
+        return self._tree._ids.item(self._idx)
+
+    @_id.setter
+    def _id(self, nid):
+        if self._idx < 0:
+            self._nid = nid
+        else:
+            tree = self._tree
+            old_nid = tree._ids.item(self._idx)
+            tree._unindex_id(old_nid, self._idx)
+            tree._ids[self._idx] = nid
+            tree._index_id(nid, self._idx)
+            if old_nid in tree.id_set:
+                tree.id_set.discard(old_nid)
+                tree.id_set.add(nid)
+
+    @property
+    def _type(self):
+        if self._idx < 0:
+            return self._ntype
+        return self._tree._types.item(self._idx)
+
+    @_type.setter
+    def _type(self, ntype):
+        if self._idx < 0:
+            self._ntype = ntype
+        else:
+            self._tree._types[self._idx] = ntype
+
+    @property
+    def _radius(self):
+        if self._idx < 0:
+            return self._nradius
+        return self._tree._radii.item(self._idx)
+
+    @_radius.setter
+    def _radius(self, radius):
+        if self._idx < 0:
+            self._nradius = radius
+        else:
+            self._tree._radii[self._idx] = radius
+            self._tree._revision += 1
 
-        self.root_length = route_length
-        self.path_length = path_length
-        self.xy_path_length = xy_path_length
-        self.z_path_length = z_path_lenth
+    @property
+    def _pos(self):
+        return self._npos
+
+    @_pos.setter
+    def _pos(self, center):
+        if self._idx < 0:
+            self._npos = center
+        else:
+            self._tree._xyz[self._idx] = center._pos
+            self._tree._invalidate_lengths()
+
+    @property
+    def _depth(self):
+        if self._idx < 0:
+            return self._ndepth
+        return self._tree._depths.item(self._idx)
+
+    @_depth.setter
+    def _depth(self, depth):
+        if self._idx < 0:
+            self._ndepth = depth
+        else:
+            self._tree._depths[self._idx] = depth
+
+    @property
+    def root_length(self):
+        if self._idx < 0:
+            return self._nroot_length
+        return self._tree._root_lengths.item(self._idx)
+
+    @root_length.setter
+    def root_length(self, root_length):
+        if self._idx < 0:
+            self._nroot_length = root_length
+        else:
+            self._tree._root_lengths[self._idx] = root_length
+
+    def _post_attach(self, parent):
+        tree = getattr(parent, "_tree", None)
+        if tree is None:
+            return
+        if self._tree is None:
+            tree._register(self)
+        if self._tree is tree:
+            tree._pa[self._idx] = parent._idx
+            tree._invalidate_lengths()
+
+    def _post_detach(self, parent):
+        if self._idx >= 0:
+            self._tree._pa[self._idx] = -2
+            self._tree._invalidate_lengths()
+
+    def _moved(self):
+        if self._tree is not None:
+            self._tree._invalidate_lengths()
 
     def set_id(self, id):
         self._id = id
@@ -181,6 +393,10 @@ class SwcNode(NodeMixin):
     def get_id(self):
         return self._id
 
+    def get_index(self):
+        """dense index (row) of the node in its SwcTree, 0..N-1, -1 for the virtual root or a free node"""
+        return self._idx
+
     def get_x(self):
         return self._pos.get_x()
 
@@ -192,12 +408,15 @@ class SwcNode(NodeMixin):
 
     def set_x(self, x):
         self._pos.set_x(x)
+        self._moved()
 
     def set_y(self, y):
         self._pos.set_y(y)
+        self._moved()
 
     def set_z(self, z):
         self._pos.set_z(z)
+        self._moved()
 
     def set_r(self, r):
         self._radius = r
@@ -206,12 +425,11 @@ class SwcNode(NodeMixin):
         return self._pos
 
     def get_center_as_tuple(self):
-        return tuple([round(self.get_x(), 2), round(self.get_y(), 2), round(self.get_z(), 2)])
+        return tuple([round(float(self.get_x()), 2), round(float(self.get_y()), 2), round(float(self.get_z()), 2)])
 
     def set_center(self, center):
         if not isinstance(center, EuclideanPoint):
             raise Exception("[Error: ]not EuclideanPoint")
-        del self._pos
         self._pos = center
 
     def depth(self):
@@ -279,9 +497,10 @@ class SwcNode(NodeMixin):
         """Transform a node by scaling
         """
 
-        self._pos[0] *= sx
-        self._pos[1] *= sy
-        self._pos[2] *= sz
+        self._pos._pos[0] *= sx
+        self._pos._pos[1] *= sy
+        self._pos._pos[2] *= sz
+        self._moved()
 
         if adjusting_radius:
             self._radius *= math.sqrt(sx * sy)
@@ -300,66 +519,256 @@ class SwcNode(NodeMixin):
             self._id, self._type, self.get_x(), self.get_y(), self.get_z(), self._radius, self.parent.get_id())
 
     def __str__(self):
-        return '%d (%d): %s, %g' % (self._id, self._type, str(self.get_center()._pos), self._radius)
+        return '%d (%d): %s, %g' % (self._id, self._type, str([float(c) for c in self.get_center()._pos]), self._radius)
 
 
 class SwcTree:
     """A class for representing one or more SWC trees.
     For simplicity, we always assume that the root is a virtual node.
+
+    Node data is stored column by column in contiguous numpy arrays, one row per node:
+        _ids(int64), _types(int64), _xyz(N*3 float64), _radii(float64),
+        _pa(int64, row index of the parent, -1 for children of the virtual root, -2 for detached rows),
+        _depths(int64) and _root_lengths(float64).
+    Only the first "_n" rows are used, the rest is spare capacity for added nodes.
+    SwcNode objects are views of these rows, they are created the first time a caller asks for nodes.
     """
 
     def __init__(self):
-        self._root = Make_Virtual()
+        self._root = None
+        self._nodes = None
         self._size = None
         self._total_length = None
+        self._edge_lengths = None
+        self._path_index = None
+        # bumped by every change of positions, radii, links or ids, see get_revision
+        self._revision = 0
 
         self.id_set = set()
+        # id -> row of every node in the column arrays, kept up to date by all mutators
+        self._id_index = {}
         self.depth_array = None
+        self._depth_np = None
         self.LOG_NODE_NUM = None
         self.lca_parent = None
         self.node_list = None
         self.id_node_dict = None
+        self._init_columns(0)
+
+    def _init_columns(self, capacity):
+        self._n = 0
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._types = np.zeros(capacity, dtype=np.int64)
+        self._xyz = np.zeros(shape=(capacity, 3), dtype=np.float64)
+        self._radii = np.zeros(capacity, dtype=np.float64)
+        self._pa = np.full(capacity, -2, dtype=np.int64)
+        self._depths = np.zeros(capacity, dtype=np.int64)
+        self._root_lengths = np.zeros(capacity, dtype=np.float64)
+
+    def _reserve(self, capacity):
+        """grow the column arrays to "capacity" rows, keep the used rows"""
+        n = self._n
+        old = (self._ids, self._types, self._xyz, self._radii, self._pa, self._depths, self._root_lengths)
+        self._init_columns(capacity)
+        self._n = n
+        for new_col, old_col in zip((self._ids, self._types, self._xyz, self._radii,
+                                     self._pa, self._depths, self._root_lengths), old):
+            new_col[:n] = old_col[:n]
+        # node views must point to the new buffer
+        if self._nodes is not None:
+            for node in self._nodes:
+                node._npos._pos = self._xyz[node._idx]
+
+    def _set_columns(self, ids, types, xyz, radii, pa):
+        """replace the whole tree by the given columns, nodes are not created here"""
+        self._root = None
+        self._nodes = None
+        self.node_list = None
+        self.id_node_dict = None
+        self._invalidate_lengths()
+        n = len(ids)
+        self._init_columns(n)
+        self._n = n
+        self._ids[:] = ids
+        self._types[:] = types
+        self._xyz[:] = xyz
+        self._radii[:] = radii
+        self._pa[:] = pa
+        self.id_set = set(self._ids.tolist())
+        self._id_index = dict(zip(self._ids.tolist(), range(n)))
+        self._update_depth_and_root_length()
+
+    def _register(self, node):
+        """append a new node (and its detached descendants) to the column arrays"""
+        stack = [node]
+        while stack:
+            cur = stack.pop()
+            idx = self._n
+            if idx == len(self._ids):
+                self._reserve(max(16, idx * 2))
+            self._ids[idx] = cur._nid
+            self._types[idx] = cur._ntype
+            self._xyz[idx] = cur._npos._pos
+            self._radii[idx] = cur._nradius
+            self._pa[idx] = -2
+            self._depths[idx] = cur._ndepth
+            self._root_lengths[idx] = cur._nroot_length
+            self._n += 1
+
+            cur._tree = self
+            cur._idx = idx
+            self._index_id(cur._nid, idx)
+            cur._npos = EuclideanPoint(center=self._xyz[idx])
+            self._nodes.append(cur)
+            if cur.parent is not None and cur.parent._tree is self:
+                self._pa[idx] = cur.parent._idx
+            stack.extend(cur.children)
+
+    def _index_id(self, nid, idx):
+        self._id_index[nid] = idx
+        self.id_node_dict = None
+        self._revision += 1
+
+    def _unindex_id(self, nid, idx):
+        if self._id_index.get(nid) == idx:
+            del self._id_index[nid]
+        self.id_node_dict = None
+        self._revision += 1
+
+    def _materialize(self):
+        """create SwcNode views for all rows and link them as in the parent index"""
+        self._root = Make_Virtual()
+        self._root._tree = self
+        self._nodes = [SwcNode._view(self, i) for i in range(self._n)]
+        pa = self._pa[:self._n].tolist()
+        # link the deepest nodes first so that the loop check of anytree stays O(1),
+        # siblings are still linked in row order
+        for i in np.argsort(-self.depths, kind='stable').tolist():
+            p = pa[i]
+            if p == -1:
+                self._nodes[i].parent = self._root
+            elif p >= 0:
+                self._nodes[i].parent = self._nodes[p]
+
+    def _reachable_depths(self):
+        """
+        pointer jumping over the parent index, return (reachable, depths):
+        reachable marks rows whose parent chain ends at the virtual root, depths counts the hops
+        """
+        n = self._n
+        pa = self.parent_index
+        rows = np.arange(n)
+
+        # "jump" ends at the top ancestor of every row
+        jump = np.where(pa >= 0, pa, rows)
+        depths = (pa >= 0).astype(np.int64)
+        for _ in range(n.bit_length() + 1):
+            next_jump = jump[jump]
+            if np.array_equal(next_jump, jump):
+                break
+            depths = depths + depths[jump]
+            jump = next_jump
+        reachable = pa[jump] == -1
+        depths[~reachable] = 0
+        return reachable, depths
+
+    def _update_depth_and_root_length(self):
+        """fill depth and root_length of rows reachable from the virtual root,
+        other rows (orphans and cycles) are set to 0
+        """
+        n = self._n
+        pa = self.parent_index
+        xyz = self.xyz
+        rows = np.arange(n)
+        reachable, depths = self._reachable_depths()
+
+        d = xyz - xyz[np.where(pa >= 0, pa, rows)]
+        seg = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2])
+
+        # one sweep in topological order, level by level
+        root_lengths = np.zeros(n, dtype=np.float64)
+        order = np.flatnonzero(reachable & (pa >= 0))
+        order = order[np.argsort(depths[order], kind='stable')]
+        bounds = np.flatnonzero(np.diff(depths[order])) + 1
+        for level in np.split(order, bounds) if len(order) > 0 else []:
+            root_lengths[level] = root_lengths[pa[level]] + seg[level]
+
+        self._depths[:n] = depths
+        self._root_lengths[:n] = root_lengths
+
+    @property
+    def ids(self):
+        return self._ids[:self._n]
+
+    @property
+    def types(self):
+        return self._types[:self._n]
+
+    @property
+    def xyz(self):
+        return self._xyz[:self._n]
+
+    @property
+    def radii(self):
+        return self._radii[:self._n]
+
+    @property
+    def parent_index(self):
+        return self._pa[:self._n]
+
+    @property
+    def depths(self):
+        return self._depths[:self._n]
+
+    @property
+    def root_lengths(self):
+        return self._root_lengths[:self._n]
 
     def is_comment(self, line):
         return line.strip().startswith('#')
 
     def root(self):
+        if self._root is None:
+            self._materialize()
         return self._root
 
     def size(self):
         self._size = len(self.id_set)
         return self._size
 
+    def index_size(self):
+        """
+        number of dense indices (SwcNode.get_index) used by the tree, including removed nodes.
+        per-node arrays get one extra entry so that index -1 (the virtual root) has its own slot
+        """
+        return self._n
+
     def regular_root(self):
-        return self._root.children
+        return self.root().children
 
     def _print(self):
-        print(RenderTree(self._root).by_attr("_id"))
+        print(RenderTree(self.root()).by_attr("_id"))
 
     def clear(self):
-        self._root = Make_Virtual()
+        self.__init__()
 
-    # warning: slow, don't use in loop
     def node_from_id(self, nid):
-        niter = iterators.PreOrderIter(self._root)
-        for tn in niter:
-            if tn.get_id() == nid:
-                return tn
-        return None
+        root = self.root()
+        idx = self._id_index.get(nid)
+        if idx is None:
+            return root if nid == -1 else None
+        return self._nodes[idx]
 
-    # warning: slow, don't use in loop
     def parent_id(self, nid):
         tn = self.node_from_id(nid)
         if tn:
             return tn.get_parent_id()
 
-    # warning: slow, don't use in loop
     def parent_node(self, nid):
         tn = self.node_from_id(nid)
         if tn:
             return tn.parent
 
-    # warning: slow, don't use in loop
     def child_list(self, nid):
         tn = self.node_from_id(nid)
         if tn:
@@ -367,91 +776,83 @@ class SwcTree:
 
     def load_list(self, lines):
         self.clear()
-        nodeDict = dict()
-        for line in lines:
-            if not self.is_comment(line):
-                #                     print line
-                data = list(map(float, line.split()))
-                #                     print(data)
-                if len(data) == 7:
-                    nid = int(data[0])
-                    ntype = int(data[1])
-                    pos = EuclideanPoint(center=data[2:5])
-                    radius = data[5]
-                    parentId = data[6]
-                    if nid in self.id_set:
-                        raise Exception("[Error: SwcTree.load]Same id {}".format(nid))
-                    self.id_set.add(nid)
-                    tn = SwcNode(nid=nid, ntype=ntype, radius=radius, center=pos)
-                    nodeDict[nid] = (tn, parentId)
-
-        for _, value in nodeDict.items():
-            tn = value[0]
-            parentId = value[1]
-            if parentId == -1:
-                tn.parent = self._root
-            else:
-                parentNode = nodeDict.get(parentId)
-                if parentNode:
-                    tn.parent = parentNode[0]
-
-        for node in self.get_node_list():
-            if node.parent is None:
-                continue
-            if node.parent.get_id() == -1:
-                node._depth = 0
-            else:
-                node._depth = node.parent._depth + 1
-                node.root_length = node.parent.root_length + node.parent_distance()
+        data = parse_swc_lines(lines)
+        ids = data[:, 0].astype(np.int64)
+        parent_ids = data[:, 6]
+
+        # same id check, report the id which appears again first in the file
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+        dup_mask = sorted_ids[1:] == sorted_ids[:-1]
+        if dup_mask.any():
+            raise Exception("[Error: SwcTree.load]Same id {}".format(ids[order[1:][dup_mask].min()]))
+
+        # map parent ids to row indices, -1 for the virtual root, -2 if the parent does not exist
+        pa = np.full(len(ids), -2, dtype=np.int64)
+        if len(ids) > 0:
+            pos = np.minimum(np.searchsorted(sorted_ids, parent_ids), len(ids) - 1)
+            found = sorted_ids[pos] == parent_ids
+            pa[found] = order[pos[found]]
+        pa[parent_ids == -1] = -1
+        self._set_columns(ids, data[:, 1].astype(np.int64), data[:, 2:5], data[:, 5], pa)
+
+    def load(self, path, cache_dir=None):
+        """
+        read a swc file, if a cache directory is given (or set by swc_cache.set_cache_dir or
+        the PYNEVAL_CACHE_DIR environment variable) the parsed columns are stored there
+        and later loads of the same file memory-map them instead of parsing the text
+        """
+        if cache_dir is None:
+            cache_dir = swc_cache.get_cache_dir()
+        key_mode = swc_cache.get_key_mode()
+        if cache_dir is not None:
+            columns = swc_cache.load_columns(path, cache_dir, key_mode)
+            if columns is not None:
+                self._adopt_columns(columns)
+                return
 
-    def load(self, path):
-        self.clear()
         with open(path, 'r') as fp:
-            lines = fp.readlines()
-            nodeDict = dict()
-            for line in lines:
-                if not self.is_comment(line):
-                    #                     print line
-                    data = list(map(float, line.split()))
-                    #                     print(data)
-                    if len(data) == 7:
-                        nid = int(data[0])
-                        ntype = int(data[1])
-                        pos = EuclideanPoint(center=data[2:5])
-                        radius = data[5]
-                        parentId = data[6]
-                        if nid in self.id_set:
-                            raise Exception("[Error: SwcTree.load]Same id {}".format(nid))
-                        self.id_set.add(nid)
-                        tn = SwcNode(nid=nid, ntype=ntype, radius=radius, center=pos)
-                        nodeDict[nid] = (tn, parentId)
-            fp.close()
-
-        for _, value in nodeDict.items():
-            tn = value[0]
-            parentId = value[1]
-            if parentId == -1:
-                tn.parent = self._root
-            else:
-                parentNode = nodeDict.get(parentId)
-                if parentNode:
-                    tn.parent = parentNode[0]
+            lines = fp.read().splitlines()
+        self.load_list(lines)
 
-        for node in self.get_node_list():
-            if node.parent is None:
-                continue
-            if node.parent.get_id() == -1:
-                node._depth = 0
-            else:
-                node._depth = node.parent._depth + 1
-                node.root_length = node.parent.root_length + node.parent_distance()
+        if cache_dir is not None:
+            swc_cache.save_columns(path, self.get_columns(), cache_dir, key_mode)
+
+    def get_columns(self):
+        """
+        the used rows of all columns as a dict (keys: swc_cache.COLUMNS), the arrays are views of the tree.
+        together with load_columns it moves a tree into another process without pickling its nodes
+        """
+        return {col: getattr(self, col) for col in swc_cache.COLUMNS}
+
+    def load_columns(self, columns):
+        """rebuild the tree from the output of get_columns, dense indices stay the same"""
+        self._adopt_columns(columns)
+
+    def set_columns(self, ids, types, xyz, radii, parent_index):
+        """replace the whole tree by the given columns, depth and root_length are computed from them"""
+        self._set_columns(ids, types, xyz, radii, parent_index)
+
+    def _adopt_columns(self, columns):
+        """use the given arrays as the columns of the tree, depth and root_length are taken as they are"""
+        self.clear()
+        self._ids = np.asarray(columns["ids"])
+        self._types = np.asarray(columns["types"])
+        self._xyz = np.asarray(columns["xyz"])
+        self._radii = np.asarray(columns["radii"])
+        self._pa = np.asarray(columns["parent_index"])
+        self._depths = np.asarray(columns["depths"])
+        self._root_lengths = np.asarray(columns["root_lengths"])
+        self._n = len(self._ids)
+        self.id_set = set(self._ids.tolist())
+        self._id_index = dict(zip(self._ids.tolist(), range(self._n)))
 
     def has_regular_node(self):
         return len(self.regular_root()) > 0
 
     def parent_distance(self, nid):
         d = 0
-        tn = self.node(nid)
+        tn = self.node_from_id(nid)
         if tn:
             parent_tn = tn.parent
             if parent_tn:
@@ -460,56 +861,103 @@ class SwcTree:
         return d
 
     def scale(self, sx, sy, sz, adjusting_radius=True):
-        niter = iterators.PreOrderIter(self._root)
-        for tn in niter:
-            tn.scale(sx, sy, sz, adjusting_radius)
+        self.xyz[:] *= np.array([sx, sy, sz], dtype=np.float64)
+        if adjusting_radius:
+            self.radii[:] *= math.sqrt(sx * sy)
+        self._invalidate_lengths()
+
+    def _invalidate_lengths(self):
+        self._edge_lengths = None
+        self._total_length = None
+        self._path_index = None
+        self._revision += 1
+
+    def get_revision(self):
+        """
+        a number which changes whenever positions, radii, links or ids of the tree change (types do not count),
+        structures built from the tree stay valid as long as it is unchanged
+        """
+        return self._revision
+
+    def edge_lengths(self):
+        """
+        length of the edge between every node and its parent, indexed by SwcNode.get_index().
+        0 for children of the virtual root and for nodes which are not linked to the root.
+        the array is cached until positions or links change
+        """
+        if self._edge_lengths is None:
+            pa = self.parent_index
+            reachable, _ = self._reachable_depths()
+            has_edge = reachable & (pa >= 0)
+            d = self.xyz - self.xyz[np.where(has_edge, pa, np.arange(self._n))]
+            self._edge_lengths = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2])
+        return self._edge_lengths
+
+    def get_path_index(self):
+        """
+        PathIndex (heavy-light decomposition and route lengths) over the dense indices,
+        cached until positions or links change
+        """
+        if self._path_index is None:
+            self._path_index = PathIndex(self.parent_index, self.edge_lengths())
+        return self._path_index
 
     def length(self, force_update=False):
-        if self._total_length is not None and force_update == False:
+        if force_update:
+            self._invalidate_lengths()
+        if self._total_length is not None:
             return self._total_length
 
-        node_list = self.get_node_list()
-        result = 0
-        for tn in node_list:
-            if tn.is_virtual() or tn.parent.is_virtual():
-                continue
-            result += tn.parent_distance()
-
-        return result
+        self._total_length = float(np.sum(self.edge_lengths()))
+        return self._total_length
 
     def radius(self, nid):
 
-        return self.node(nid).radius()
+        return self.node_from_id(nid).radius()
 
-    def get_depth_array(self, node_num):
-        self.depth_array = [0] * (node_num + 10)
-        node_list = self.get_node_list()
-        for node in node_list:
-            self.depth_array[node.get_id()] = node.depth()
+    def get_depth_array(self, node_num=-1):
+        """
+        depth of every node indexed by its dense index, the extra last entry belongs to the virtual root.
+        node_num is not used any more, the array size only depends on the number of nodes
+        """
+        rows = np.array([node._idx for node in self.get_node_list() if not node.is_virtual()], dtype=np.int64)
+        depth_array = np.zeros(self._n + 1, dtype=np.int64)
+        depth_array[rows] = self._depths[rows]
+        self.depth_array = depth_array.tolist()
+        self._depth_np = depth_array
+        return rows
 
     # initialize LCA data structure in swc_tree
     def get_lca_preprocess(self, node_num=-1):
-        if node_num == -1:
-            node_num = self.size()
-        self.get_depth_array(node_num)
-        self.LOG_NODE_NUM = math.ceil(math.log(node_num, 2)) + 1
-        self.lca_parent = np.zeros(shape=(node_num + 10, self.LOG_NODE_NUM), dtype=int)
-        tree_node_list = self.get_node_list()
-
-        for node in tree_node_list:
-            if node.is_virtual():
-                continue
-            self.lca_parent[node.get_id()][0] = node.parent.get_id()
+        """
+        build the binary lifting table over dense indices, the last row belongs to the virtual root,
+        -1 means no ancestor. node_num is kept for old callers, it does not change the table size
+        """
+        rows = self.get_depth_array()
+        self.LOG_NODE_NUM = math.ceil(math.log(max(self._n, 1), 2)) + 1
+        self.lca_parent = np.full(shape=(self._n + 1, self.LOG_NODE_NUM), fill_value=-1, dtype=int)
+
+        # first column: parent of every regular node in the tree, roots keep -1
+        self.lca_parent[rows, 0] = self._pa[rows]
+        self.lca_parent[self.lca_parent < -1] = -1
+
+        # column k + 1 is column k applied twice, one whole column at a time
+        lca_parent = self.lca_parent
         for k in range(self.LOG_NODE_NUM - 1):
-            for v in range(1, node_num + 1):
-                if self.lca_parent[v][k] < 0:
-                    self.lca_parent[v][k + 1] = -1
-                else:
-                    self.lca_parent[v][k + 1] = self.lca_parent[int(self.lca_parent[v][k])][k]
+            half = lca_parent[:, k]
+            lca_parent[:, k + 1] = np.where(half < 0, -1, lca_parent[half, k])
+
+        # sorted ids for vectorized id -> index lookups in get_lca_batch, id -1 is the virtual root
+        id_index = {nid: idx for nid, idx in self._id_index.items() if nid != -1}
+        id_index[-1] = -1
+        id_keys = np.fromiter(id_index.keys(), dtype=np.int64, count=len(id_index))
+        id_rows = np.fromiter(id_index.values(), dtype=np.int64, count=len(id_index))
+        order = np.argsort(id_keys)
+        self._lca_id_keys = id_keys[order]
+        self._lca_id_rows = id_rows[order]
         return True
 
-    # input node id of two swc_node, calculate LCA
-    def get_lca(self, u, v):
+    def _lca_index(self, u, v):
         lca_parent = self.lca_parent
         LOG_NODE_NUM = self.LOG_NODE_NUM
         depth_array = self.depth_array
@@ -527,18 +975,64 @@ class SwcTree:
                 v = lca_parent[v][k]
         return lca_parent[u][0]
 
+    # input node id of two swc_node, calculate LCA
+    def get_lca(self, u, v):
+        u = -1 if u == -1 else self._id_index[u]
+        v = -1 if v == -1 else self._id_index[v]
+        lca = self._lca_index(u, v)
+        return -1 if lca < 0 else self._ids.item(lca)
+
+    def get_lca_batch(self, u_array, v_array):
+        """
+        LCA of every pair (u_array[i], v_array[i]) of node ids, same results as get_lca
+        get_lca_preprocess must be called first
+        """
+        lca_parent = self.lca_parent
+        depth_array = self._depth_np
+        u = self._lca_rows_of(u_array)
+        v = self._lca_rows_of(v_array)
+
+        swap = depth_array[u] > depth_array[v]
+        u[swap], v[swap] = v[swap], u[swap]
+        diff = depth_array[v] - depth_array[u]
+        for k in range(self.LOG_NODE_NUM):
+            lift = (diff >> k & 1).astype(bool)
+            v[lift] = lca_parent[v[lift], k]
+
+        same = u == v
+        for k in range(self.LOG_NODE_NUM - 1, -1, -1):
+            pu = lca_parent[u, k]
+            pv = lca_parent[v, k]
+            lift = (pu != pv) & ~same
+            u[lift] = pu[lift]
+            v[lift] = pv[lift]
+        lca = np.where(same, u, lca_parent[u, 0])
+        return np.where(lca < 0, -1, self._ids[np.maximum(lca, 0)])
+
+    def _lca_rows_of(self, id_array):
+        id_array = np.asarray(id_array, dtype=np.int64)
+        keys = self._lca_id_keys
+        pos = np.minimum(np.searchsorted(keys, id_array), len(keys) - 1)
+        unknown = keys[pos] != id_array
+        if unknown.any():
+            raise KeyError(id_array[unknown][0])
+        return self._lca_id_rows[pos]
+
     def align_roots(self, gold_tree, matches, DEBUG=False):
+        # imported here, so loading the model does not load the metric indexes
+        from pyneval.metric.utils.point_index import create_point_index
+
         offset = EuclideanPoint()
-        stack = queue.LifoQueue()
-        swc_test_list = self.get_node_list()
+        swc_test_list = [node for node in self.get_node_list() if not node.is_virtual()]
+        test_index = create_point_index([node.get_center()._pos for node in swc_test_list])
 
         for root in gold_tree.root().children:
             gold_anchor = np.array(root._pos)
             if root in matches.keys():
                 test_anchor = np.array(matches[root]._pos)
             else:
-                nearby_nodes = get_nearby_swc_node_list(gold_node=root, test_swc_list=swc_test_list,
-                                                        threshold=root.radius() / 2)
+                nearby_nodes = get_nearby_swc_node_list(gold_node=root, test_index=test_index,
+                                                        test_nodes=swc_test_list, threshold=root.radius() / 2)
                 if len(nearby_nodes) == 0:
                     continue
                 test_anchor = nearby_nodes[0]._pos
@@ -548,49 +1042,39 @@ class SwcTree:
                 print("off_set:x = {}, y = {}, z = {}".format(
                     offset._pos[0], offset._pos[1], offset._pos[2]))
 
-            stack.put(root)
-            while not stack.empty():
-                node = stack.get()
-                if node.is_virtual():
-                    continue
-
-                node._pos[0] += offset._pos[0]
-                node._pos[1] += offset._pos[1]
-                node._pos[2] += offset._pos[2]
-
-                for son in node.children:
-                    stack.put(son)
+            # move the whole subtree of root at once
+            rows = pre_order_index(gold_tree.parent_index, roots=[root.get_index()])
+            gold_tree.xyz[rows] += offset._pos
+        gold_tree._invalidate_lengths()
+        self._invalidate_lengths()
 
     def change_root(self, new_root_id):
-        stack = queue.LifoQueue()
         swc_list = self.get_node_list()
-        list_size = max(self.id_set)
-        vis_list = np.zeros(shape=(list_size+10))
-        pa_list = [None] * (list_size+10)
-
-        for node in swc_list:
-            pa_list[node.get_id()] = node.parent
         new_root = self.node_from_id(new_root_id)
-
-        stack.put(new_root)
-        pa_list[new_root_id] = self.root()
-        while not stack.empty():
-            cur_node = stack.get()
-            vis_list[cur_node.get_id()] = True
-            for son in cur_node.children:
-                if not vis_list[son.get_id()]:
-                    stack.put(son)
-                    pa_list[son.get_id()] = cur_node
-            if cur_node.parent is not None and \
-                    cur_node.parent.get_id() != -1 and \
-                    not vis_list[cur_node.parent.get_id()]:
-                stack.put(cur_node.parent)
-                pa_list[cur_node.parent.get_id()] = cur_node
-
-        for i in range(1, len(swc_list)):
-            swc_list[i].parent = None
-        for i in range(1, len(swc_list)):
-            swc_list[i].parent = pa_list[swc_list[i].get_id()]
+        pa_of = {node: node.parent for node in swc_list[1:]}
+
+        # only the links on the path from the new root to its top root are reversed
+        prev, cur = self.root(), new_root
+        while cur is not None and not cur.is_virtual():
+            pa_of[cur] = prev
+            prev, cur = cur, cur.parent
+
+        sons_of = {}
+        new_pa = np.full(self.index_size(), -2, dtype=np.int64)
+        for node in swc_list[1:]:
+            sons_of.setdefault(pa_of[node], []).append(node)
+            new_pa[node.get_index()] = pa_of[node].get_index()
+
+        for node in swc_list[1:]:
+            node.parent = None
+        # link bottom-up, so the loop check of anytree never walks up a long chain,
+        # siblings are linked in the order of swc_list
+        for idx in post_order_index(new_pa).tolist():
+            pa = self._nodes[idx]
+            for son in sons_of.get(pa, []):
+                son.parent = pa
+        for son in sons_of.get(self.root(), []):
+            son.parent = self.root()
 
     def type_clear(self, col=0, rt_color=2):
         node_list = self.get_node_list()
@@ -635,8 +1119,9 @@ class SwcTree:
         pa.children = tuple(children)
 
         for son in node.children:
-            son.parent = self._root
+            son.parent = self.root()
         self.id_set.remove(node.get_id())
+        self._unindex_id(node.get_id(), node._idx)
         return True
 
     def unlink_child(self, node):
@@ -650,14 +1135,7 @@ class SwcTree:
 
     def get_node_list(self, update=False):
         if self.node_list is None or update:
-            self.node_list = []
-            q = queue.LifoQueue()
-            q.put(self._root)
-            while not q.empty():
-                cur = q.get()
-                self.node_list.append(cur)
-                for child in cur.children:
-                    q.put(child)
+            self.node_list = list(pre_order(self.root(), reverse=True))
 
         return self.node_list
 
@@ -682,17 +1160,32 @@ class SwcTree:
         return "".join(swc_str)
 
     def get_copy(self):
+        """
+        copy all nodes reachable from the root by copying the column arrays,
+        the order of siblings is kept
+        """
+        if self._root is None:
+            reachable, _ = self._reachable_depths()
+            keep = np.flatnonzero(reachable)
+        else:
+            # node links may have been changed, take the rows in pre-order of the linked tree
+            keep = np.array([node._idx for node in pre_order(self._root)][1:], dtype=np.int64)
+        pa = self._pa[keep]
+        new_row = np.full(self._n, -2, dtype=np.int64)
+        new_row[keep] = np.arange(len(keep))
+        new_pa = np.where(pa >= 0, new_row[np.maximum(pa, 0)], pa)
+
         new_tree = SwcTree()
-        swc_str = self.to_str_list().split("\n")
-        new_tree.load_list(swc_str)
+        new_tree._set_columns(self._ids[keep], self._types[keep], self._xyz[keep], self._radii[keep], new_pa)
         return new_tree
 
     def get_id_node_dict(self):
+        """id -> node of all nodes and the virtual root (id -1), rebuilt after the ids change"""
         if self.id_node_dict is not None:
             return self.id_node_dict
-        self.id_node_dict = {}
-        for node in self.get_node_list():
-            self.id_node_dict[node.get_id()] = node
+        self.id_node_dict = {-1: self.root()}
+        for nid, idx in self._id_index.items():
+            self.id_node_dict[nid] = self._nodes[idx]
         return self.id_node_dict
 
     def get_branch_swc_list(self):
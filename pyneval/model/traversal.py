@@ -0,0 +1,90 @@
+"""
+iterative tree traversals, none of them recurses, so the depth of a tree is only limited by memory.
+
+node traversals walk the "children" of anytree nodes (SwcNode, BinaryNode) with plain lists.
+index traversals walk a parent index array (e.g. SwcTree.parent_index), where parent_index[i] is
+the row of the parent of row i, -1 for children of the virtual root and -2 for unlinked rows.
+children of a row are visited in row order.
+"""
+import numpy as np
+
+
+def pre_order(node, reverse=False):
+    """
+    yield node and all its descendants in pre-order, children in their order,
+    same order as anytree.PreOrderIter(node). reverse=True visits the last child first
+    """
+    stack = [node]
+    while stack:
+        cur = stack.pop()
+        yield cur
+        if reverse:
+            stack.extend(cur.children)
+        else:
+            stack.extend(reversed(cur.children))
+
+
+def children_index(parent_index):
+    """
+    children lists of a parent index in CSR form: the children of row i are
+    child_rows[offsets[i]:offsets[i + 1]], children of the virtual root are
+    child_rows[offsets[n]:offsets[n + 1]] with n = len(parent_index)
+    :return: offsets, child_rows
+    """
+    parent_index = np.asarray(parent_index, dtype=np.int64)
+    n = len(parent_index)
+    rows = np.flatnonzero(parent_index >= -1)
+    key = np.where(parent_index[rows] == -1, n, parent_index[rows])
+    order = np.argsort(key, kind='stable')
+    offsets = np.zeros(n + 2, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(key, minlength=n + 1))
+    return offsets, rows[order]
+
+
+def _get_roots(offsets, child_rows, roots):
+    if roots is None:
+        n = len(offsets) - 2
+        return child_rows[offsets[n]:offsets[n + 1]]
+    return np.asarray(roots, dtype=np.int64)
+
+
+def pre_order_index(parent_index, roots=None, reverse=False):
+    """
+    rows in pre-order, starting from "roots" (default: children of the virtual root)
+    reverse=True visits the last child first
+    """
+    offsets, child_rows = children_index(parent_index)
+    roots = _get_roots(offsets, child_rows, roots).tolist()
+    offsets = offsets.tolist()
+    child_rows = child_rows.tolist()
+
+    res = []
+    stack = roots if reverse else roots[::-1]
+    while stack:
+        cur = stack.pop()
+        res.append(cur)
+        sons = child_rows[offsets[cur]:offsets[cur + 1]]
+        stack.extend(sons if reverse else sons[::-1])
+    return np.array(res, dtype=np.int64)
+
+
+def post_order_index(parent_index, roots=None):
+    """rows in post-order (children in their order, then the parent)"""
+    return pre_order_index(parent_index, roots=roots, reverse=True)[::-1]
+
+
+def bfs_index(parent_index, roots=None):
+    """rows in breadth-first order, every level is gathered with one numpy call"""
+    offsets, child_rows = children_index(parent_index)
+    frontier = _get_roots(offsets, child_rows, roots)
+    levels = []
+    while len(frontier) > 0:
+        levels.append(frontier)
+        starts = offsets[frontier]
+        counts = offsets[frontier + 1] - starts
+        # positions of all children of the frontier in child_rows, level order kept
+        first = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        frontier = child_rows[first + np.arange(counts.sum())]
+    if len(levels) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(levels)
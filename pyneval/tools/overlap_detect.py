@@ -3,40 +3,33 @@ import os
 from pyneval.model.swc_node import SwcTree
 from pyneval.model.euclidean_point import Line
 from pyneval.metric.utils.edge_match_utils import \
-    get_idedge_dict, get_edge_rtree, get_lca_length, get_nearby_edges, get_route_node, \
-    cal_rad_threshold, cal_len_threshold
+    get_idedge_dict, get_edge_index, get_candidate_edges, NearbyEdgeCache, get_lca_length, \
+    cal_rad_threshold, cal_len_threshold, DEFAULT_INDEX_BACKEND
 from pyneval.tools.re_sample import down_sample_swc_tree_command_line
-from anytree import PreOrderIter
+from pyneval.model.traversal import pre_order
+from pyneval.model.path_index import PathMarks
 from pyneval.io import swc_writer
 from pyneval.io.read_json import read_json
 import math
-import numpy as np
 
 
 # make sure the match path does not contain a detected redundant edge
-def is_self_root_clean(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, vis_list):
+def is_self_root_clean(gold_swc_tree, gold_line_tuple_a, gold_line_tuple_b, vis_marks):
+    """
+    :param vis_marks: PathMarks of gold_swc_tree.get_path_index(), detected redundant edges are marked
+    """
     # if two foots lay on the same edge, pass
     if gold_line_tuple_a[0].get_id() == gold_line_tuple_b[0].get_id() and \
             gold_line_tuple_a[1].get_id() == gold_line_tuple_b[1].get_id():
-        return vis_list[gold_line_tuple_a[0].get_id()] != 1
+        return not vis_marks.is_marked(gold_line_tuple_a[0].get_index())
 
-    lca_id = gold_swc_tree.get_lca(gold_line_tuple_a[0].get_id(), gold_line_tuple_b[0].get_id())
-    if lca_id is None:
-        return False
-
-    # get nodes on the route, make sure no extra node
-    route_list_a = get_route_node(gold_line_tuple_a[0], lca_id)
-    route_list_b = get_route_node(gold_line_tuple_b[0], lca_id)
+    row_a, row_b = gold_line_tuple_a[0].get_index(), gold_line_tuple_b[0].get_index()
+    lca = vis_marks.path_index.lca(row_a, row_b)
 
-    route_list = route_list_a + route_list_b
-    for node in route_list:
-        if node.get_id() == lca_id and \
-                gold_line_tuple_a[0].get_id() != lca_id and \
-                gold_line_tuple_b[0].get_id() != lca_id:
-            continue
-        if vis_list[node.get_id()] == 1:
-            return False
-    return True
+    # nodes on the route, the lca only counts if it is one of the two edges
+    if vis_marks.any_marked(row_a, lca) or vis_marks.any_marked(row_b, lca):
+        return False
+    return not (lca in (row_a, row_b) and vis_marks.is_marked(lca))
 
 
 def get_ang(side_edge1, side_edge2, oppo_edge):
@@ -50,10 +43,10 @@ def get_ang(side_edge1, side_edge2, oppo_edge):
 
 
 def color_origin_tree(new_swc_tree, swc_tree):
-    new_swc_list = [node for node in PreOrderIter(new_swc_tree.root())]
+    new_swc_list = [node for node in pre_order(new_swc_tree.root())]
     id_node_map = {}
 
-    for node in PreOrderIter(swc_tree.root()):
+    for node in pre_order(swc_tree.root()):
         id_node_map[node.get_id()] = node
 
     for node in new_swc_list:
@@ -66,31 +59,30 @@ def color_origin_tree(new_swc_tree, swc_tree):
 
 # find overlap edges
 def get_self_match_edges_e_fast(swc_tree=None,
-                                rad_threshold=None, len_threshold=None, list_size=-1,
-                                mode="not_self", DEBUG=False):
-    idx3d = get_edge_rtree(swc_tree)
+                                rad_threshold=None, len_threshold=None,
+                                mode="not_self", index_backend=DEFAULT_INDEX_BACKEND, DEBUG=False):
+    idx3d = get_edge_index(swc_tree, backend=index_backend)
     id_edge_dict = get_idedge_dict(swc_tree)
     # sort the tree according the tree size
     roots = swc_tree.root().children
-    id_rootdis_dict = {}
     node_list = []
     root_list = []
     for root in roots:
-        r_list = [node for node in PreOrderIter(root)]
+        r_list = [node for node in pre_order(root)]
         root_list.append(tuple([root, len(r_list)]))
     root_list.sort(key=lambda x: x[1])
 
     for root in root_list:
-        r_list = [node for node in PreOrderIter(root[0])]
+        r_list = [node for node in pre_order(root[0])]
         node_list += r_list
 
-    if list_size == -1:
-        list_size = len(node_list)
-
-    for node in node_list:
-        id_rootdis_dict[node.get_id()] = node.root_length
+    # nearby edges of all nodes at once, already within the radius threshold
+    candidates = get_candidate_edges(gold_swc_tree=swc_tree, test_swc_tree=swc_tree,
+                                     rad_threshold=rad_threshold, idx3d=idx3d, not_self=True)
+    nearby_edge_cache = NearbyEdgeCache(*candidates, id_edge_dict=id_edge_dict, index_size=swc_tree.index_size())
 
-    vis_list = np.zeros(list_size + 10)
+    # detected redundant edges, marked by the dense index of the child node
+    vis_marks = PathMarks(swc_tree.get_path_index())
     for node in node_list:
         if node.is_virtual() or node.parent.is_virtual():
             continue
@@ -99,8 +91,8 @@ def get_self_match_edges_e_fast(swc_tree=None,
 
         rad_threshold1, rad_threshold2 = cal_rad_threshold(rad_threshold, node.radius(), node.parent.radius())
 
-        line_tuple_as = get_nearby_edges(idx3d, node, id_edge_dict, threshold=rad_threshold1, not_self=True)
-        line_tuple_bs = get_nearby_edges(idx3d, parent, id_edge_dict, threshold=rad_threshold2, not_self=True)
+        line_tuple_as = nearby_edge_cache.get(node, rad_threshold1)
+        line_tuple_bs = nearby_edge_cache.get(parent, rad_threshold2)
 
         done = False
         for line_tuple_a_d in line_tuple_as:
@@ -114,14 +106,13 @@ def get_self_match_edges_e_fast(swc_tree=None,
                                              line_tuple_a,
                                              line_tuple_b,
                                              Line(e_node_1=node.get_center(),
-                                                  e_node_2=node.parent.get_center()),
-                                             id_rootdis_dict)
+                                                  e_node_2=node.parent.get_center()))
                 gold_length = node.distance(parent)
                 len_threshold1 = cal_len_threshold(len_threshold, gold_length)
 
                 if dis_a <= rad_threshold1 and dis_b <= rad_threshold2 and \
                         math.fabs(test_length - gold_length) < len_threshold1:
-                    if mode == "not_self" and not is_self_root_clean(swc_tree, line_tuple_a, line_tuple_b, vis_list):
+                    if mode == "not_self" and not is_self_root_clean(swc_tree, line_tuple_a, line_tuple_b, vis_marks):
                         continue
                     if DEBUG:
                         print("node = {} test_length = {} gold_length = {}".format(
@@ -129,9 +120,12 @@ def get_self_match_edges_e_fast(swc_tree=None,
                         ))
                     node._type = 3
                     node.parent._type = 3
-                    vis_list[node.get_id()] = 1
+                    vis_marks.mark(node.get_index())
                     done = True
                     break
+    if DEBUG:
+        print("nearby edge cache: queries = {}, hit rate = {:.4f}".format(
+            nearby_edge_cache.queries, nearby_edge_cache.hit_rate()))
 
 
 def delete_overlap_node(swc_tree):
@@ -141,7 +135,7 @@ def delete_overlap_node(swc_tree):
             for son in node.children:
                 son.parent = swc_tree.root()
             swc_tree.remove_node(node.parent, node)
-    swc_tree.node_list = [node for node in PreOrderIter(swc_tree.root())]
+    swc_tree.node_list = [node for node in pre_order(swc_tree.root())]
 
 
 def overlap_clean(swc_tree, out_path, file_name, loc_config=None):
@@ -158,13 +152,12 @@ def overlap_clean(swc_tree, out_path, file_name, loc_config=None):
     new_swc_tree = down_sample_swc_tree_command_line(swc_tree, loc_config)
     new_swc_tree = down_sample_swc_tree_command_line(new_swc_tree, loc_config)
 
-    new_swc_tree.get_lca_preprocess(swc_tree.size())
-    swc_tree.get_lca_preprocess(swc_tree.size())
+    new_swc_tree.get_lca_preprocess()
+    swc_tree.get_lca_preprocess()
 
     get_self_match_edges_e_fast(swc_tree=new_swc_tree,
                                 rad_threshold=dis_threshold,
                                 len_threshold=length_threshold,
-                                list_size=swc_tree.size(),
                                 mode="not_self", DEBUG=False)
     color_origin_tree(new_swc_tree, swc_tree)
     swc_writer.swc_save(new_swc_tree, os.path.join(out_path, os.path.join('marked_data', file_name)))
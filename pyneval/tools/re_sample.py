@@ -1,9 +1,12 @@
-import queue
 from pyneval.model.swc_node import SwcNode, SwcTree, Make_Virtual
 from pyneval.model.euclidean_point import Line, EuclideanPoint
-from anytree import PreOrderIter
+from pyneval.model.traversal import pre_order, pre_order_index
 from pyneval.io.swc_writer import swc_save
 import copy
+import numpy as np
+
+# a piece is halved at most MAX_SPLIT_LEVEL times, positions of new nodes on an edge are int64
+MAX_SPLIT_LEVEL = 62
 
 
 def itp_ok(node=None, son=None, pa=None,
@@ -36,21 +39,16 @@ def itp_ok(node=None, son=None, pa=None,
 
 
 def down_sample(swc_tree=None, rad_mul=1.50, center_dis=None, stage=0):
-    stack = queue.LifoQueue()
-    stack.put(swc_tree.root())
     down_pa = {}
-    is_active = [True]*(max(swc_tree.id_set) + 5)
+    # indexed by the dense node index, not by the swc id
+    is_active = [True]*(swc_tree.index_size() + 1)
 
-    for node in PreOrderIter(swc_tree.root()):
+    for node in pre_order(swc_tree.root()):
         if node.parent is None or node is None:
             continue
         down_pa[node] = node.parent
 
-    while not stack.empty():
-        node = stack.get()
-        for son in node.children:
-            stack.put(son)
-
+    for node in pre_order(swc_tree.root(), reverse=True):
         # 确保不是根节点
         if node.is_virtual() or down_pa[node].is_virtual():
             continue
@@ -67,7 +65,7 @@ def down_sample(swc_tree=None, rad_mul=1.50, center_dis=None, stage=0):
         if stage == 1 and (son_dis > son.radius() + node.radius() and pa_dis > pa.radius() + node.radius()):
             continue
         if itp_ok(node=node, son=son, pa=pa, rad_mul=rad_mul, center_dis=center_dis):
-            is_active[node.get_id()] = False
+            is_active[node.get_index()] = False
             down_pa[son] = down_pa[node]
 
     return down_pa, is_active
@@ -90,27 +88,33 @@ def down_sample_swc_tree(swc_tree, rad_mul=1.50, center_dis=None, stage=0):
     '''
     down_pa, is_activate = down_sample(swc_tree=swc_tree, rad_mul=rad_mul, center_dis=center_dis, stage=stage)
     new_swc_tree = SwcTree()
-    node_list = [node for node in PreOrderIter(swc_tree.root())]
+    node_list = [node for node in pre_order(swc_tree.root())]
     id_node_map = {-1: new_swc_tree.root()}
+    sons_of = {}
     for node in node_list:
         if node.is_virtual():
             continue
-        if is_activate[node.get_id()]:
+        if is_activate[node.get_index()]:
             tmp_node = SwcNode()
             tmp_node._id = node.get_id()
             tmp_node._type = node._type
             tmp_node._pos = copy.copy(node._pos)
             tmp_node._radius = node._radius
-            pa = id_node_map[down_pa[node].get_id()]
-            tmp_node.parent = pa
+            sons_of.setdefault(down_pa[node].get_id(), []).append(tmp_node)
             id_node_map[node.get_id()] = tmp_node
             new_swc_tree.id_set.add(tmp_node._id)
+
+    # link bottom-up, so the loop check of anytree never walks up a long chain
+    for nid in reversed(list(sons_of.keys())):
+        for tmp_node in sons_of[nid]:
+            tmp_node.parent = id_node_map[nid]
     return new_swc_tree
 
 
 def re_sample(swc_tree, son, pa, length_threshold):
     '''
-    self recursive function, add node on the middle of edge son, pa
+    add nodes on the middle of edge son, pa until every piece is short enough.
+    pieces are split in the same order as a recursive split of (new_node, pa) before (son, new_node)
     :param swc_tree:
     :param son:
     :param pa:
@@ -118,27 +122,32 @@ def re_sample(swc_tree, son, pa, length_threshold):
     :param tiff_file: optional, adjust to fit tiff if exist
     :return: True/False, it dose not matter
     '''
-    dis = son.distance(pa)
-    if dis - (son.radius() + pa.radius()) < length_threshold:
-        return False
+    res = False
+    stack = [(son, pa)]
+    while stack:
+        son, pa = stack.pop()
+        dis = son.distance(pa)
+        if dis - (son.radius() + pa.radius()) < length_threshold:
+            continue
 
-    new_pos = EuclideanPoint(center=[(son.get_x() + pa.get_x()) / 2,
-                                     (son.get_y() + pa.get_y()) / 2,
-                                     (son.get_z() + pa.get_z()) / 2])
+        new_pos = EuclideanPoint(center=[(son.get_x() + pa.get_x()) / 2,
+                                         (son.get_y() + pa.get_y()) / 2,
+                                         (son.get_z() + pa.get_z()) / 2])
 
-    new_node = SwcNode(center=new_pos)
-    new_node.set_r((son.radius() + pa.radius()) / 2)
-    new_node._type = 7
+        new_node = SwcNode(center=new_pos)
+        new_node.set_r((son.radius() + pa.radius()) / 2)
+        new_node._type = 7
 
-    swc_tree.unlink_child(son)
-    if not swc_tree.add_child(pa, new_node):
-        raise Exception("[Error: ] add child fail type of pa :{}, type of son".format(type(pa, new_node)))
-    if not swc_tree.link_child(new_node, son):
-        raise Exception("[Error: ] add child fail type of pa :{}, type of son".format(type(new_node, son)))
+        swc_tree.unlink_child(son)
+        if not swc_tree.add_child(pa, new_node):
+            raise Exception("[Error: ] add child fail type of pa :{}, type of son".format(type(pa, new_node)))
+        if not swc_tree.link_child(new_node, son):
+            raise Exception("[Error: ] add child fail type of pa :{}, type of son".format(type(new_node, son)))
 
-    re_sample(swc_tree=swc_tree, son=new_node, pa=pa, length_threshold=length_threshold)
-    re_sample(swc_tree=swc_tree, son=son, pa=new_node, length_threshold=length_threshold)
-    return True
+        stack.append((son, new_node))
+        stack.append((new_node, pa))
+        res = True
+    return res
 
 
 def up_sample_swc_tree_command_line(swc_tree, config=None):
@@ -146,24 +155,108 @@ def up_sample_swc_tree_command_line(swc_tree, config=None):
     return up_sample_swc_tree(swc_tree=swc_tree, length_threshold=length_threshold)
 
 
+def get_split_points(son_xyz, son_r, pa_xyz, pa_r, length_threshold):
+    '''
+    the nodes re_sample adds to the edges (son, pa), computed for all edges at once.
+    the pieces are split level by level, a piece of level k is a half of a piece of level k-1,
+    with the float operations of re_sample, so the result is the same to the last bit.
+    how often a piece is halved depends on its radii, so the levels of one edge may differ
+    :param son_xyz: M*3 array
+    :param son_r: M array
+    :param pa_xyz: M*3 array
+    :param pa_r: M array
+    :param length_threshold: float
+    :return: edge(N, int64), rank(N, int64), xyz(N*3), radii(N) of the new nodes, sorted by edge,
+        then from son to pa. rank is the order in which re_sample adds the nodes, over all edges
+    '''
+    edge = np.arange(len(son_r), dtype=np.int64)
+    piece = np.zeros(len(son_r), dtype=np.int64)
+    lo_xyz, lo_r = np.asarray(son_xyz, dtype=np.float64), np.asarray(son_r, dtype=np.float64)
+    hi_xyz, hi_r = np.asarray(pa_xyz, dtype=np.float64), np.asarray(pa_r, dtype=np.float64)
+    levels = []
+    while len(edge):
+        sub = lo_xyz - hi_xyz
+        dis = np.sqrt(sub[:, 0] * sub[:, 0] + sub[:, 1] * sub[:, 1] + sub[:, 2] * sub[:, 2])
+        split = ~(dis - (lo_r + hi_r) < length_threshold)
+        if not split.any():
+            break
+        if len(levels) == MAX_SPLIT_LEVEL:
+            raise Exception("[Error: ]edges can not be split to length_threshold {}".format(length_threshold))
+        edge, piece = edge[split], piece[split]
+        lo_xyz, lo_r, hi_xyz, hi_r = lo_xyz[split], lo_r[split], hi_xyz[split], hi_r[split]
+        mid_xyz, mid_r = (lo_xyz + hi_xyz) / 2, (lo_r + hi_r) / 2
+        levels.append((edge, piece, mid_xyz, mid_r))
+
+        # piece i is split into piece 2i on the son side and piece 2i+1 on the pa side
+        edge, piece = np.repeat(edge, 2), np.stack([piece * 2, piece * 2 + 1], axis=1).ravel()
+        lo_xyz = np.stack([lo_xyz, mid_xyz], axis=1).reshape(-1, 3)
+        hi_xyz = np.stack([mid_xyz, hi_xyz], axis=1).reshape(-1, 3)
+        lo_r = np.stack([lo_r, mid_r], axis=1).ravel()
+        hi_r = np.stack([mid_r, hi_r], axis=1).ravel()
+    if not levels:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros(0)
+
+    level_num = len(levels)
+    edge = np.concatenate([item[0] for item in levels])
+    piece = np.concatenate([item[1] for item in levels])
+    xyz = np.concatenate([item[2] for item in levels])
+    radii = np.concatenate([item[3] for item in levels])
+    level = np.repeat(np.arange(level_num), [len(item[0]) for item in levels])
+    # the middle of piece i of level k is at (2i+1) / 2^(k+1) of the edge from son
+    position = (piece * 2 + 1) << (level_num - 1 - level)
+
+    # re_sample adds a node, then the nodes on its pa side, then the nodes on its son side (pre-order).
+    # digit j of a node is 1 if it is on the pa side of its ancestor of level j, 2 on the son side, 0 for j >= level
+    digits = []
+    for j in range(level_num):
+        side = (piece >> np.maximum(level - 1 - j, 0)) & 1
+        digits.append(np.where(j < level, 2 - side, 0))
+    rank = np.empty(len(edge), dtype=np.int64)
+    rank[np.lexsort(digits[::-1] + [edge])] = np.arange(len(edge))
+
+    order = np.lexsort((position, edge))
+    return edge[order], rank[order], xyz[order], radii[order]
+
+
 def up_sample_swc_tree(swc_tree, length_threshold=1.0):
     '''
+    the tree of re_sample on every edge, built on the column arrays in one pass without creating nodes.
+    ids of the new nodes are counted up from the largest id in the order re_sample adds them
     :param swc_tree: the tree need to add node(dense)
     :param length_threshold: control how many nodes to add
-    :return: swc_tree has changed in this function
+    :return: a new tree, swc_tree is not changed
     '''
-    up_sampled_swc_tree = swc_tree.get_copy()
+    copied_swc_tree = swc_tree.get_copy()
+    ids, types, xyz = copied_swc_tree.ids, copied_swc_tree.types, copied_swc_tree.xyz
+    radii, pa = copied_swc_tree.radii, copied_swc_tree.parent_index
+    node_num = len(ids)
 
-    swc_list = up_sampled_swc_tree.get_node_list()
-    for node in swc_list:
-        if node.is_virtual() or node.parent.is_virtual():
-            continue
+    # edges in the order of get_node_list, as re_sample is called in up_sample_swc_tree
+    sons = pre_order_index(pa, reverse=True)
+    sons = sons[pa[sons] >= 0]
+    edge, rank, new_xyz, new_radii = get_split_points(xyz[sons], radii[sons], xyz[pa[sons]], radii[pa[sons]],
+                                                      length_threshold)
 
-        re_sample(swc_tree=up_sampled_swc_tree, son=node, pa=node.parent,
-                  length_threshold=length_threshold)
+    # new nodes are appended in the order they are added, so the children of a node keep their order:
+    # sons of unsplit edges first, then the new nodes next to it in the order of the edges
+    new_rows = node_num + rank
+    counts = np.bincount(edge, minlength=len(sons))
+    starts = np.cumsum(counts) - counts
+    split = np.flatnonzero(counts)
+    # the new nodes of an edge go from son to pa, each one is the parent of the one before it
+    new_pa = np.r_[new_rows[1:], 0]
+    new_pa[starts[split] + counts[split] - 1] = pa[sons[split]]
+    up_pa = pa.copy()
+    up_pa[sons[split]] = new_rows[starts[split]]
 
-    # 're_sample' will change the structure of the tree. Update is required after using
-    up_sampled_swc_tree.get_node_list(update=True)
+    order = np.argsort(rank)
+    next_id = int(ids.max()) + 1 if node_num else 1
+    up_sampled_swc_tree = SwcTree()
+    up_sampled_swc_tree.set_columns(np.r_[ids, next_id + np.arange(len(rank))],
+                                    np.r_[types, np.full(len(rank), 7, dtype=types.dtype)],
+                                    np.r_[xyz, new_xyz[order]],
+                                    np.r_[radii, new_radii[order]],
+                                    np.r_[up_pa, new_pa[order]])
     return up_sampled_swc_tree
 
 
@@ -1,4 +1,3 @@
-import sys
 from pyneval.model.swc_node import SwcNode, SwcTree
 from pyneval.io.save_swc import swc_save
 
@@ -26,7 +25,6 @@ def cut_swc_rectangle(swc_tree, LFD_pos, RBT_pos):
                             
 
 if __name__ == "__main__":
-    sys.setrecursionlimit(100000)
     file_name = "194444"
     swc_tree = SwcTree()
     # load origin swc file
@@ -17,9 +17,14 @@ setup(name='pyneval',
                   ("config/schemas", glob.glob('config/schemas/*.json'))],
       install_requires=[
             'anytree>=2.7.2',
-            'numpy>=1.17.3',
-            'rtree>=0.8'
+            'numpy>=1.17.3'
       ],
+      extras_require={
+            # libspatialindex segment index, only needed for index_backend="rtree"
+            'rtree': ['rtree>=0.8'],
+            # compiled kd-tree for the nearest node searches, the numpy PointGrid is used without it
+            'scipy': ['scipy>=1.6']
+      },
       entry_points={
           'console_scripts': [
               'pyneval=pyneval.cli.pyneval:run',
@@ -1,7 +1,9 @@
 import unittest
 import random
 import math
-from pyneval.model.euclidean_point import EuclideanPoint,Line
+import numpy as np
+from pyneval.model.euclidean_point import EuclideanPoint, Line, point_segment_pairs, point_segment_matrix, \
+    _project, _project_one
 
 
 def rand(k):
@@ -38,6 +40,53 @@ class TestPointMethods(unittest.TestCase):
             for i in range(0,3):
                 self.assertTrue(math.fabs(ans1._pos[i] - ans2._pos[i]) < 0.0000001)
 
+    def test_scalar_kernel(self):
+        # _project_one is the plain python copy of _project, both must give the same bits
+        rng = np.random.RandomState(1)
+        seg_a = rng.uniform(0, 10, size=(60, 3))
+        seg_b = rng.uniform(0, 10, size=(60, 3))
+        # degenerate segments: same ends, ends closer than sqrt(EPS)
+        seg_b[0] = seg_a[0]
+        seg_b[1] = seg_a[1] + 1e-5
+        points = rng.uniform(-5, 15, size=(60, 3))
+        # on the ends, before the start and behind the end of the segment (clamped)
+        points[2], points[3] = seg_a[2], seg_b[3]
+        points[4] = seg_a[4] - (seg_b[4] - seg_a[4])
+        points[5] = seg_b[5] + (seg_b[5] - seg_a[5])
+        for clamp in (True, False):
+            dis, foot, t = _project(points, seg_a, seg_b, clamp)
+            for i in range(len(points)):
+                one_dis, one_foot, one_t = _project_one(points[i].tolist(), seg_a[i].tolist(), seg_b[i].tolist(),
+                                                        clamp)
+                self.assertEqual(one_dis, dis[i])
+                self.assertEqual(one_foot, foot[i].tolist())
+                self.assertEqual(one_t, t[i])
+
+    def test_batched_kernels(self):
+        rng = np.random.RandomState(0)
+        points = rng.uniform(0, 10, size=(40, 3))
+        seg_a = rng.uniform(0, 10, size=(30, 3))
+        seg_b = rng.uniform(0, 10, size=(30, 3))
+        seg_b[0] = seg_a[0]
+        dis, foot, t = point_segment_matrix(points, seg_a, seg_b)
+        self.assertEqual(dis.shape, (40, 30))
+        self.assertEqual(foot.shape, (40, 30, 3))
+        self.assertTrue(np.all((t >= 0) & (t <= 1)))
+        for i in range(len(points)):
+            p = EuclideanPoint(points[i].tolist())
+            for j in range(len(seg_a)):
+                line = Line(coords=[seg_a[j].tolist(), seg_b[j].tolist()])
+                self.assertEqual(dis[i, j], p.distance(line))
+                self.assertEqual(foot[i, j].tolist(), p.get_closest_point(line)._pos)
+
+        pair_dis, pair_foot, pair_t = point_segment_pairs(points[:30], seg_a, seg_b, clamp=False)
+        for i in range(30):
+            line = Line(coords=[seg_a[i].tolist(), seg_b[i].tolist()], is_segment=False)
+            self.assertEqual(pair_dis[i], EuclideanPoint(points[i].tolist()).distance(line))
+        # a degenerate segment is its first end
+        self.assertEqual(pair_t[0], 0.0)
+        self.assertEqual(pair_foot[0].tolist(), seg_a[0].tolist())
+
 
 if __name__ == "__main__":
     unittest.main()
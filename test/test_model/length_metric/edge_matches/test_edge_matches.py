@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from pyneval.metric.length_metric import length_metric_run
+from pyneval.metric.utils.edge_match_utils import get_match_edges, EdgeMatches
+from pyneval.model.euclidean_point import Line
+from pyneval.model.swc_node import SwcTree
+from test.test_model.length_metric.tree_loader import TreeTestCase
+
+
+class TestEdgeMatches(TreeTestCase):
+    def test_arrays(self):
+        gold, test = self.load("gold_34_23_10.swc"), self.load("test_34_23_10.swc")
+        edge_matches = EdgeMatches(gold)
+        match_edges, test_match_length = get_match_edges(gold, test, edge_matches=edge_matches)
+        self.assertEqual(len(edge_matches), len(match_edges))
+        self.assertEqual(edge_matches.test_ids.shape, (len(match_edges), 2))
+        self.assertEqual(edge_matches.feet.shape, (len(match_edges), 2, 3))
+        self.assertEqual(set(edge_matches.gold_ids.tolist()), {line_tuple[0].get_id() for line_tuple in match_edges})
+        self.assertAlmostEqual(float(edge_matches.lengths.sum()), test_match_length)
+
+        # the feet lay on the matched test edges
+        for test_ids, feet in zip(edge_matches.test_ids.tolist(), edge_matches.feet):
+            for test_id, foot in zip(test_ids, feet):
+                node = test.node_from_id(test_id)
+                line = Line(e_node_1=node.get_center(), e_node_2=node.parent.get_center())
+                self.assertAlmostEqual(line.get_points()[0].distance_to_point(foot) +
+                                       line.get_points()[1].distance_to_point(foot),
+                                       node.parent_distance())
+
+    def test_swc_list(self):
+        gold, test = self.load("gold_34_23_10.swc"), self.load("test_34_23_10.swc")
+        _, _, edge_matches = length_metric_run(gold, test)
+        lines = edge_matches.to_swc_list()
+        self.assertEqual(len(lines), 4 * len(edge_matches))
+        vertical_tree = SwcTree()
+        vertical_tree.load_list(lines)
+        self.assertEqual(vertical_tree.size(), len(lines))
+        # node 3 is the foot of the child end of the first match
+        self.assertTrue(np.allclose(vertical_tree.xyz[2], edge_matches.feet[0][0]))
+        self.assertEqual(vertical_tree.parent_id(3), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import random
+import unittest
+from pyneval.metric.utils.edge_match_utils import EdgeUseTable
+from pyneval.model.swc_node import SwcTree
+
+
+def overlap(inter1, inter2):
+    # closed intervals, empty ones never overlap
+    if inter1[0] >= inter1[1] or inter2[0] >= inter2[1]:
+        return False
+    return inter1[0] <= inter2[1] and inter2[0] <= inter1[1]
+
+
+class TestEdgeUseTable(unittest.TestCase):
+    def test_random_usage(self):
+        tree = SwcTree()
+        tree.load_list(["1 1 0 0 0 1 -1", "2 1 1 0 0 1 1", "3 1 0 2 0 1 1"])
+        edges = tree.root().children[0].children
+        self.assertEqual(len(edges), 2)
+        table = EdgeUseTable(tree.index_size())
+        used = {edge: [] for edge in edges}
+        rng = random.Random(0)
+        for _ in range(2000):
+            edge = rng.choice(edges)
+            start, end = sorted([round(rng.random(), 2), round(rng.random(), 2)])
+            free = not any(overlap(inter, (start, end)) for inter in used[edge])
+            self.assertEqual(table.is_free(edge, start, end), free)
+            if free and start < end:
+                table.add(edge, start, end)
+                used[edge].append((start, end))
+            self.assertEqual(table.is_used(edge), len(used[edge]) > 0)
+        self.assertFalse(table.is_used(tree.root().children[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from pyneval.metric.utils.edge_match_utils import get_candidate_edges, get_nearby_edges, get_edge_index, \
+    get_idedge_dict, cal_rad_threshold, NearbyEdgeCache
+from test.test_model.length_metric.tree_loader import TreeTestCase
+
+
+class TestGetCandidateEdges(TreeTestCase):
+    def check(self, rad_threshold):
+        gold_swc_tree = self.load("gold_fake_data3.swc")
+        test_swc_tree = self.load("test_fake_data3.swc")
+        # the default backend, rtree is optional
+        idx3d = get_edge_index(test_swc_tree)
+        id_edge_dict = get_idedge_dict(test_swc_tree)
+
+        gold_index, test_edge_ids, distances = get_candidate_edges(gold_swc_tree, test_swc_tree,
+                                                                   rad_threshold, idx3d=idx3d)
+        self.assertGreater(len(gold_index), 0)
+        for node in gold_swc_tree.get_node_list():
+            if node.is_virtual():
+                continue
+            threshold, _ = cal_rad_threshold(rad_threshold, node.radius(), node.radius())
+            expected = [(line_tuple[0].get_id(), dis)
+                        for line_tuple, dis in get_nearby_edges(idx3d, node, id_edge_dict, threshold)
+                        if dis <= threshold]
+            mask = gold_index == node.get_index()
+            self.assertEqual(list(zip(test_edge_ids[mask].tolist(), distances[mask].tolist())), expected)
+
+    def test_relative_threshold(self):
+        self.check(-2.0)
+
+    def test_absolute_threshold(self):
+        self.check(1.5)
+
+    def test_cache(self):
+        gold_swc_tree = self.load("gold_fake_data3.swc")
+        test_swc_tree = self.load("test_fake_data3.swc")
+        candidates = get_candidate_edges(gold_swc_tree, test_swc_tree, -2.0)
+        cache = NearbyEdgeCache(*candidates, id_edge_dict=get_idedge_dict(test_swc_tree),
+                                index_size=gold_swc_tree.index_size())
+        node = gold_swc_tree.root().children[0]
+        threshold = 2.0 * node.radius()
+        nearby_edges = cache.get(node, threshold)
+        self.assertIs(cache.get(node, threshold), nearby_edges)
+        self.assertEqual(cache.hit_rate(), 0.5)
+        # a smaller threshold keeps a prefix of the list
+        smaller = cache.get(node, threshold / 2)
+        self.assertEqual(smaller, nearby_edges[:len(smaller)])
+        self.assertEqual(cache.queries, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
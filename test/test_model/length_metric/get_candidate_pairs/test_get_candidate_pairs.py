@@ -0,0 +1,51 @@
+import unittest
+from pyneval.metric.utils.edge_match_utils import get_candidate_pairs, get_idedge_dict, FLOAT_ERROR
+from pyneval.model.swc_node import SwcTree
+from pyneval.model.euclidean_point import EuclideanPoint, Line
+
+
+class TestGetCandidatePairs(unittest.TestCase):
+    def setUp(self):
+        self.tree = SwcTree()
+        self.tree.load_list(["1 1 0 0 0 1 -1", "2 1 1 0 0 1 1", "3 1 2 0 0 1 2", "4 1 3 0 0 1 3",
+                             "5 1 9 0 0 1 4", "6 1 1 1 0 1 2", "7 1 1 2 0 1 6"])
+        self.edges = get_idedge_dict(self.tree)
+        self.point_a = EuclideanPoint(center=[0.5, 0.3, 0])
+        self.point_b = EuclideanPoint(center=[1.6, 0.2, 0])
+
+    def brute_force(self, set_a, set_b, rad_a, rad_b, gold_length, len_threshold):
+        res = []
+        for i, (edge_a, dis_a) in enumerate(set_a):
+            for j, (edge_b, dis_b) in enumerate(set_b):
+                foot_a = self.point_a.get_closest_point(Line(e_node_1=edge_a[0].get_center(),
+                                                             e_node_2=edge_a[1].get_center()))
+                foot_b = self.point_b.get_closest_point(Line(e_node_1=edge_b[0].get_center(),
+                                                             e_node_2=edge_b[1].get_center()))
+                if dis_a > rad_a or dis_b > rad_b or \
+                        foot_a.distance(foot_b) - gold_length >= len_threshold + FLOAT_ERROR:
+                    continue
+                res.append((dis_a + dis_b, i, j, edge_a[0].get_id(), edge_b[0].get_id()))
+        return [item[3:] for item in sorted(res)]
+
+    def test_order(self):
+        set_a = [(self.edges[nid], dis) for nid, dis in [(2, 0.3), (6, 0.5), (3, 0.5), (7, 1.2)]]
+        set_b = [(self.edges[nid], dis) for nid, dis in [(3, 0.2), (2, 0.4), (4, 0.6), (5, 1.0)]]
+        for rad_a, rad_b, len_threshold in [(2.0, 2.0, 10.0), (1.0, 0.7, 10.0), (2.0, 2.0, 0.5)]:
+            pairs = list(get_candidate_pairs(self.point_a, self.point_b, set_a, set_b,
+                                             rad_a, rad_b, 1.1, len_threshold))
+            self.assertEqual([(edge_a[0].get_id(), edge_b[0].get_id()) for edge_a, _, edge_b, _, _ in pairs],
+                             self.brute_force(set_a, set_b, rad_a, rad_b, 1.1, len_threshold))
+            for edge_a, dis_a, edge_b, dis_b, (foot_a, foot_b) in pairs:
+                self.assertTrue(foot_a.on_line(Line(e_node_1=edge_a[0].get_center(),
+                                                    e_node_2=edge_a[1].get_center())))
+        self.assertEqual(list(get_candidate_pairs(self.point_a, self.point_b, set_a, [], 2.0, 2.0, 1.1, 1.0)), [])
+
+    def test_lazy(self):
+        set_a = [(self.edges[2], 0.1 * k) for k in range(50)]
+        pairs = get_candidate_pairs(self.point_a, self.point_b, set_a, set_a, 10.0, 10.0, 1.1, 100.0)
+        first = next(pairs)
+        self.assertEqual((first[1], first[3]), (0.0, 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from pyneval.metric.length_metric import length_metric, length_metric_bidirectional
+from pyneval.metric.utils.eval_context import EvalContext
+from test.test_model.length_metric.tree_loader import TreeTestCase
+
+
+class TestLengthMetricBidirectional(TreeTestCase):
+    def setUp(self):
+        self.config = {"rad_mode": 1, "rad_threshold": 1, "len_threshold": 0.2, "debug": False}
+
+    def test_same_as_two_runs(self):
+        gold, test = self.load("gold_34_23_10.swc"), self.load("test_34_23_10.swc")
+        res = length_metric_bidirectional(gold, test, self.config)
+        self.assertEqual(res["forward"], length_metric(self.load("gold_34_23_10.swc"),
+                                                       self.load("test_34_23_10.swc"), self.config))
+        self.assertEqual(res["reverse"], length_metric(self.load("test_34_23_10.swc"),
+                                                       self.load("gold_34_23_10.swc"), self.config))
+
+    def test_shared_context(self):
+        gold = self.load("gold_34_23_10.swc")
+        context = EvalContext()
+        first = length_metric_bidirectional(gold, self.load("test_34_23_10.swc"), self.config, context=context)
+        # edge index and id_edge_dict of both trees
+        self.assertEqual((context.builds, context.hits), (4, 0))
+        second = length_metric_bidirectional(gold, self.load("test_34_23_10.swc"), self.config, context=context)
+        self.assertEqual(second, first)
+        # the structures of gold are reused by the second test tree
+        self.assertEqual((context.builds, context.hits), (6, 2))
+
+        index = context.get_edge_index(gold)
+        self.assertIs(context.get_edge_index(gold), index)
+        gold.scale(2, 2, 2)
+        self.assertIsNot(context.get_edge_index(gold), index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from pyneval.metric.length_metric import length_metric
+from test.test_model.length_metric.tree_loader import load_tree
+
+# forward scores since candidate edge pairs are searched best first, the first matching pair of a gold edge
+# is the closest one, so a few gold edges are matched to other test edges than before
+SCORES = [
+    ("ssd_data/gold/a.swc", "ssd_data/test/a.swc", {"recall": 0.67110106, "precision": 0.60263488}),
+    ("ssd_data/gold/b.swc", "ssd_data/test/b.swc", {"recall": 0.64808487, "precision": 0.59202327}),
+    ("ssd_data/gold/c.swc", "ssd_data/test/c.swc", {"recall": 0.69409693, "precision": 0.62968366}),
+    ("ssd_data/gold/f.swc", "ssd_data/test/f.swc", {"recall": 0.63752101, "precision": 0.58206891}),
+    ("geo_metric_data/gold_34_23_10.swc", "geo_metric_data/test_34_23_10.swc",
+     {"recall": 0.43624867, "precision": 0.72558345}),
+]
+
+
+class TestLengthMetricScores(unittest.TestCase):
+    def test_scores(self):
+        config = {"rad_mode": 1, "rad_threshold": 1, "len_threshold": 0.2, "debug": False}
+        for gold_name, test_name, expected in SCORES:
+            res = length_metric(load_tree(gold_name), load_tree(test_name), config)
+            self.assertEqual(res, expected, gold_name)
+
+
+if __name__ == "__main__":
+    unittest.main()
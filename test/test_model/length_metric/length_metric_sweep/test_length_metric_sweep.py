@@ -0,0 +1,41 @@
+import unittest
+from pyneval.metric.length_metric import length_metric, length_metric_sweep, sweep_to_str
+from pyneval.metric.utils.edge_match_utils import get_match_edges, get_nearby_edge_cache
+from test.test_model.length_metric.tree_loader import TreeTestCase
+
+
+class TestLengthMetricSweep(TreeTestCase):
+    def check(self, rad_mode):
+        config = {"rad_mode": rad_mode, "rad_threshold": 1, "len_threshold": 0.2, "debug": False}
+        rad_thresholds, len_thresholds = [0.5, 2.0, 1.0], [0.1, 0.3]
+        sweep_res = length_metric_sweep(self.load("gold_34_23_10.swc"), self.load("test_34_23_10.swc"), config,
+                                        rad_thresholds=rad_thresholds, len_thresholds=len_thresholds)
+        self.assertEqual(len(sweep_res), 6)
+        for row in sweep_res:
+            config["rad_threshold"] = row["rad_threshold"]
+            config["len_threshold"] = row["len_threshold"]
+            self.assertEqual(length_metric(self.load("gold_34_23_10.swc"), self.load("test_34_23_10.swc"), config),
+                             {"recall": row["recall"], "precision": row["precision"]})
+        return sweep_res
+
+    def test_sweep(self):
+        sweep_res = self.check(rad_mode=1)
+        self.check(rad_mode=2)
+        lines = sweep_to_str(sweep_res).splitlines()
+        self.assertEqual(lines[0], "rad_threshold,len_threshold,recall,precision")
+        self.assertEqual(lines[1], "0.5,0.1,{},{}".format(sweep_res[0]["recall"], sweep_res[0]["precision"]))
+
+    def test_cache_counters(self):
+        # the counters of a shared cache cover the last run only, its lists are kept
+        gold, test = self.load("gold_34_23_10.swc"), self.load("test_34_23_10.swc")
+        nearby_edge_cache = get_nearby_edge_cache(gold, test, rad_threshold=-2.0)
+        get_match_edges(gold, test, rad_threshold=-2.0, len_threshold=0.2, nearby_edge_cache=nearby_edge_cache)
+        queries, hits = nearby_edge_cache.queries, nearby_edge_cache.hits
+        get_match_edges(gold, test, rad_threshold=-2.0, len_threshold=0.2, nearby_edge_cache=nearby_edge_cache)
+        self.assertEqual(nearby_edge_cache.queries, queries)
+        self.assertEqual(nearby_edge_cache.hits, queries)
+        self.assertLess(hits, queries)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,21 @@
+import unittest
+from pyneval.metric.length_metric import length_metric
+from test.test_model.length_metric.tree_loader import TreeTestCase
+
+
+class TestScoreCandidatePairs(TreeTestCase):
+    def test_parallel_same_as_serial(self):
+        config = {"rad_mode": 1, "rad_threshold": 1, "len_threshold": 0.2, "debug": False}
+        res = {}
+        for workers in (1, 2):
+            config["workers"] = workers
+            gold_swc_tree = self.load("gold_34_23_10.swc")
+            test_swc_tree = self.load("test_34_23_10.swc")
+            res[workers] = (length_metric(gold_swc_tree, test_swc_tree, config),
+                            length_metric(test_swc_tree, gold_swc_tree, config),
+                            gold_swc_tree.to_str_list(), test_swc_tree.to_str_list())
+        self.assertEqual(res[1], res[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
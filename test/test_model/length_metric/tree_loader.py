@@ -0,0 +1,18 @@
+import os
+import unittest
+from pyneval.model.swc_node import SwcTree
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "data", "test_data")
+
+
+def load_tree(path):
+    """tree of data/test_data/<path>"""
+    tree = SwcTree()
+    tree.load(os.path.join(DATA_DIR, path))
+    return tree
+
+
+class TreeTestCase(unittest.TestCase):
+    """test case which loads trees from data/test_data/geo_metric_data"""
+    def load(self, name):
+        return load_tree(os.path.join("geo_metric_data", name))
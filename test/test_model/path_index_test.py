@@ -0,0 +1,64 @@
+import os
+import random
+import unittest
+from pyneval.model.path_index import PathMarks
+from pyneval.model.swc_node import SwcTree
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "test_data")
+
+
+def route(tree, u, w):
+    # rows from u up to w, w excluded
+    pa = tree.parent_index
+    res = []
+    while u != w and u >= 0:
+        res.append(u)
+        u = int(pa[u])
+    return res
+
+
+class PathIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = SwcTree()
+        self.tree.load(os.path.join(DATA_DIR, "geo_metric_data", "test_34_23_10.swc"))
+        self.tree.get_lca_preprocess()
+        self.path_index = self.tree.get_path_index()
+        rng = random.Random(0)
+        rows = range(self.tree.size())
+        self.pairs = [(rng.choice(rows), rng.choice(rows)) for _ in range(300)]
+
+    def test_lca_and_length(self):
+        tree, path_index = self.tree, self.path_index
+        for u, v in self.pairs:
+            lca = path_index.lca(u, v)
+            lca_id = tree.get_lca(int(tree.ids[u]), int(tree.ids[v]))
+            self.assertEqual(-1 if lca < 0 else tree.ids[lca], lca_id)
+            if lca < 0:
+                self.assertIsNone(path_index.path_length(u, v))
+                continue
+            length = sum(tree.edge_lengths()[route(tree, u, lca) + route(tree, v, lca)])
+            self.assertAlmostEqual(path_index.path_length(u, v), length)
+            self.assertAlmostEqual(path_index.root_dis[u], tree.root_lengths[u])
+
+    def test_marks(self):
+        tree, path_index = self.tree, self.path_index
+        marks = PathMarks(path_index)
+        marked = set()
+        rng = random.Random(1)
+        for u, v in self.pairs:
+            lca = path_index.lca(u, v)
+            self.assertEqual(route(tree, u, lca), path_index.path_rows(u, lca))
+            self.assertEqual(marks.any_marked(u, lca), any(row in marked for row in route(tree, u, lca)))
+            if rng.random() < 0.3:
+                marks.mark_path(v, lca)
+                marked.update(route(tree, v, lca))
+        self.assertEqual(sum(marks.marked), len(marked))
+
+    def test_cache(self):
+        self.assertIs(self.tree.get_path_index(), self.path_index)
+        self.tree.scale(2, 2, 2)
+        self.assertIsNot(self.tree.get_path_index(), self.path_index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import numpy as np
+from pyneval.metric.utils import point_index
+from pyneval.metric.utils.point_index import PointGrid, KDTreeIndex, create_point_index
+from pyneval.metric.utils.point_match_utils import create_node_index, get_swc2swc_dicts
+from pyneval.model.swc_node import SwcTree
+
+
+class PointIndexTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.points = rng.uniform(0, 50, size=(400, 3))
+        # same positions and a far away cluster
+        self.points[:10] = self.points[10:20]
+        self.points[20:30] += 500
+        self.queries = np.r_[rng.uniform(-10, 60, size=(150, 3)), self.points[:5], [[2000.0, 0.0, 0.0]]]
+
+    def brute_force_knn(self, points, k):
+        res = []
+        for q in self.queries:
+            dis = np.sqrt(((points - q) ** 2).sum(axis=1))
+            order = np.lexsort((np.arange(len(points)), dis))[:k]
+            res.append(order.tolist() + [-1] * (k - len(order)))
+        return res
+
+    def check(self, index, points):
+        for k in (1, 5):
+            idx, dis = index.knn(self.queries, k)
+            self.assertEqual(idx.tolist(), self.brute_force_knn(points, k))
+            for q, row, row_dis in zip(self.queries, idx.tolist(), dis.tolist()):
+                for i, d in zip(row, row_dis):
+                    self.assertAlmostEqual(d, np.linalg.norm(points[i] - q) if i >= 0 else np.inf)
+        ids, dis, counts = index.radius(self.queries, 4.0)
+        offsets = np.r_[0, np.cumsum(counts)]
+        for i, q in enumerate(self.queries):
+            expected = np.sqrt(((points - q) ** 2).sum(axis=1))
+            hits = ids[offsets[i]:offsets[i + 1]].tolist()
+            self.assertEqual(sorted(hits), np.flatnonzero(expected <= 4.0).tolist())
+            self.assertTrue(np.all(np.diff(dis[offsets[i]:offsets[i + 1]]) >= 0))
+
+    def test_grid(self):
+        self.check(PointGrid(self.points), self.points)
+
+    def test_flat_and_small(self):
+        flat = self.points.copy()
+        flat[:, 2] = 3.0
+        self.check(PointGrid(flat), flat)
+        self.check(PointGrid(self.points[:3]), self.points[:3])
+        idx, dis = PointGrid(np.zeros((0, 3))).knn(self.queries, 2)
+        self.assertTrue(np.all(idx == -1) and np.all(np.isinf(dis)))
+
+    @unittest.skipIf(point_index.cKDTree is None, "scipy is not installed")
+    def test_kdtree(self):
+        self.check(KDTreeIndex(self.points), self.points)
+
+    def test_backend(self):
+        with self.assertRaises(Exception):
+            create_point_index(self.points, backend="octree")
+        self.assertIsInstance(create_point_index(self.points, backend="grid"), PointGrid)
+
+
+class NodeIndexTest(unittest.TestCase):
+    def test_same_position(self):
+        tree = SwcTree()
+        tree.load_list(["1 1 0 0 0 1 -1", "2 1 0 0 0 1 1", "3 1 4 0 0 1 2"])
+        index, nodes = create_node_index(tree.get_node_list(), backend="grid")
+        # nodes on the same position are kept apart
+        self.assertEqual([node.get_id() for node in nodes], [1, 2, 3])
+        idx, _ = index.knn([[0.0, 0.0, 0.0]], 2)
+        self.assertEqual(sorted(idx[0].tolist()), [0, 1])
+
+        other = SwcTree()
+        other.load_list(["7 1 0 0 0.01 1 -1", "8 1 9 0 0 1 7"])
+        src_tar_dict = get_swc2swc_dicts(other.get_node_list(), tree.get_node_list())
+        self.assertEqual({src.get_id(): None if tar is None else tar.get_id() for src, tar in src_tar_dict.items()},
+                         {7: 1, 8: None})
+
+
+if __name__ == "__main__":
+    unittest.main()
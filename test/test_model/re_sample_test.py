@@ -0,0 +1,53 @@
+import os
+import unittest
+import numpy as np
+from pyneval.model.swc_node import SwcTree
+from pyneval.tools import re_sample
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "test_data")
+
+
+def slow_up_sample(swc_tree, length_threshold):
+    # re_sample on the nodes of a copy, one edge after another
+    up_sampled_swc_tree = swc_tree.get_copy()
+    for node in up_sampled_swc_tree.get_node_list():
+        if node.is_virtual() or node.parent.is_virtual():
+            continue
+        re_sample.re_sample(up_sampled_swc_tree, son=node, pa=node.parent, length_threshold=length_threshold)
+    up_sampled_swc_tree.get_node_list(update=True)
+    return up_sampled_swc_tree
+
+
+class UpSampleTest(unittest.TestCase):
+    def check_same(self, swc_tree, length_threshold):
+        fast = re_sample.up_sample_swc_tree(swc_tree, length_threshold=length_threshold)
+        slow = slow_up_sample(swc_tree, length_threshold)
+        self.assertEqual(fast.to_str_list(), slow.to_str_list())
+        for col in ("ids", "types", "xyz", "radii", "parent_index"):
+            self.assertTrue(np.array_equal(fast.get_columns()[col], slow.get_columns()[col]))
+
+    def test_same_as_re_sample(self):
+        for file_name in ("ssd_data/gold/c.swc", "ssd_data/test/d.swc"):
+            swc_tree = SwcTree()
+            swc_tree.load(os.path.join(DATA_DIR, file_name))
+            for length_threshold in (0.4, 1.0, 3.0):
+                self.check_same(swc_tree, length_threshold)
+
+    def test_radii(self):
+        # radii of the two ends differ, so the pieces of an edge are not halved the same number of times
+        swc_tree = SwcTree()
+        swc_tree.load_list(["1 1 0 0 0 6 -1", "3 2 40 0 0 0.1 1", "2 3 0 25 3 1 1", "7 3 0 40 9 0 2", "5 1 0 0 1 1 -1"])
+        self.check_same(swc_tree, 1.0)
+        up_sampled_swc_tree = re_sample.up_sample_swc_tree(swc_tree, length_threshold=1.0)
+        self.assertEqual(up_sampled_swc_tree.ids[:5].tolist(), [1, 3, 2, 7, 5])
+        self.assertEqual(up_sampled_swc_tree.ids[5], 8)
+        self.assertEqual(swc_tree.size(), 5)
+
+    def test_no_edge(self):
+        swc_tree = SwcTree()
+        swc_tree.load_list(["1 1 0 0 0 1 -1"])
+        self.assertEqual(re_sample.up_sample_swc_tree(swc_tree).size(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import unittest
+import numpy as np
+from pyneval.metric import ssd_metric
+from pyneval.metric.utils.segment_distance import SegmentDistanceIndex, get_tree_segments, iter_edge_samples
+from pyneval.model.euclidean_point import point_segment_matrix
+from pyneval.model.swc_node import SwcTree
+from pyneval.io.read_json import read_json
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "test_data")
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "config")
+
+
+class SegmentDistanceTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.seg_a = rng.uniform(0, 50, size=(300, 3))
+        self.seg_b = self.seg_a + rng.normal(0, 3, size=(300, 3))
+        # long segments, points and a far away cluster
+        self.seg_b[:10] += 40
+        self.seg_b[10:20] = self.seg_a[10:20]
+        self.seg_a[20:30] += 500
+        self.seg_b[20:30] += 500
+        self.queries = np.r_[rng.uniform(-10, 60, size=(200, 3)), self.seg_a[:5], [[2000.0, 0.0, 0.0]]]
+
+    def test_nearest(self):
+        for backend in ("grid", "auto"):
+            index = SegmentDistanceIndex(self.seg_a, self.seg_b, backend=backend)
+            dis, seg = index.nearest(self.queries)
+            expected, _, _ = point_segment_matrix(self.queries, self.seg_a, self.seg_b)
+            self.assertTrue(np.allclose(dis, expected.min(axis=1)))
+            self.assertTrue(np.allclose(expected[np.arange(len(seg)), seg], dis))
+
+    def test_zero_length(self):
+        # most segments are points, the step is taken from the others
+        rng = np.random.RandomState(1)
+        seg_a = rng.uniform(0, 20, size=(100, 3))
+        seg_b = seg_a.copy()
+        seg_b[60:] += rng.normal(0, 1, size=(40, 3))
+        index = SegmentDistanceIndex(seg_a, seg_b)
+        self.assertLessEqual(len(index.owner), 3 * len(seg_a))
+        dis, _ = index.nearest(self.queries)
+        expected, _, _ = point_segment_matrix(self.queries, seg_a, seg_b)
+        self.assertTrue(np.allclose(dis, expected.min(axis=1)))
+
+    def test_empty(self):
+        dis, seg = SegmentDistanceIndex(np.zeros((0, 3)), np.zeros((0, 3))).nearest(self.queries[:3])
+        self.assertTrue(np.all(np.isinf(dis)))
+        self.assertEqual(seg.tolist(), [-1, -1, -1])
+
+    def test_samples(self):
+        swc_tree = SwcTree()
+        swc_tree.load_list(["1 1 0 0 0 1 -1", "2 1 2.5 0 0 2 1", "3 1 2.5 1 0 3 2", "4 1 9 9 9 1 -1"])
+        seg_a, seg_b = get_tree_segments(swc_tree)
+        self.assertEqual(len(seg_a), 3)
+        self.assertEqual(seg_a[2].tolist(), seg_b[2].tolist())
+        chunks = list(iter_edge_samples(swc_tree, sample_step=1.0, chunk_size=2))
+        xyz = np.concatenate([chunk[0] for chunk in chunks])
+        radii = np.concatenate([chunk[1] for chunk in chunks])
+        rows = np.concatenate([chunk[2] for chunk in chunks])
+        # 4 nodes, 2 points on the first edge, none on the second one
+        self.assertEqual(rows.tolist(), [0, 1, 2, 3, -1, -1])
+        self.assertTrue(np.allclose(xyz[4:], [[2.5 / 3 * 2, 0, 0], [2.5 / 3, 0, 0]]))
+        self.assertTrue(np.allclose(radii[4:], [2 - 1 / 3, 2 - 2 / 3]))
+
+    def test_ssd_analytic(self):
+        gold_swc_tree, test_swc_tree = SwcTree(), SwcTree()
+        gold_swc_tree.load(os.path.join(DATA_DIR, "ssd_data", "gold", "c.swc"))
+        test_swc_tree.load(os.path.join(DATA_DIR, "ssd_data", "test", "c.swc"))
+        config = read_json(os.path.join(CONFIG_DIR, "ssd_metric.json"))
+        config.update(engine="analytic", sample_step=0.5)
+        gold_str = gold_swc_tree.to_str_list()
+        res = ssd_metric.ssd_metric(gold_swc_tree, test_swc_tree, config)
+        self.assertEqual(gold_swc_tree.to_str_list(), gold_str)
+
+        # brute force on all samples
+        mse = []
+        for src_tree, tar_tree in ((gold_swc_tree, test_swc_tree), (test_swc_tree, gold_swc_tree)):
+            seg_a, seg_b = get_tree_segments(tar_tree)
+            xyz = np.concatenate([chunk[0] for chunk in iter_edge_samples(src_tree, 0.5)])
+            dis = np.concatenate([point_segment_matrix(xyz[i:i + 2000], seg_a, seg_b)[0].min(axis=1)
+                                  for i in range(0, len(xyz), 2000)])
+            far = dis >= config["ssd_threshold"]
+            mse.append((dis[far].mean(), 1 - far.sum() / len(dis)))
+        self.assertAlmostEqual(res["avg_score"], (mse[0][0] + mse[1][0]) / 2)
+        self.assertAlmostEqual(res["recall"], mse[0][1])
+        self.assertAlmostEqual(res["precision"], mse[1][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
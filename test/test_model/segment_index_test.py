@@ -0,0 +1,107 @@
+import os
+import pickle
+import unittest
+import numpy as np
+from pyneval.metric.utils.segment_index import SegmentGrid, MAX_CELLS_PER_BOX
+from pyneval.metric.utils import edge_match_utils
+from pyneval.metric.utils.edge_match_utils import get_edge_index, get_candidate_edges
+from pyneval.metric.length_metric import length_metric
+from pyneval.model.swc_node import SwcTree
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "test_data")
+
+
+class SegmentGridTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        a = rng.uniform(0, 50, size=(300, 3))
+        b = a + rng.normal(0, 3, size=(300, 3))
+        b[:5] = a[:5] + 40
+        self.mins = np.minimum(a, b)
+        self.maxs = np.maximum(a, b)
+        self.points = rng.uniform(-10, 60, size=(200, 3))
+
+    def brute_force(self, mins, maxs):
+        return [np.flatnonzero(np.all((self.mins <= hi) & (lo <= self.maxs), axis=1)).tolist()
+                for lo, hi in zip(mins, maxs)]
+
+    def test_queries(self):
+        grid = SegmentGrid(self.mins, self.maxs)
+        ids, counts = grid.radius_v(self.points, 2.5)
+        self.assertEqual(len(counts), len(self.points))
+        offsets = np.r_[0, np.cumsum(counts)]
+        expected = self.brute_force(self.points - 2.5, self.points + 2.5)
+        for i in range(len(self.points)):
+            self.assertEqual(ids[offsets[i]:offsets[i + 1]].tolist(), expected[i])
+        box = tuple((self.points[3] - 2.5).tolist() + (self.points[3] + 2.5).tolist())
+        self.assertEqual(grid.intersection(box), expected[3])
+
+    def test_wide(self):
+        # one long diagonal box among small ones is not spread over the cells, nor is a large query
+        rng = np.random.RandomState(1)
+        a = rng.uniform(0, 600, size=(2000, 3))
+        self.mins = np.r_[a, [[0.0, 0.0, 0.0]]]
+        self.maxs = np.r_[a + 1.0, [[600.0, 600.0, 600.0]]]
+        grid = SegmentGrid(self.mins, self.maxs)
+        self.assertEqual(grid.wide_boxes.tolist(), [2000])
+        self.assertLessEqual(len(grid.cell_boxes), MAX_CELLS_PER_BOX * len(self.mins))
+        points = np.r_[rng.uniform(-10, 610, size=(50, 3)), [[300.0, 300.0, 300.0]]]
+        radius = np.r_[np.full(50, 2.0), 400.0]
+        ids, counts = grid.radius_v(points, radius)
+        offsets = np.r_[0, np.cumsum(counts)]
+        expected = self.brute_force(points - radius[:, None], points + radius[:, None])
+        for i in range(len(points)):
+            self.assertEqual(ids[offsets[i]:offsets[i + 1]].tolist(), expected[i])
+        self.assertEqual(counts[-1], len(self.mins))
+
+    def test_pickle(self):
+        grid = SegmentGrid(self.mins, self.maxs, ids=np.arange(len(self.mins)) + 100)
+        copy_grid = pickle.loads(pickle.dumps(grid))
+        self.assertTrue(np.array_equal(copy_grid.radius_v(self.points, 1.0)[0], grid.radius_v(self.points, 1.0)[0]))
+
+    def test_empty(self):
+        grid = SegmentGrid(np.zeros((0, 3)), np.zeros((0, 3)))
+        ids, counts = grid.radius_v(self.points, 1.0)
+        self.assertEqual(len(ids), 0)
+        self.assertEqual(counts.tolist(), [0] * len(self.points))
+
+
+@unittest.skipIf(edge_match_utils.index is None, "rtree is not installed")
+class EdgeIndexBackendTest(unittest.TestCase):
+    def load(self, name):
+        tree = SwcTree()
+        tree.load(os.path.join(DATA_DIR, "geo_metric_data", name))
+        return tree
+
+    def test_same_hits(self):
+        rtree_index = get_edge_index(self.load("test_fake_data3.swc"), backend="rtree")
+        grid = get_edge_index(self.load("test_fake_data3.swc"), backend="grid")
+        points = self.load("gold_fake_data3.swc").xyz
+        rtree_ids, rtree_counts = rtree_index.intersection_v(points - 1.0, points + 1.0)
+        grid_ids, grid_counts = grid.radius_v(points, 1.0)
+        self.assertEqual(rtree_counts.tolist(), grid_counts.tolist())
+        self.assertEqual(sorted(rtree_ids.tolist()), sorted(grid_ids.tolist()))
+
+    def test_same_candidate_order(self):
+        # many edges are at distance 0 of a node, the order of ties must not depend on the backend
+        gold_swc_tree, test_swc_tree = SwcTree(), SwcTree()
+        gold_swc_tree.load(os.path.join(DATA_DIR, "ssd_data", "gold", "b.swc"))
+        test_swc_tree.load(os.path.join(DATA_DIR, "ssd_data", "test", "b.swc"))
+        res = {}
+        for backend in ("grid", "rtree"):
+            idx3d = get_edge_index(gold_swc_tree, backend=backend)
+            res[backend] = get_candidate_edges(test_swc_tree, gold_swc_tree, -2.0, idx3d=idx3d)
+        for grid_array, rtree_array in zip(res["grid"], res["rtree"]):
+            self.assertEqual(grid_array.tolist(), rtree_array.tolist())
+
+    def test_length_metric(self):
+        config = {"rad_mode": 1, "rad_threshold": 1, "len_threshold": 0.2, "debug": False}
+        res = {}
+        for backend in ("grid", "rtree"):
+            config["index_backend"] = backend
+            res[backend] = length_metric(self.load("gold_fake_data3.swc"), self.load("test_fake_data3.swc"), config)
+        self.assertEqual(res["grid"], res["rtree"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pyneval.model.swc_node import SwcTree, SwcNode
+from pyneval.model.euclidean_point import EuclideanPoint
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "test_data")
+
+
+class SwcTreeColumnTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = SwcTree()
+        self.tree.load(os.path.join(DATA_DIR, "geo_metric_data", "gold_fake_data1.swc"))
+
+    def test_columns(self):
+        tree = self.tree
+        self.assertIsNone(tree._nodes)
+        self.assertEqual(len(tree.ids), tree.size())
+        for node in tree.get_node_list():
+            if node.is_virtual():
+                continue
+            self.assertEqual(tree.ids[node._idx], node.get_id())
+            self.assertTrue(np.array_equal(tree.xyz[node._idx], node.get_center()._pos))
+            self.assertEqual(tree.radii[node._idx], node.radius())
+            self.assertEqual(tree.depths[node._idx], node.depth())
+            if node.parent.is_virtual():
+                self.assertEqual(tree.parent_index[node._idx], -1)
+            else:
+                self.assertEqual(tree.parent_index[node._idx], node.parent._idx)
+                self.assertAlmostEqual(node.root_length, node.parent.root_length + node.parent_distance())
+
+    def test_view_write(self):
+        tree = self.tree
+        node = tree.root().children[0]
+        node.set_x(100.0)
+        node._type = 7
+        node.set_r(3.5)
+        self.assertEqual(tree.xyz[node._idx][0], 100.0)
+        self.assertEqual(tree.types[node._idx], 7)
+        self.assertEqual(tree.radii[node._idx], 3.5)
+
+    def test_add_child(self):
+        tree = self.tree
+        pa = tree.root().children[0]
+        son = SwcNode(center=EuclideanPoint(center=[1.0, 2.0, 3.0]), radius=0.5)
+        tree.add_child(pa, son)
+        self.assertEqual(tree.parent_index[son._idx], pa._idx)
+        self.assertEqual(tree.ids[son._idx], son.get_id())
+        self.assertTrue(np.array_equal(tree.xyz[son._idx], [1.0, 2.0, 3.0]))
+
+
+class SwcTreeIdIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = SwcTree()
+        self.tree.load(os.path.join(DATA_DIR, "geo_metric_data", "gold_fake_data1.swc"))
+
+    def test_lookup(self):
+        tree = self.tree
+        for node in tree.get_node_list():
+            self.assertIs(tree.node_from_id(node.get_id()), node)
+            if not node.is_virtual():
+                self.assertEqual(tree.parent_id(node.get_id()), node.get_parent_id())
+                self.assertEqual(tree.child_list(node.get_id()), node.children)
+                self.assertEqual(tree.radius(node.get_id()), node.radius())
+                self.assertEqual(tree.parent_distance(node.get_id()), node.distance(node.parent))
+        self.assertIsNone(tree.node_from_id(10 ** 6))
+
+    def test_mutations(self):
+        tree = self.tree
+        id_node_dict = tree.get_id_node_dict()
+        pa = tree.root().children[0]
+        son = SwcNode(center=EuclideanPoint(center=[1.0, 2.0, 3.0]))
+        tree.add_child(pa, son)
+        self.assertIs(tree.node_from_id(son.get_id()), son)
+        self.assertIsNot(tree.get_id_node_dict(), id_node_dict)
+        self.assertIs(tree.get_id_node_dict()[son.get_id()], son)
+
+        old_id = son.get_id()
+        son.set_id(old_id + 100)
+        self.assertIsNone(tree.node_from_id(old_id))
+        self.assertIs(tree.node_from_id(old_id + 100), son)
+
+        tree.remove_node(son)
+        self.assertIsNone(tree.node_from_id(old_id + 100))
+        self.assertNotIn(old_id + 100, tree.get_id_node_dict())
+
+
+class SwcTreeLengthTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = SwcTree()
+        self.tree.load(os.path.join(DATA_DIR, "geo_metric_data", "gold_fake_data1.swc"))
+
+    def slow_length(self):
+        return sum(node.parent_distance() for node in self.tree.get_node_list(update=True)
+                   if not node.is_virtual() and not node.parent.is_virtual())
+
+    def test_length(self):
+        tree = self.tree
+        self.assertAlmostEqual(tree.length(), self.slow_length())
+        for node in tree.get_node_list():
+            if not node.is_virtual() and not node.parent.is_virtual():
+                self.assertAlmostEqual(tree.edge_lengths()[node.get_index()], node.parent_distance())
+
+    def test_invalidate(self):
+        tree = self.tree
+        tree.length()
+        tree.scale(2, 2, 2)
+        self.assertAlmostEqual(tree.length(), self.slow_length())
+        tree.root().children[0].children[0].set_x(100.0)
+        self.assertAlmostEqual(tree.length(), self.slow_length())
+        tree.remove_node(tree.root().children[0].children[0])
+        self.assertAlmostEqual(tree.length(), self.slow_length())
+        tree.add_child(tree.root().children[0], SwcNode(center=EuclideanPoint(center=[1.0, 2.0, 3.0])))
+        self.assertAlmostEqual(tree.length(), self.slow_length())
+
+
+class SwcTreeCopyTest(unittest.TestCase):
+    def test_copy(self):
+        tree = SwcTree()
+        tree.load(os.path.join(DATA_DIR, "geo_metric_data", "gold_fake_data1.swc"))
+        copy_tree = tree.get_copy()
+        self.assertEqual(copy_tree.to_str_list(), tree.to_str_list())
+        self.assertEqual(copy_tree.id_set, tree.id_set)
+        self.assertTrue(np.array_equal(copy_tree.root_lengths, tree.root_lengths))
+
+        # the copy does not share data with the origin
+        copy_tree.root().children[0].set_x(-100.0)
+        self.assertNotEqual(tree.root().children[0].get_x(), -100.0)
+
+    def test_copy_after_change(self):
+        tree = SwcTree()
+        tree.load(os.path.join(DATA_DIR, "geo_metric_data", "gold_fake_data1.swc"))
+        node = tree.root().children[0].children[0]
+        tree.remove_node(node)
+        copy_tree = tree.get_copy()
+        tree.get_node_list(update=True)
+        self.assertEqual(copy_tree.to_str_list(), tree.to_str_list())
+        self.assertNotIn(node.get_id(), copy_tree.id_set)
+        self.assertEqual(copy_tree.size(), tree.size())
+
+
+class SwcTreeLcaTest(unittest.TestCase):
+    def test_lca_batch(self):
+        tree = SwcTree()
+        tree.load(os.path.join(DATA_DIR, "geo_metric_data", "test_34_23_10.swc"))
+        tree.get_lca_preprocess(max(tree.id_set) + 5)
+        ids = sorted(tree.id_set)
+        u_array = np.repeat(ids[::37], len(ids[::41]))
+        v_array = np.tile(ids[::41], len(ids[::37]))
+        lca = tree.get_lca_batch(u_array, v_array)
+        for u, v, w in zip(u_array.tolist(), v_array.tolist(), lca.tolist()):
+            self.assertEqual(tree.get_lca(u, v), w)
+
+    def test_sparse_ids(self):
+        tree = SwcTree()
+        tree.load_list(["10000000 1 0 0 0 1 -1",
+                        "20000000 1 1 0 0 1 10000000",
+                        "30000000 1 2 0 0 1 20000000",
+                        "40000000 1 1 1 0 1 20000000"])
+        tree.get_lca_preprocess()
+        self.assertEqual(tree.lca_parent.shape[0], tree.size() + 1)
+        self.assertEqual(tree.get_lca(30000000, 40000000), 20000000)
+        self.assertEqual(list(tree.get_lca_batch([30000000, 10000000], [40000000, -1])), [20000000, -1])
+
+        tree.change_root(30000000)
+        self.assertEqual(tree.parent_id(20000000), 30000000)
+        self.assertEqual(tree.parent_id(10000000), 20000000)
+
+
+class SwcNodeLayoutTest(unittest.TestCase):
+    def test_diadem_fields(self):
+        tree = SwcTree()
+        tree.load(os.path.join(DATA_DIR, "geo_metric_data", "gold_fake_data1.swc"))
+        node = tree.root().children[0]
+        self.assertFalse(hasattr(node, "__dict__"))
+        self.assertIsNone(node._diadem)
+        self.assertEqual(node.path_length, 0.0)
+        self.assertIsNone(node.left_trajectory)
+
+        node.path_length += 2.5
+        self.assertEqual(node.path_length, 2.5)
+        self.assertIsNotNone(node._diadem)
+        self.assertEqual(SwcNode(path_length=1.5).path_length, 1.5)
+        self.assertIsNone(SwcNode()._diadem)
+
+
+class SwcTreeLoadListTest(unittest.TestCase):
+    def test_comments_and_missing_parent(self):
+        tree = SwcTree()
+        tree.load_list(["# comment", "", "1 1 0 0 0 1 -1", "2 1 3 4 0 1 1", "3 1 0 0 0 1 9"])
+        self.assertEqual(tree.size(), 3)
+        self.assertEqual(list(tree.parent_index), [-1, 0, -2])
+        self.assertEqual(tree.root_lengths[1], 5.0)
+        self.assertEqual([node.get_id() for node in tree.get_node_list()], [-1, 1, 2])
+
+    def test_same_id(self):
+        tree = SwcTree()
+        with self.assertRaises(Exception):
+            tree.load_list(["1 1 0 0 0 1 -1", "1 1 0 0 0 1 -1"])
+
+
+class SwcTreeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(DATA_DIR, "geo_metric_data", "gold_fake_data1.swc")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_warm_load(self):
+        cold = SwcTree()
+        cold.load(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        warm = SwcTree()
+        warm.load(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(warm.to_str_list(), cold.to_str_list())
+        self.assertTrue(np.array_equal(warm.root_lengths, cold.root_lengths))
+        # changing a cached tree leaves the cache untouched
+        warm.scale(2, 2, 2)
+        again = SwcTree()
+        again.load(self.path, cache_dir=self.cache_dir)
+        self.assertEqual(again.to_str_list(), cold.to_str_list())
+
+
+if __name__ == "__main__":
+    unittest.main()
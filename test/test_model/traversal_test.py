@@ -0,0 +1,61 @@
+import sys
+import unittest
+import numpy as np
+from anytree import PreOrderIter
+from pyneval.model.swc_node import SwcTree
+from pyneval.model.traversal import pre_order, pre_order_index, post_order_index, bfs_index
+from pyneval.metric.utils.bin_utils import convert_to_binarytrees
+from pyneval.tools import re_sample
+
+
+def chain_tree(node_num):
+    tree = SwcTree()
+    tree.load_list(["{} 2 {} {} 0 1 {}".format(i + 1, i * 2.5, np.sin(i), i if i > 0 else -1)
+                    for i in range(node_num)])
+    return tree
+
+
+class TraversalTest(unittest.TestCase):
+    def test_pre_order(self):
+        tree = SwcTree()
+        tree.load_list(["1 1 0 0 0 1 -1", "2 1 1 0 0 1 1", "3 1 2 0 0 1 2", "4 1 0 1 0 1 1", "5 1 0 0 1 1 -1"])
+        self.assertEqual([node.get_id() for node in pre_order(tree.root())],
+                         [node.get_id() for node in PreOrderIter(tree.root())])
+
+    def test_index_orders(self):
+        # rows: 0 -> {1, 3}, 1 -> {2}, 4 is another root, 5 is unlinked
+        parent_index = np.array([-1, 0, 1, 0, -1, -2])
+        self.assertEqual(pre_order_index(parent_index).tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(pre_order_index(parent_index, reverse=True).tolist(), [4, 0, 3, 1, 2])
+        self.assertEqual(post_order_index(parent_index).tolist(), [2, 1, 3, 0, 4])
+        self.assertEqual(bfs_index(parent_index).tolist(), [0, 4, 1, 3, 2])
+        self.assertEqual(bfs_index(parent_index, roots=[1]).tolist(), [1, 2])
+
+        tree = SwcTree()
+        tree.load_list(["1 1 0 0 0 1 -1", "2 1 1 0 0 1 1", "3 1 2 0 0 1 2", "4 1 0 1 0 1 1", "5 1 0 0 1 1 -1"])
+        self.assertEqual(tree.ids[pre_order_index(tree.parent_index)].tolist(),
+                         [node.get_id() for node in pre_order(tree.root())][1:])
+
+    def test_deep_tree(self):
+        # deeper than the recursion limit, other tests may have raised it
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(1000)
+        try:
+            self.check_deep_tree(1100)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+    def check_deep_tree(self, node_num):
+        tree = chain_tree(node_num)
+        self.assertEqual(len(list(pre_order(tree.root()))), node_num + 1)
+        tot_root, bin_root_list = convert_to_binarytrees(tree.root())
+        self.assertEqual(len(bin_root_list), 1)
+        up_sampled_tree = re_sample.up_sample_swc_tree(tree, length_threshold=0.4)
+        self.assertGreater(up_sampled_tree.size(), node_num)
+        tree.change_root(node_num)
+        self.assertEqual(tree.parent_id(1), 2)
+        self.assertEqual(tree.root().children[0].get_id(), node_num)
+
+
+if __name__ == "__main__":
+    unittest.main()